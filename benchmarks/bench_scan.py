@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Micro-benchmark for scan_gitrepos(): scandir-based walker with compiled ignore globs,
+compared to the original os.walk-based walker with per-name fnmatch over every ignore pattern.
+
+A synthetic directory tree is created in a temporary directory. Every <repo-every>'th leaf directory
+is made a "git repository" by adding an (empty) `.git` directory, which is all scan_gitrepos() looks at.
+
+Usage:
+    python benchmarks/bench_scan.py [--depth 4] [--fanout 8] [--ignoreglobs 200] [--repeat 5]
+
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from fnmatch import fnmatch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from git_status_checker.git_status_checker import scan_gitrepos, is_git_workdir_or_repo  # noqa: E402
+
+
+def scan_gitrepos_oswalk(basedirs, ignoreglobs=None, followlinks=False):
+    """ The original os.walk/fnmatch-based implementation of scan_gitrepos(), for comparison. """
+    ignoreglobs = ignoreglobs or []
+    gitrepos = []
+    for basedir in basedirs:
+        for dirpath, dirnames, filenames in os.walk(basedir, followlinks=followlinks):
+            ignoredirs = [dirname for dirname in dirnames if any(fnmatch(dirname, pat) for pat in ignoreglobs)]
+            for dirname in ignoredirs:
+                dirnames.remove(dirname)
+            if is_git_workdir_or_repo(dirpath, dirnames, filenames):
+                gitrepos.append(dirpath)
+                del dirnames[:]
+    return gitrepos
+
+
+def make_tree(basedir, depth, fanout, repo_every=3, files_per_dir=4, seed=0):
+    """ Create a synthetic tree of directories under <basedir>. Returns the number of directories created. """
+    rng = random.Random(seed)
+    ndirs = 0
+    leaves = 0
+    stack = [(basedir, 0)]
+    while stack:
+        dirpath, level = stack.pop()
+        for i in range(files_per_dir):
+            open(os.path.join(dirpath, "file%s.txt" % i), "w").close()
+        if level == depth:
+            leaves += 1
+            if leaves % repo_every == 0:
+                os.mkdir(os.path.join(dirpath, ".git"))
+            continue
+        for i in range(fanout):
+            # A few directories match the ignore globs used in the benchmark:
+            name = rng.choice(["src", "lib", "pkg", "data", "docs"]) + "%s_%s" % (level, i)
+            if rng.random() < 0.05:
+                name = "node_modules" if rng.random() < 0.5 else "build%s" % i
+            subdir = os.path.join(dirpath, name)
+            if os.path.exists(subdir):
+                continue
+            os.mkdir(subdir)
+            ndirs += 1
+            stack.append((subdir, level + 1))
+    return ndirs
+
+
+def make_ignoreglobs(n):
+    """ Return <n> ignore globs; a mix of literal names and wildcard patterns, most of which never match. """
+    ignoreglobs = ["node_modules", "build*", "*.egg-info", "__pycache__"]
+    for i in range(n - len(ignoreglobs)):
+        ignoreglobs.append(("vendor%s" % i) if i % 2 else ("*.tmp%s*" % i))
+    return ignoreglobs[:n]
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--ignoreglobs", type=int, default=200, help="Number of ignore glob patterns.")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="gsc-bench-scan-") as basedir:
+        ndirs = make_tree(basedir, args.depth, args.fanout)
+        ignoreglobs = make_ignoreglobs(args.ignoreglobs)
+        print("Synthetic tree: %s directories, %s ignore globs." % (ndirs, len(ignoreglobs)))
+        t_old, repos_old = best_of(lambda: scan_gitrepos_oswalk([basedir], ignoreglobs), args.repeat)
+        t_new, repos_new = best_of(lambda: scan_gitrepos([basedir], ignoreglobs), args.repeat)
+        assert sorted(repos_old) == sorted(repos_new), "Walkers found different repositories!"
+        print("os.walk + fnmatch:           %8.1f ms  (%s repos)" % (t_old * 1000, len(repos_old)))
+        print("scandir + compiled globs:    %8.1f ms  (%s repos)" % (t_new * 1000, len(repos_new)))
+        print("Speedup: %.1fx" % (t_old / t_new))
+
+
+if __name__ == '__main__':
+    main()
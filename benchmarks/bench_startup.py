@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Startup benchmark: how long it takes to import git_status_checker, and to run a `query` client call.
+
+git-status-checker is run from shell prompts and git hooks, so startup time matters.
+The import time is measured with `python -X importtime`, in a fresh interpreter for each repetition,
+and checked against a budget. It also checks that optional dependencies, which are only needed
+for some options (e.g. yaml for --config, sqlite3 for --history), are not imported at startup.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat 10] [--budget-ms 40]
+
+Exits with status 1 if the median import time exceeds the budget, or if an optional dependency is imported.
+
+"""
+
+import os
+import sys
+import argparse
+import compileall
+import statistics
+import subprocess
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULE = "git_status_checker.git_status_checker"
+
+# Modules that must not be imported by `import git_status_checker.git_status_checker`:
+LAZY_MODULES = ("yaml", "concurrent.futures", "asyncio", "sqlite3", "socketserver", "json", "ctypes", "cProfile")
+
+
+def importtime(module=MODULE):
+    """ Import <module> in a fresh interpreter with `-X importtime`.
+
+    Returns (cumulative import time of <module> in seconds, set of all imported module names).
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                          cwd=ROOT, stderr=subprocess.PIPE, check=True)
+    cumulative, imported = None, set()
+    for line in proc.stderr.decode().splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        if not cumulative_us.strip().isdigit():
+            continue  # Header line.
+        imported.add(name.strip())
+        if name.strip() == module:
+            cumulative = int(cumulative_us) / 1e6
+    return cumulative, imported
+
+
+def query_walltime():
+    """ Return wall time (seconds) of a `git-status-checker query` call when no server is running. """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-m", MODULE, "query", "--socket", os.path.join(ROOT, "no-such-socket"),
+                    "status"], cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def interpreter_walltime():
+    """ Return wall time (seconds) of starting (and exiting) a bare interpreter, for reference. """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10, help="Number of repetitions. Default: 10.")
+    parser.add_argument("--budget-ms", type=float, default=40,
+                        help="Maximum allowed median import time, in milliseconds. Default: 40.")
+    args = parser.parse_args(argv)
+
+    # Make sure the .pyc files are up to date, so compilation is not measured (even with PYTHONDONTWRITEBYTECODE):
+    compileall.compile_dir(os.path.join(ROOT, "git_status_checker"), quiet=1)
+    importtime()  # Warmup.
+    results = [importtime() for _ in range(args.repeat)]
+    import_ms = statistics.median(cumulative for cumulative, _ in results) * 1e3
+    imported = results[-1][1]
+    query_ms = statistics.median(query_walltime() for _ in range(args.repeat)) * 1e3
+    interpreter_ms = statistics.median(interpreter_walltime() for _ in range(args.repeat)) * 1e3
+
+    print("Import %s: %.1f ms (median of %s, budget %.0f ms)" % (MODULE, import_ms, args.repeat, args.budget_ms))
+    print("`git-status-checker query` (no server): %.1f ms wall time (bare interpreter: %.1f ms)"
+          % (query_ms, interpreter_ms))
+    failed = False
+    if import_ms > args.budget_ms:
+        print("FAIL: import time exceeds budget.")
+        failed = True
+    eager = [name for name in LAZY_MODULES if name in imported]
+    if eager:
+        print("FAIL: modules that should only be imported when needed were imported at startup:", ", ".join(eager))
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Create reproducible synthetic "repository farms" for benchmarking git-status-checker.
+
+A farm is a directory containing:
+* `remotes/`: A number of local bare repositories, used as "origin" for the repositories in the farm.
+* `tree/`: The directory to scan. Contains <nrepos> git repositories at varying depths, in the states:
+    clean:         In sync with origin.
+    dirty:         A modified tracked file and an untracked file.
+    ahead:         One local commit that has not been pushed.
+    behind:        The remote-tracking branch is one commit ahead of the local branch.
+    fetchable:     The remote has one commit that has not been fetched (seen by --check-fetch only).
+  plus deep non-repository directory trees, some of which match the ignore globs.
+* `ignore.txt`: Ignore globs for the farm (for --ignorefile).
+
+To make farms with thousands of repositories quickly, a single template repository is created with `git`,
+and every repository in the farm is a copy of the template, with its state set by rewriting ref files.
+The template has commits c1, c2 (changing files), c3 (empty), and c4 (empty, never pushed),
+so the worktree matches the checked-out commit in all states.
+
+Usage:
+    python benchmarks/farm.py <farmdir> [--repos 200] [--seed 0]
+
+"""
+
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import subprocess
+
+STATES = ("clean", "dirty", "ahead", "behind", "fetchable")
+DEFAULT_WEIGHTS = {"clean": 6, "dirty": 1, "ahead": 1, "behind": 1, "fetchable": 1}
+IGNOREGLOBS = ["node_modules", "build*", "*.egg-info", "__pycache__", ".venv"]
+
+
+def git(*args, cwd=None):
+    """ Run git command (quietly, with a fixed identity and dates, so farms are reproducible). """
+    env = dict(os.environ,
+               GIT_AUTHOR_NAME="Farm", GIT_AUTHOR_EMAIL="farm@example.com",
+               GIT_COMMITTER_NAME="Farm", GIT_COMMITTER_EMAIL="farm@example.com",
+               GIT_AUTHOR_DATE="2020-01-01T00:00:00Z", GIT_COMMITTER_DATE="2020-01-01T00:00:00Z")
+    return subprocess.check_output(["git", "-c", "init.defaultBranch=master", *args],
+                                   cwd=cwd, env=env, stderr=subprocess.STDOUT).decode().strip()
+
+
+def make_template(farmdir):
+    """ Create the template repository and template bare remote. Returns dict of commit hashes. """
+    template = os.path.join(farmdir, "template")
+    remote = os.path.join(farmdir, "template-remote.git")
+    git("init", "-q", "--bare", remote)
+    git("init", "-q", template)
+    commits = {}
+    for i, name in enumerate(["c1", "c2", "c3"]):
+        if i < 2:
+            with open(os.path.join(template, "file%s.txt" % i), "w") as fp:
+                fp.write("content %s\n" % i)
+            git("add", ".", cwd=template)
+        git("commit", "-q", "--allow-empty", "-m", name, cwd=template)
+        commits[name] = git("rev-parse", "HEAD", cwd=template)
+    git("remote", "add", "origin", remote, cwd=template)
+    git("push", "-q", "-u", "origin", "master", cwd=template)
+    git("commit", "-q", "--allow-empty", "-m", "c4", cwd=template)
+    commits["c4"] = git("rev-parse", "HEAD", cwd=template)
+    git("reset", "-q", "--soft", commits["c3"], cwd=template)
+    git("gc", "-q", cwd=template)  # pack objects (c4 is kept, since it is still in the reflog).
+    git("status", cwd=template)  # refresh index stat info
+    return template, remote, commits
+
+
+def write_ref(gitdir, ref, sha):
+    path = os.path.join(gitdir, ref)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fp:
+        fp.write(sha + "\n")
+
+
+def set_state(repo, state, commits):
+    """ Put the repository copy <repo> into <state> (see module docstring), without running git. """
+    gitdir = os.path.join(repo, ".git")
+    local, tracking = {
+        "clean": ("c3", "c3"), "dirty": ("c3", "c3"), "ahead": ("c4", "c3"),
+        "behind": ("c2", "c3"), "fetchable": ("c2", "c2"),
+    }[state]
+    write_ref(gitdir, "refs/heads/master", commits[local])
+    write_ref(gitdir, "refs/remotes/origin/master", commits[tracking])
+    if state == "dirty":
+        with open(os.path.join(repo, "file0.txt"), "a") as fp:
+            fp.write("modified\n")
+        open(os.path.join(repo, "untracked.txt"), "w").close()
+
+
+def set_remote_url(repo, url):
+    """ Point the repository's origin remote to <url> (by editing the config file). """
+    config = os.path.join(repo, ".git", "config")
+    with open(config) as fp:
+        lines = fp.readlines()
+    with open(config, "w") as fp:
+        fp.writelines("\turl = %s\n" % url if line.strip().startswith("url = ") else line for line in lines)
+
+
+def make_noise_tree(basedir, rng, depth, fanout):
+    """ Create a tree of non-repository directories (some matching the ignore globs). Returns number of dirs. """
+    ndirs = 0
+    stack = [(basedir, 0)]
+    while stack:
+        dirpath, level = stack.pop()
+        os.makedirs(dirpath, exist_ok=True)
+        ndirs += 1
+        for i in range(3):
+            open(os.path.join(dirpath, "data%s.dat" % i), "w").close()
+        if level < depth:
+            for i in range(fanout):
+                name = rng.choice(IGNOREGLOBS).replace("*", "-out") if rng.random() < 0.1 else "dir%s" % i
+                stack.append((os.path.join(dirpath, name), level + 1))
+    return ndirs
+
+
+def make_farm(farmdir, nrepos=200, nremotes=4, max_depth=4, noise_trees=None, seed=0, weights=None):
+    """ Create a repository farm in <farmdir> (which must not exist or be empty).
+
+    Args:
+        farmdir: Directory to create the farm in.
+        nrepos: Number of repositories.
+        nremotes: Number of (bare) remotes, shared by the repositories.
+        max_depth: Repositories are placed at depths 1 to max_depth below the tree directory.
+        noise_trees: Number of non-repository directory trees (default: nrepos // 10 + 1).
+        seed: Random seed. The same arguments always give the same farm.
+        weights: Dict with relative frequency of each repository state, default DEFAULT_WEIGHTS.
+
+    Returns:
+        Dict describing the farm, which is also saved as `farm.json` in farmdir.
+    """
+    rng = random.Random(seed)
+    weights = weights or DEFAULT_WEIGHTS
+    os.makedirs(farmdir, exist_ok=True)
+    template, template_remote, commits = make_template(farmdir)
+    remotes = []
+    for i in range(nremotes):
+        remote = os.path.join(farmdir, "remotes", "remote%s.git" % i)
+        shutil.copytree(template_remote, remote)
+        remotes.append(remote)
+    tree = os.path.join(farmdir, "tree")
+    repos = {}
+    states = rng.choices(list(weights), weights=list(weights.values()), k=nrepos)
+    for i, state in enumerate(states):
+        depth = rng.randint(1, max_depth)
+        parts = ["group%s" % rng.randrange(max(1, nrepos // 20)) for _ in range(depth - 1)]
+        repo = os.path.join(tree, *parts, "repo%05d" % i)
+        shutil.copytree(template, repo, symlinks=True)
+        set_remote_url(repo, remotes[i % nremotes])
+        set_state(repo, state, commits)
+        repos[repo] = state
+    ndirs = 0
+    for i in range(nrepos // 10 + 1 if noise_trees is None else noise_trees):
+        ndirs += make_noise_tree(os.path.join(tree, "noise%s" % i), rng, depth=3, fanout=4)
+    with open(os.path.join(farmdir, "ignore.txt"), "w") as fp:
+        fp.write("\n".join(IGNOREGLOBS) + "\n")
+    farm = {
+        "farmdir": farmdir, "tree": tree, "ignorefile": os.path.join(farmdir, "ignore.txt"),
+        "nrepos": nrepos, "nremotes": nremotes, "seed": seed, "noise_dirs": ndirs,
+        "states": {state: states.count(state) for state in STATES}, "repos": repos,
+    }
+    with open(os.path.join(farmdir, "farm.json"), "w") as fp:
+        json.dump(farm, fp, indent=1)
+    return farm
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create a synthetic repository farm for benchmarking.")
+    parser.add_argument("farmdir")
+    parser.add_argument("--repos", type=int, default=200)
+    parser.add_argument("--remotes", type=int, default=4)
+    parser.add_argument("--max-depth", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    farm = make_farm(args.farmdir, nrepos=args.repos, nremotes=args.remotes, max_depth=args.max_depth, seed=args.seed)
+    print("Created farm with %s repositories %s and %s non-repository directories in %s" % (
+        farm["nrepos"], farm["states"], farm["noise_dirs"], farm["tree"]), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Benchmark suite: time repository discovery, status checking, and fetch checking separately,
+on synthetic repository farms (see farm.py) of several sizes.
+
+Results are written as JSON, which can be compared between commits:
+
+    git checkout old; python benchmarks/run_benchmarks.py --output old.json
+    git checkout new; python benchmarks/run_benchmarks.py --output new.json
+    python benchmarks/run_benchmarks.py --compare old.json new.json
+
+Farms are created in <workdir> and reused by later runs with the same farm parameters,
+so both runs measure the same repositories. Each benchmark is run once to warm up
+(file system cache, index refresh) and then <repeat> times; the minimum and median are reported.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--scales 50,200,1000] [--phases discovery,status,fetch]
+                                        [--repeat 3] [--workdir DIR] [--output results.json]
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import statistics
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from farm import make_farm  # noqa: E402
+from git_status_checker import git_status_checker as gsc  # noqa: E402
+from git_status_checker.fetch_checker import AsyncFetchChecker, LsRemoteFetchChecker  # noqa: E402
+
+PHASES = ("discovery", "status", "fetch")
+RESULTS_VERSION = 1
+
+
+def get_farm(workdir, nrepos, seed=0):
+    """ Return farm with <nrepos> repositories in <workdir>, creating it if it does not already exist. """
+    farmdir = os.path.join(workdir, "farm-%s-seed%s" % (nrepos, seed))
+    try:
+        with open(os.path.join(farmdir, "farm.json")) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        shutil.rmtree(farmdir, ignore_errors=True)
+    start = time.perf_counter()
+    farm = make_farm(farmdir, nrepos=nrepos, seed=seed)
+    print("Created farm with %s repositories in %.1f s: %s" % (nrepos, time.perf_counter() - start, farmdir),
+          file=sys.stderr)
+    return farm
+
+
+def discovery_benchmarks(farm, ignoreglobs):
+    """ Yield (variant, function) for the discovery phase. Each function returns the number of items found. """
+    for scan_jobs in (1, 8):
+        yield "scan_jobs=%s" % scan_jobs, lambda scan_jobs=scan_jobs: len(
+            gsc.scan_gitrepos([farm["tree"]], ignoreglobs, scan_jobs=scan_jobs))
+
+
+def status_benchmarks(farm, gitrepos):
+    cpus = os.cpu_count() or 1
+    for backend in ("subprocess", "native"):
+        for jobs in sorted({1, cpus}):
+            yield "backend=%s,jobs=%s" % (backend, jobs), lambda backend=backend, jobs=jobs: sum(
+                1 for _, (commitstat, pushstat, _) in gsc.iter_repo_status(gitrepos, jobs=jobs, backend=backend)
+                if commitstat or pushstat)
+
+
+def fetch_benchmarks(farm, gitrepos, fetch_jobs=8):
+    def fetch_subprocess():
+        with ThreadPoolExecutor(fetch_jobs) as executor:
+            return sum(1 for fetchstat in executor.map(gsc.check_fetch_status, gitrepos) if fetchstat)
+
+    def fetch_asyncio():
+        with AsyncFetchChecker(max_concurrency=fetch_jobs, max_per_host=fetch_jobs) as fetch_checker:
+            futures = [fetch_checker.submit(gitrepo) for gitrepo in gitrepos]
+            return sum(1 for future in futures if future.result())
+
+    def fetch_ls_remote():
+        with LsRemoteFetchChecker(max_concurrency=fetch_jobs, max_per_host=fetch_jobs) as fetch_checker:
+            futures = [fetch_checker.submit(gitrepo) for gitrepo in gitrepos]
+            return sum(1 for future in futures if future.result())
+
+    yield "engine=subprocess,fetch_jobs=%s" % fetch_jobs, fetch_subprocess
+    yield "engine=asyncio,fetch_jobs=%s" % fetch_jobs, fetch_asyncio
+    yield "engine=ls-remote,fetch_jobs=%s" % fetch_jobs, fetch_ls_remote
+
+
+def measure(func, repeat):
+    """ Run <func> once to warm up, then <repeat> times. Returns (timings, result). """
+    result = func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+def environment():
+    """ Return dict describing the code and machine being benchmarked. """
+    repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def output(cmd):
+        try:
+            return subprocess.check_output(cmd, cwd=repodir, stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        "commit": output(["git", "rev-parse", "HEAD"]),
+        "describe": output(["git", "describe", "--always", "--dirty"]),
+        "git_version": output(["git", "--version"]),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def run(scales, phases, repeat, workdir):
+    results = []
+    for nrepos in scales:
+        farm = get_farm(workdir, nrepos)
+        ignoreglobs = gsc.read_ignorefile(farm["ignorefile"])
+        gitrepos = gsc.scan_gitrepos([farm["tree"]], ignoreglobs)
+        if len(gitrepos) != nrepos:
+            raise RuntimeError("Expected %s repositories in farm, found %s." % (nrepos, len(gitrepos)))
+        benchmarks = {
+            "discovery": lambda: discovery_benchmarks(farm, ignoreglobs),
+            "status": lambda: status_benchmarks(farm, gitrepos),
+            "fetch": lambda: fetch_benchmarks(farm, gitrepos),
+        }
+        for phase in phases:
+            for variant, func in benchmarks[phase]():
+                timings, count = measure(func, repeat)
+                result = {
+                    "scale": nrepos, "phase": phase, "variant": variant, "count": count,
+                    "min": min(timings), "median": statistics.median(timings), "timings": timings,
+                }
+                results.append(result)
+                print("%6s repos  %-10s %-34s %9.1f ms  (median %.1f ms, %s found)" % (
+                    nrepos, phase, variant, result["min"] * 1000, result["median"] * 1000, count),
+                    file=sys.stderr)
+    return results
+
+
+def compare(old_fn, new_fn, threshold=0.1):
+    """ Print comparison of two results files. Returns number of benchmarks that got slower by > threshold. """
+    with open(old_fn) as fp:
+        old = json.load(fp)
+    with open(new_fn) as fp:
+        new = json.load(fp)
+    print("Old: %s (%s)" % (old["environment"].get("describe"), old_fn))
+    print("New: %s (%s)" % (new["environment"].get("describe"), new_fn))
+    old_results = {(r["scale"], r["phase"], r["variant"]): r for r in old["results"]}
+    slower = 0
+    for r in new["results"]:
+        key = (r["scale"], r["phase"], r["variant"])
+        if key not in old_results:
+            print("%6s repos  %-10s %-34s %9s -> %9.1f ms" % (key + ("-", r["min"] * 1000)))
+            continue
+        ratio = r["min"] / old_results[key]["min"]
+        flag = " SLOWER" if ratio > 1 + threshold else (" faster" if ratio < 1 - threshold else "")
+        slower += ratio > 1 + threshold
+        print("%6s repos  %-10s %-34s %9.1f -> %9.1f ms  %5.2fx%s" % (
+            key + (old_results[key]["min"] * 1000, r["min"] * 1000, ratio, flag)))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark git-status-checker on synthetic repository farms.")
+    parser.add_argument("--scales", default="50,200,1000",
+                        help="Comma-separated list of farm sizes (number of repositories).")
+    parser.add_argument("--phases", default=",".join(PHASES),
+                        help="Comma-separated list of phases to benchmark: %s." % ", ".join(PHASES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workdir", help="Directory for farms. Default: a temporary directory, removed afterwards.")
+    parser.add_argument("--output", help="Write JSON results to this file (default: stdout).")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="Compare two results files instead of running benchmarks. "
+                             "Exit status is 1 if any benchmark got more than 10%% slower.")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare) else 0)
+
+    scales = [int(scale) for scale in args.scales.split(",")]
+    phases = args.phases.split(",")
+    for phase in phases:
+        if phase not in PHASES:
+            parser.error("Unknown phase %r" % phase)
+    if args.workdir:
+        results = run(scales, phases, args.repeat, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="gsc-bench-") as workdir:
+            results = run(scales, phases, args.repeat, workdir)
+    data = {"version": RESULTS_VERSION, "environment": environment(), "results": results}
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(data, fp, indent=1)
+    else:
+        json.dump(data, sys.stdout, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,479 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Asyncio-based engine for checking if remotes have changes that can be fetched (`--check-fetch`).
+
+All `git fetch --dry-run` calls are made from a single asyncio event loop running in a background thread,
+so the number of concurrent fetches is independent of the number of status-checking worker threads.
+Fetches are limited by:
+* A global concurrency cap (max number of concurrent `git fetch` processes).
+* A per-host concurrency cap, so we don't hammer a single (e.g. internal) git server.
+  The per-host slot is acquired before the global slot, so fetches waiting for a busy host
+  do not hold global slots that fetches to other hosts could use.
+* Local git processes (e.g. `git ls-remote --get-url` to find the remote) are limited by a separate cap
+  of the same size, so submitting many repositories at once does not start a process for each of them.
+* A per-repository timeout; a fetch that does not complete in time is killed and reported as timed out.
+
+Usage:
+
+    with AsyncFetchChecker(max_concurrency=8, max_per_host=2, timeout=60) as fetch_checker:
+        future = fetch_checker.submit(gitrepo)   # concurrent.futures.Future
+        fetch_status = future.result()
+
+LsRemoteFetchChecker (`--fetch-engine ls-remote`) has the same interface, but instead of fetching in each
+repository, it runs one `git ls-remote --heads` per unique remote URL, and compares the advertised
+branch heads with each repository's remote-tracking refs. When many repositories are clones of the
+same few remotes, this reduces the number of network round-trips from one per repository to one per remote.
+
+"""
+
+import os
+import json
+import time
+import asyncio
+import threading
+import subprocess
+from urllib.parse import urlsplit
+import logging
+logger = logging.getLogger(__name__)
+
+if __package__:
+    from . import gitdir
+else:
+    import gitdir
+
+
+FETCH_COMMAND = ["git", "fetch", "--dry-run"]
+
+
+def fetch_error_message(exc):
+    """ Return the fetch-status message used when `git fetch --dry-run` fails with <exc>. """
+    return str(exc) + " Maybe failed auth? Please do a manual `git fetch` to debug the issue."
+
+
+def fetch_timeout_message(timeout):
+    """ Return the fetch-status message used when `git fetch --dry-run` did not complete within <timeout>. """
+    return "Timed out: `git fetch --dry-run` did not complete within %s seconds." % (timeout,)
+
+
+def remote_host(url):
+    """ Return the host part of a git remote URL, or "" if the remote is local.
+
+    Examples:
+        https://github.com/scholer/git-status-checker.git  ->  github.com
+        ssh://git@git.example.com:2222/repo.git             ->  git.example.com
+        git@github.com:scholer/git-status-checker.git       ->  github.com   (scp-like syntax)
+        /path/to/repo.git, ../repo.git, file:///repo.git    ->  ""
+    """
+    url = url.strip()
+    if "://" in url:
+        if url.startswith("file://"):
+            return ""
+        return (urlsplit(url).hostname or "").lower()
+    # scp-like syntax, "[user@]host:path". Git only considers it scp-like if there is no slash before the colon.
+    # (Windows drive letters, "C:/path", are local paths.)
+    host, sep, _ = url.partition(":")
+    if sep and "/" not in host and "\\" not in host and len(host) > 1:
+        return host.rpartition("@")[2].lower()
+    return ""
+
+
+class AsyncFetchChecker:
+    """ Check fetch status for many repositories concurrently, using asyncio subprocesses.
+
+    The event loop runs in a daemon thread, started by start() (or by entering the context manager).
+    submit() can be called from any thread and returns a concurrent.futures.Future
+    whose result is the fetch status, exactly as returned by check_repo_status(fetch=True):
+    the `git fetch --dry-run` output (empty string if there is nothing to fetch),
+    or an error/timeout message.
+    """
+
+    def __init__(self, max_concurrency=8, max_per_host=2, timeout=None, on_spawn=None, on_complete=None):
+        """
+        Args:
+            max_concurrency: Maximum number of concurrent `git fetch` processes (globally).
+            max_per_host: Maximum number of concurrent `git fetch` processes per remote host.
+                Local remotes (paths and file:// URLs) are only limited by the global cap.
+            timeout: Per-repository timeout, in seconds. None means no timeout.
+            on_spawn: Optional callable, called (without arguments) every time a subprocess is started.
+            on_complete: Optional callable, called as on_complete("fetch", gitrepo, seconds) when a
+                `git fetch --dry-run` completes, with the time it took (not counting time spent waiting
+                for a free slot), e.g. timings.Timings.record.
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_per_host = max(1, max_per_host)
+        self.timeout = timeout
+        self.on_spawn = on_spawn
+        self.on_complete = on_complete
+        self._loop = None
+        self._thread = None
+        self._global_semaphore = None
+        self._local_semaphore = None
+        self._host_semaphores = {}
+
+    def start(self):
+        """ Start the event loop in a background thread. """
+        if self._thread is not None:
+            return
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="AsyncFetchChecker", daemon=True)
+        self._thread.start()
+        # Semaphores must be created by the loop that uses them (required for Python < 3.10):
+        asyncio.run_coroutine_threadsafe(self._setup(), self._loop).result()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def _setup(self):
+        self._global_semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._local_semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def close(self):
+        """ Cancel outstanding fetches, stop the event loop and wait for the background thread to exit. """
+        if self._thread is None:
+            return
+
+        async def _cancel_all():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(_cancel_all(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._thread = None
+        self._loop = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, gitrepo):
+        """ Schedule a fetch check for <gitrepo> and return a concurrent.futures.Future with the fetch status. """
+        if self._thread is None:
+            raise RuntimeError("AsyncFetchChecker has not been started.")
+        return asyncio.run_coroutine_threadsafe(self.check_fetch(gitrepo), self._loop)
+
+    def _host_semaphore(self, host):
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.max_per_host)
+        return self._host_semaphores[host]
+
+    async def _acquire_remote_slot(self, host):
+        """ Acquire a slot for a network operation against <host> (None or "" for local remotes).
+
+        The per-host slot is acquired first, and then the global slot, so tasks waiting for a busy host
+        do not block operations against other hosts.
+        Returns the host semaphore (or None), which must be passed to _release_remote_slot().
+        """
+        host_semaphore = self._host_semaphore(host) if host else None
+        if host_semaphore is not None:
+            await host_semaphore.acquire()
+        try:
+            await self._global_semaphore.acquire()
+        except BaseException:
+            if host_semaphore is not None:
+                host_semaphore.release()
+            raise
+        return host_semaphore
+
+    def _release_remote_slot(self, host_semaphore):
+        self._global_semaphore.release()
+        if host_semaphore is not None:
+            host_semaphore.release()
+
+    async def _run_git(self, args, cwd, timeout=None):
+        """ Run `git <args>` in <cwd> and return (returncode, output), with stderr merged into output.
+
+        Raises asyncio.TimeoutError if the process does not complete within <timeout> seconds
+        (the process is killed before raising).
+        """
+        if self.on_spawn is not None:
+            self.on_spawn()
+        proc = await asyncio.create_subprocess_exec(
+            "git", *args, cwd=cwd,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+        )
+        try:
+            output, _ = await asyncio.wait_for(proc.communicate(), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            raise
+        return proc.returncode, output
+
+    async def remote_url(self, gitrepo):
+        """ Return the URL of the remote that `git fetch` will use by default for <gitrepo> (or "" if none).
+
+        `git ls-remote --get-url` resolves the default remote of the current branch (falling back to origin),
+        and applies any `url.<base>.insteadOf` rewrites. It does not make any network requests.
+        """
+        async with self._local_semaphore:
+            returncode, output = await self._run_git(["ls-remote", "--get-url"], cwd=gitrepo)
+        if returncode != 0:
+            return ""
+        return output.decode(errors="replace").strip()
+
+    async def check_fetch(self, gitrepo):
+        """ Return the fetch status for <gitrepo> (see class docstring). """
+        host = remote_host(await self.remote_url(gitrepo))
+        host_semaphore = await self._acquire_remote_slot(host)
+        start = time.perf_counter()
+        try:
+            logger.debug("Checking fetch status for %s (remote host %r)", gitrepo, host)
+            returncode, output = await self._run_git(FETCH_COMMAND[1:], cwd=gitrepo, timeout=self.timeout)
+        except asyncio.TimeoutError:
+            logger.info("%s: `git fetch --dry-run` timed out after %s seconds.", gitrepo, self.timeout)
+            return fetch_timeout_message(self.timeout)
+        finally:
+            self._release_remote_slot(host_semaphore)
+            if self.on_complete is not None:
+                self.on_complete("fetch", gitrepo, time.perf_counter() - start)
+        if returncode != 0:
+            return fetch_error_message(subprocess.CalledProcessError(returncode, FETCH_COMMAND))
+        return output.decode().strip()
+
+
+class LsRemoteError(Exception):
+    """ Raised when `git ls-remote` fails. """
+
+
+def map_refspec(refspec, ref):
+    """ Return the local ref that remote <ref> is fetched into by fetch <refspec>, or None if it is not fetched.
+
+    Example:
+        map_refspec("+refs/heads/*:refs/remotes/origin/*", "refs/heads/master")  ->  "refs/remotes/origin/master"
+    A refspec without a destination (e.g. "refs/heads/master") only updates FETCH_HEAD, so it maps no refs.
+    """
+    src, _, dst = refspec.lstrip("+").partition(":")
+    matched = _match_ref_pattern(src, ref)
+    if not dst or matched is None:
+        return None
+    return dst.replace("*", matched, 1)
+
+
+def _match_ref_pattern(pattern, ref):
+    """ Return the part of <ref> matched by the "*" in refspec side <pattern> ("" if it has no "*"), or None. """
+    if "*" not in pattern:
+        return "" if ref == pattern else None
+    prefix, _, suffix = pattern.partition("*")
+    if ref.startswith(prefix) and ref.endswith(suffix) and len(ref) >= len(prefix) + len(suffix):
+        return ref[len(prefix):len(ref) - len(suffix)]
+    return None
+
+
+def compare_refs(advertised, local, refspecs):
+    """ Return list of (old, new, remote ref, local ref) for the branches in <advertised> that would be fetched.
+
+    Args:
+        advertised: Dict {ref: hash} of the refs advertised by the remote (`git ls-remote`).
+        local: Dict {ref: hash} of the local remote-tracking refs.
+        refspecs: List of the remote's fetch refspecs. As with `git fetch`, a ref is fetched into the local ref
+            of every refspec that matches it, unless it matches a negative refspec (e.g. "^refs/heads/tmp/*").
+    old is None for new branches. Branches deleted on the remote are not included (`git fetch` does not
+    remove them either, unless pruning).
+    """
+    negative = [refspec[1:] for refspec in refspecs if refspec.startswith("^")]
+    positive = [refspec for refspec in refspecs if not refspec.startswith("^")]
+    updates = []
+    for ref, new in sorted(advertised.items()):
+        if any(_match_ref_pattern(pattern, ref) is not None for pattern in negative):
+            continue
+        local_refs = []
+        for refspec in positive:
+            local_ref = map_refspec(refspec, ref)
+            if local_ref is not None and local_ref not in local_refs:
+                local_refs.append(local_ref)
+        updates.extend((local.get(local_ref), new, ref, local_ref) for local_ref in local_refs
+                       if local.get(local_ref) != new)
+    return updates
+
+
+def format_updates(url, updates):
+    """ Return fetch-status message for <updates> from compare_refs(), similar to `git fetch --dry-run` output. """
+    if not updates:
+        return ""
+    lines = ["From %s" % url]
+    for old, new, ref, local_ref in updates:
+        src, dst = _short_ref(ref), _short_ref(local_ref)
+        if old is None:
+            lines.append(" * %-17s %-10s -> %s" % ("[new branch]", src, dst))
+        else:
+            lines.append("   %-17s %-10s -> %s" % ("%s..%s" % (old[:7], new[:7]), src, dst))
+    return "\n".join(lines)
+
+
+def _short_ref(ref):
+    for prefix in ("refs/heads/", "refs/remotes/", "refs/"):
+        if ref.startswith(prefix):
+            return ref[len(prefix):]
+    return ref
+
+
+class LsRemoteFetchChecker(AsyncFetchChecker):
+    """ Check fetch status with one `git ls-remote --heads` per unique remote URL (`--fetch-engine ls-remote`).
+
+    For each repository, the URL of the remote that `git fetch` would use by default is resolved, and the
+    branch heads advertised by that URL are compared with the repository's remote-tracking refs
+    (using all of the remote's fetch refspecs). `git ls-remote` is only run once per URL per run, in the first
+    repository that uses it. With <ttl>, the advertised refs are also cached in <cache_file> across runs.
+
+    Limitations compared to `git fetch --dry-run`: only branches (refs/heads) are compared,
+    so new tags are not reported.
+    The fetch status message is similar to `git fetch --dry-run` output.
+    """
+
+    def __init__(self, max_concurrency=8, max_per_host=2, timeout=None, on_spawn=None, on_complete=None,
+                 cache_file=None, ttl=0):
+        """
+        Args:
+            max_concurrency, max_per_host, timeout, on_spawn, on_complete: As for AsyncFetchChecker,
+                but limiting/timing `git ls-remote` processes.
+            cache_file: File to cache advertised refs in, across runs (only used if ttl > 0).
+            ttl: Number of seconds advertised refs from <cache_file> can be reused. 0 means only cache for this run.
+        """
+        super().__init__(max_concurrency=max_concurrency, max_per_host=max_per_host, timeout=timeout,
+                         on_spawn=on_spawn, on_complete=on_complete)
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.ls_remote_count = 0
+        self._advertised = {}  # url -> asyncio.Task, resolving to dict {ref: hash}.
+        self._disk_cache = {}  # url -> {"time": time.time(), "refs": {ref: hash}}
+
+    def start(self):
+        if self.cache_file and self.ttl > 0:
+            try:
+                with open(self.cache_file) as fp:
+                    self._disk_cache = json.load(fp)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as exc:
+                logger.warning("Could not read ls-remote cache %s: %s", self.cache_file, exc)
+        super().start()
+
+    def close(self):
+        super().close()
+        if self.cache_file and self.ttl > 0:
+            now = time.time()
+            data = {url: entry for url, entry in self._disk_cache.items() if now - entry["time"] < self.ttl}
+            tmpfn = "%s.%s.tmp" % (self.cache_file, os.getpid())
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+                with open(tmpfn, "w") as fp:
+                    json.dump(data, fp, separators=(",", ":"))
+                os.replace(tmpfn, self.cache_file)
+            except OSError as exc:
+                logger.warning("Could not write ls-remote cache %s: %s", self.cache_file, exc)
+        logger.info("Checked fetch status with %s `git ls-remote` calls for %s remotes.",
+                    self.ls_remote_count, len(self._advertised))
+
+    def default_remote(self, gitrepo):
+        """ Return (remote name, list of fetch refspecs) for the remote `git fetch` uses by default in <gitrepo>.
+
+        That is the upstream remote of the checked-out branch, falling back to "origin".
+        Returns (None, None) if the remote does not exist, or is the local repository itself (".").
+        """
+        gdir = gitdir.resolve_gitdir(gitrepo)
+        if gdir is None:
+            return None, None
+        remote = gitdir.default_remote(gdir)
+        config = gitdir.read_config(os.path.join(gitdir.resolve_commondir(gdir), "config"), multivalued=True)
+        remote_config = config.get(("remote", remote))
+        if remote == "." or not remote_config or not remote_config.get("url"):
+            return None, None
+        return remote, remote_config.get("fetch") or ["+refs/heads/*:refs/remotes/%s/*" % remote]
+
+    async def local_refs(self, gitrepo, refspecs):
+        """ Return dict {ref: hash} with the refs in <gitrepo> that fetch <refspecs> can update. """
+        patterns = []
+        for refspec in refspecs:
+            dst = refspec.partition(":")[2]
+            if dst and not refspec.startswith("^"):
+                # for-each-ref patterns match up to a "/", so use the directory above the "*" (if any):
+                patterns.append(dst.partition("*")[0].rpartition("/")[0] + "/" if "*" in dst else dst)
+        if not patterns:
+            return {}
+        async with self._local_semaphore:
+            returncode, output = await self._run_git(
+                ["for-each-ref", "--format=%(objectname) %(refname)"] + patterns, cwd=gitrepo)
+        if returncode != 0:
+            return {}
+        return dict(line.split(" ", 1)[::-1] for line in output.decode(errors="replace").splitlines())
+
+    async def advertised_refs(self, gitrepo, url):
+        """ Return dict {ref: hash} of the branches advertised by <url>, running `git ls-remote` at most once. """
+        if url not in self._advertised:
+            self._advertised[url] = asyncio.ensure_future(self._ls_remote(gitrepo, url))
+        return await asyncio.shield(self._advertised[url])
+
+    async def _ls_remote(self, gitrepo, url):
+        cached = self._disk_cache.get(url)
+        if cached is not None and self.ttl > 0 and time.time() - cached["time"] < self.ttl:
+            logger.debug("Using cached `git ls-remote` result for %s", url)
+            return cached["refs"]
+        host_semaphore = await self._acquire_remote_slot(remote_host(url))
+        try:
+            logger.debug("Running `git ls-remote --heads %s` in %s", url, gitrepo)
+            self.ls_remote_count += 1
+            returncode, output = await self._run_git(["ls-remote", "--heads", url], cwd=gitrepo,
+                                                     timeout=self.timeout)
+        finally:
+            self._release_remote_slot(host_semaphore)
+        if returncode != 0:
+            raise LsRemoteError(output.decode(errors="replace").strip()
+                                or "`git ls-remote %s` failed with exit status %s." % (url, returncode))
+        refs = {}
+        for line in output.decode(errors="replace").splitlines():
+            objectname, _, ref = line.partition("\t")
+            refs[ref] = objectname
+        self._disk_cache[url] = {"time": time.time(), "refs": refs}
+        return refs
+
+    async def check_fetch(self, gitrepo):
+        """ Return the fetch status for <gitrepo> (see class docstring). """
+        remote, refspecs = self.default_remote(gitrepo)
+        if remote is None:
+            return ""  # Nothing to fetch from, like `git fetch --dry-run` without a remote.
+        start = time.perf_counter()
+        try:
+            async with self._local_semaphore:
+                returncode, output = await self._run_git(["ls-remote", "--get-url", remote], cwd=gitrepo)
+            url = output.decode(errors="replace").strip()
+            if returncode != 0 or not url:
+                return ""
+            if not remote_host(url) and "://" not in url:
+                url = os.path.abspath(os.path.join(gitrepo, url))  # Relative paths are relative to the worktree.
+            try:
+                advertised = await self.advertised_refs(gitrepo, url)
+            except asyncio.TimeoutError:
+                logger.info("%s: `git ls-remote %s` timed out after %s seconds.", gitrepo, url, self.timeout)
+                return "Timed out: `git ls-remote` did not complete within %s seconds." % (self.timeout,)
+            except LsRemoteError as exc:
+                return fetch_error_message(exc)
+            updates = compare_refs(advertised, await self.local_refs(gitrepo, refspecs), refspecs)
+        finally:
+            if self.on_complete is not None:
+                self.on_complete("fetch", gitrepo, time.perf_counter() - start)
+        return format_updates(url, updates)
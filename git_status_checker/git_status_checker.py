@@ -41,18 +41,34 @@ Git status and --porcelain documentation:
 import sys
 import os
 import re
-import yaml
-import glob
-import shlex
+import time
+import queue
 import argparse
+import functools
+import threading
 import subprocess
-from fnmatch import fnmatch
+import collections
+import zlib
+from fnmatch import translate
 # from collections import defaultdict
 # from datetime import datetime, timedelta
 import logging
 logger = logging.getLogger(__name__)
 
 
+def import_submodule(name):
+    """ Import and return the git_status_checker submodule <name>, e.g. "fetch_checker".
+
+    Optional features live in separate modules, which are only imported when they are used.
+    This works both when git_status_checker is installed as a package,
+    and when git_status_checker.py is executed directly as a script.
+    """
+    import importlib
+    if __package__:
+        return importlib.import_module("." + name, __package__)
+    return importlib.import_module(name)
+
+
 def parse_args(argv=None):
     """Parse command line arguments.
 
@@ -71,10 +87,20 @@ def parse_args(argv=None):
     parser.add_argument("--verbose", "-v", action="count", help="Increase verbosity.")
     parser.add_argument("--testing", action="store_true", help="Run app in simple test mode.")
     parser.add_argument("--loglevel", default=logging.WARNING, help="Set logging output threshold level.")
-    # parser.add_argument("--profile", "-p", action="store_true", help="Profile app execution.")
-    # parser.add_argument("--print-profile", "-P", action="store_true", help="Print profiling statistics.")
-    # parser.add_argument("--profile-outputfn", default="scaffold_rotation.profile",
-    #                     help="Save profiling statistics to this file.")
+    parser.add_argument("--profile", "-p", action="store_true",
+                        help="Profile app execution with cProfile, saving the statistics to --profile-outputfn. "
+                        "Only the main thread is profiled; use `--jobs 1` to include the status checks.")
+    parser.add_argument("--print-profile", "-P", action="store_true",
+                        help="Print profiling statistics (implies --profile).")
+    parser.add_argument("--profile-outputfn", default="git-status-checker.profile",
+                        help="Save profiling statistics to this file. Default: git-status-checker.profile")
+    parser.add_argument("--timings", action="store_true",
+                        help="Print a timings report (to stderr) after checking: walk time (wall time until "
+                        "discovery completed, which overlaps with checking) and number of "
+                        "directories listed, status and fetch latency per repository (p50, p95, max), "
+                        "the slowest repositories, and the number of subprocesses started.")
+    parser.add_argument("--slowest", type=int, default=10,
+                        help="Number of slowest repositories to list in the --timings report. Default: 10.")
 
     parser.add_argument("--recursive", action="store_true",
                         help="Scan the given basedirs recursively. This is the default.")
@@ -86,7 +112,63 @@ def parse_args(argv=None):
                         help="Follow symbolic links when walking/scanning the basedirs.")
     parser.add_argument("--no-followlinks", action="store_false", dest="followlinks")
 
+    parser.add_argument("--scan-jobs", type=int, default=1,
+                        help="Number of directories to list concurrently when scanning basedirs for git repositories. "
+                        "Basedirs and sub-directories are then walked in parallel, which can be much faster "
+                        "on network file systems, where latency rather than CPU dominates. "
+                        "This is independent of --jobs, which sets the number of concurrent status checks. "
+                        "Default: 1 (scan serially).")
+
+    parser.add_argument("--scan-cache", action="store_true",
+                        help="Cache the directory listings made when scanning basedirs for git repositories. "
+                        "On repeated runs, only directories whose modification time has changed are listed again, "
+                        "which can be much faster, e.g. on network file systems. "
+                        "The cache is invalidated if the ignore globs change.")
+    parser.add_argument("--rescan", action="store_true",
+                        help="Do a full scan of all basedirs, ignoring (and replacing) any cached directory listings. "
+                        "Implies --scan-cache.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Remember each repository's status between runs, and only run `git status` for "
+                        "repositories whose index, HEAD, checked-out branch ref, packed-refs, config, "
+                        "upstream ref, or top-level directory have changed since the last run. "
+                        "Note that modifying an already-tracked file does not change any of these, "
+                        "so use --max-age to make sure all repositories are re-checked regularly.")
+    parser.add_argument("--max-age", type=float, default=24*3600,
+                        help="With --incremental, always re-check repositories whose cached status is older "
+                        "than this many seconds. Default: 86400 (one day).")
+    parser.add_argument("--cache-dir",
+                        help="Directory for cache files. Default is `~/.cache/git-status-checker` "
+                        "(or `%%LOCALAPPDATA%%\\git-status-checker` on Windows).")
+    parser.add_argument("--history", action="store_true",
+                        help="Record the status and check time of every repository in a local SQLite database "
+                        "(written in one transaction at the end of the run). "
+                        "Use `git-status-checker report` to list long-standing dirty repositories, "
+                        "newly dirty repositories, and the slowest repositories over time.")
+    parser.add_argument("--history-file",
+                        help="History database for --history. Default: history.sqlite in --cache-dir.")
+
     parser.add_argument("--ignore-untracked", action="store_true", help="Ignore untracked files.")
+    parser.add_argument("--summary", "--quick", dest="summary", action="store_true",
+                        help="Only find out whether each repository is dirty: `git status` is stopped as soon as "
+                        "the first changed file has been read, and only that file is listed. "
+                        "This is much faster for repositories with many changed files. Exit codes are unchanged.")
+    parser.add_argument("--all-branches", action="store_true",
+                        help="Also report unpushed commits on local branches other than the checked-out branch. "
+                        "The upstream and ahead/behind state of all branches is read with one `git for-each-ref` "
+                        "call per repository. Branches that are only behind their upstream are not reported.")
+    parser.add_argument("--worktrees", action="store_true",
+                        help="Follow the `gitdir:` links of each repository found, and also check all its worktrees "
+                        "(the main worktree and all linked worktrees from `git worktree add`, also outside the "
+                        "basedirs). Bare repositories with linked worktrees are checked through their worktrees. "
+                        "With --all-branches, branches that are not checked out are only reported for one worktree. "
+                        "(Worktrees of the same repository always share the --all-branches branch listing and "
+                        "the fetch check, within a run.)")
+    parser.add_argument("--submodules", action="store_true",
+                        help="Also check the checked-out submodules of each repository (as listed in .gitmodules), "
+                        "recursively. By default, repositories inside repositories are not checked.")
+    parser.add_argument("--max-files", type=int,
+                        help="List at most this many changed files per repository in the report "
+                        "(all changed files are still counted). Default: list all changed files.")
 
     parser.add_argument(
         "--no-check-remote-tracking-branch",
@@ -101,9 +183,91 @@ def parse_args(argv=None):
                         help="Check if origin has changes that can be fetched. This is disabled by default, since "
                         "it requires making a lot of remote requests which could be expensive.")
 
+    parser.add_argument("--fetch-engine", choices=("asyncio", "subprocess", "ls-remote"), default="asyncio",
+                        help="How to run `git fetch --dry-run` when --check-fetch is given. "
+                        "'asyncio' (default) runs fetches concurrently from a single event loop, "
+                        "limited by --fetch-jobs and --fetch-jobs-per-host. "
+                        "'subprocess' runs the fetch as part of each repository's status check. "
+                        "'ls-remote' does not fetch, but runs one `git ls-remote --heads` per unique remote URL, "
+                        "and compares the advertised branches with each repository's remote-tracking branches "
+                        "(new tags are not reported).")
+    parser.add_argument("--ls-remote-ttl", type=float, default=0,
+                        help="With --fetch-engine ls-remote, cache the branches advertised by each remote "
+                        "(in --cache-dir) for this many seconds across runs. Default: 0 (only cache during the run).")
+    parser.add_argument("--fetch-jobs", type=int, default=8,
+                        help="Maximum number of concurrent `git fetch` processes (asyncio fetch engine). Default: 8.")
+    parser.add_argument("--fetch-jobs-per-host", type=int, default=2,
+                        help="Maximum number of concurrent `git fetch` processes against the same remote host "
+                        "(asyncio fetch engine). Local remotes are only limited by --fetch-jobs. Default: 2.")
+    parser.add_argument("--fetch-timeout", type=float, default=120,
+                        help="Timeout, in seconds, for each `git fetch --dry-run`. A fetch that does not complete "
+                        "in time is killed and reported as timed out. Use 0 to disable. Default: 120.")
+
+    parser.add_argument("--schedule", choices=("stream", "adaptive"), default="stream",
+                        help="How to schedule the status checks. 'stream' (default) checks repositories in the "
+                        "order they are found, while the scan is still running, and reports results as they "
+                        "become available. 'adaptive' waits for the scan to finish, then checks the repositories "
+                        "that took longest in previous runs first, and adapts the number of concurrent checks "
+                        "(up to --jobs) to the observed throughput and the load average (see --max-load).")
+    parser.add_argument("--max-load", type=float,
+                        help="With --schedule adaptive, reduce the number of concurrent checks while the 1-minute "
+                        "load average is above this. Default: the number of CPUs.")
+    parser.add_argument("--shard", type=parse_shard, metavar="K/N",
+                        help="Only check the repositories in shard K (1 to N) of N. All repositories are still "
+                        "found, but they are partitioned into N shards by a hash of their path, so N independent "
+                        "processes (e.g. on different hosts, with the same basedirs) each check their own share. "
+                        "Use with --format jsonl (or json), and combine the result files with "
+                        "`git-status-checker merge FILE...`, which prints one report and exits with one exit status. "
+                        "A shard without repositories exits with status 0.")
+    parser.add_argument("--jobs", "-j", type=int, default=None,
+                        help="Number of repositories to check concurrently (each check runs `git status` "
+                        "and optionally `git fetch --dry-run` in a subprocess). "
+                        "Default is the number of CPUs. Use `--jobs 1` to check repositories one at a time. "
+                        "Results are always reported in the same order as with a serial run.")
+
+    parser.add_argument("--backend", choices=("subprocess", "native", "pygit2", "auto"), default="subprocess",
+                        help="How to read each repository's commit and push status. "
+                        "'subprocess' (default) runs `git status`. "
+                        "'native' reads HEAD, refs, config, the index and .gitignore files in-process, "
+                        "without starting a `git` process, for repositories that are clean and in sync "
+                        "with their upstream, and falls back to `git status` for everything else. "
+                        "'pygit2' uses the pygit2 library (if installed). "
+                        "'auto' uses pygit2 if it is installed, otherwise 'native'. "
+                        "The reported status is the same for all backends.")
+
+    parser.add_argument("--format", choices=("text", "jsonl", "json", "csv"), default="text",
+                        help="Output format. 'text' (default) prints a human-readable report for repositories "
+                        "with outstanding changes. 'jsonl' writes one JSON object per repository (JSON Lines), "
+                        "'json' a JSON array, and 'csv' one line per repository, for all checked repositories. "
+                        "Each record has the repository path, branch, upstream, ahead/behind counts, "
+                        "number of changed files per state, fetch result, error, and check duration. "
+                        "Records are written as soon as each repository has been checked.")
+
+    parser.add_argument("--watch", action="store_true",
+                        help="After the initial check, keep running and watch the repositories for changes, "
+                        "re-checking only repositories that changed, and reporting each status change as it happens. "
+                        "Uses inotify on Linux (falling back to polling elsewhere). Stop with Ctrl-C. "
+                        "Repositories are only discovered once, at startup.")
+    parser.add_argument("--watch-poll", action="store_true",
+                        help="With --watch, always watch for changes by polling, instead of using inotify.")
+    parser.add_argument("--watch-interval", type=float, default=2.0,
+                        help="Polling interval, in seconds, when watching by polling. Default: 2.")
+    parser.add_argument("--watch-debounce", type=float, default=0.5,
+                        help="With --watch, wait until a repository has had no changes for this many seconds "
+                        "before re-checking it (but at most 10 times as long). Default: 0.5.")
+
+    parser.add_argument("--serve", action="store_true",
+                        help="After the initial check, keep running and serve the status of the repositories "
+                        "over a Unix domain socket, for `git-status-checker query` (e.g. from shell prompts "
+                        "and editor plugins). Use together with --watch to keep the status up to date.")
+    parser.add_argument("--socket",
+                        help="Socket path for --serve. Default: `$XDG_RUNTIME_DIR/git-status-checker.sock`, "
+                        "or `git-status-checker.sock` in the cache directory.")
+
     parser.add_argument("--wait", action="store_true",
                         help="If changes are found, wait for input before continuing. This is typically used to "
-                        "prevent the command prompt from closing when executing as e.g. a scheduled task.")
+                        "prevent the command prompt from closing when executing as e.g. a scheduled task. "
+                        "With --format jsonl/json/csv, the prompt is written to stderr.")
 
     parser.add_argument("--config", "-c",
                         help="Instead of providing command line arguments at the command line, "
@@ -149,8 +313,9 @@ def process_args(argns=None, argv=None):
 
     # Load config with parameters:
     if args.get("config"):
+        import yaml  # Only imported when needed, as importing yaml is slow.
         with open(args["config"]) as fp:
-            cfg = yaml.load(fp)
+            cfg = yaml.safe_load(fp)
         args.update(cfg)
 
     if args.get("loglevel"):
@@ -158,11 +323,14 @@ def process_args(argns=None, argv=None):
             args["loglevel"] = int(args.get("loglevel"))
         except ValueError:
             args["loglevel"] = getattr(logging, args["loglevel"])
+    if isinstance(args.get("shard"), str):
+        args["shard"] = parse_shard(args["shard"])  # From the config file.
 
     # On windows, we have to expand glob patterns manually:
+    import glob
     file_pattern_matches = [(pattern, glob.glob(os.path.expanduser(pattern))) for pattern in args['basedirs']]
     for pattern in (pattern for pattern, res in file_pattern_matches if len(res) == 0):
-        print("WARNING: File/pattern '%s' does not match any files." % pattern)
+        print("WARNING: File/pattern '%s' does not match any files." % pattern, file=sys.stderr)
     args['basedirs'] = [fname for pattern, res in file_pattern_matches for fname in res]
 
     if args.get("ignorefile"):
@@ -171,6 +339,30 @@ def process_args(argns=None, argv=None):
     return args
 
 
+def default_cache_dir():
+    """ Return the default directory for git-status-checker's cache files.
+
+    This is `$XDG_CACHE_HOME/git-status-checker` (default `~/.cache/git-status-checker`),
+    or `%LOCALAPPDATA%\\git-status-checker` on Windows.
+    """
+    if os.name == "nt" and os.environ.get("LOCALAPPDATA"):
+        base = os.environ["LOCALAPPDATA"]
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "git-status-checker")
+
+
+def default_socket_path():
+    """ Return the default socket path for --serve and `git-status-checker query`.
+
+    This is `$XDG_RUNTIME_DIR/git-status-checker.sock` if XDG_RUNTIME_DIR is set,
+    otherwise `git-status-checker.sock` in the cache directory (see default_cache_dir()).
+    """
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], "git-status-checker.sock")
+    return os.path.join(default_cache_dir(), "git-status-checker.sock")
+
+
 def read_ignorefile(ignorefile):
     """ Read file with glob patterns specifying files to ignore. """
     if ignorefile is None:
@@ -204,8 +396,9 @@ def is_git_workdir_or_repo(dirpath, dirnames, filenames):
 
     Args:
         dirpath: Directory (path).
-        dirnames: List of child directory names within `dirpath` (just the names - not the path).
-        filenames: List of file names within `dirpath` (just the names - not the path).
+        dirnames: Child directory names within `dirpath` (just the names - not the path).
+            Can be any container, e.g. a list or a set (faster membership test).
+        filenames: File names within `dirpath` (just the names - not the path). Can be a list or a set.
 
     Returns:
         True if dirpath is a git working directory (has a `.git` file or directory)
@@ -223,40 +416,300 @@ def is_git_workdir_or_repo(dirpath, dirnames, filenames):
     return 0
 
 
-def scan_gitrepos(basedirs, ignoreglobs=None, followlinks=False):
+def compile_ignoreglobs(ignoreglobs):
+    """ Compile a list of glob patterns into a single matching function.
+
+    Patterns without wildcards are matched using a set lookup, and all other patterns are
+    combined into one regular expression, so the cost of matching a name does not grow
+    (much) with the number of patterns.
+
+    Args:
+        ignoreglobs: List of glob patterns, as used by fnmatch.
+
+    Returns:
+        Function is_ignored(name), which returns True if name matches any of the patterns
+        (equivalent to `any(fnmatch(name, pat) for pat in ignoreglobs)`),
+        or None if there are no patterns.
+    """
+    if not ignoreglobs:
+        return None
+    # fnmatch normalizes case on case-insensitive file systems (e.g. Windows); we do the same.
+    normcase = os.path.normcase if os.path.normcase("Aa/") != "Aa/" else None
+    if normcase:
+        ignoreglobs = [normcase(pat) for pat in ignoreglobs]
+    literals = frozenset(pat for pat in ignoreglobs if not any(char in pat for char in "*?["))
+    wildcard_pats = [pat for pat in ignoreglobs if pat not in literals]
+    match = re.compile("|".join(translate(pat) for pat in wildcard_pats)).match if wildcard_pats else None
+
+    def is_ignored(name):
+        if normcase:
+            name = normcase(name)
+        return name in literals or (match is not None and match(name) is not None)
+
+    return is_ignored
+
+
+GIT_MARKER_NAMES = frozenset((".git", "HEAD", "config", "refs"))
+
+
+def list_gitrepo_candidates(dirpath, is_ignored=None, followlinks=False):
+    """ List a single directory, as needed for scanning for git repositories.
+
+    Uses os.scandir, so directories are identified from the directory listing itself,
+    without additional stat calls (on most platforms).
+
+    Args:
+        dirpath: The directory to list.
+        is_ignored: Function returning True for sub-directory names to ignore, see compile_ignoreglobs().
+        followlinks: If False, symbolic links to directories are not included in the returned subdirs.
+
+    Returns:
+        (is_repo, subdirs) two-tuple, where is_repo is the value returned by is_git_workdir_or_repo(),
+        and subdirs is a list of (non-ignored) sub-directory names to descend into.
+        If dirpath is a git repository, subdirs is empty, since we do not look for repositories inside repositories.
+    """
+    subdirs = []
+    marker_dirs, marker_files = set(), set()  # Only the names relevant for is_git_workdir_or_repo().
+    ignoredirs = []
+    try:
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                name = entry.name
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_dir:
+                    if name in GIT_MARKER_NAMES:
+                        marker_files.add(name)
+                    continue
+                if is_ignored is not None and is_ignored(name):
+                    ignoredirs.append(name)
+                    continue
+                if name in GIT_MARKER_NAMES:
+                    marker_dirs.add(name)
+                if followlinks or not entry.is_symlink():
+                    subdirs.append(name)
+    except OSError as exc:
+        # Like os.walk, we skip directories that cannot be listed, e.g. due to missing permissions.
+        logger.debug("Could not list directory %s: %s", dirpath, exc)
+        return 0, []
+    if ignoredirs:
+        logger.debug("Ignoring the following directories in %s: %s", dirpath, ignoredirs)
+    is_repo = is_git_workdir_or_repo(dirpath, marker_dirs, marker_files)
+    if is_repo:
+        return is_repo, []
+    subdirs.sort()  # Makes the scan order independent of the file system's listing order.
+    return is_repo, subdirs
+
+
+def walk_gitrepos(basedirs, list_dir, executor=None, lookahead=32):
+    """ Walk <basedirs> and yield the git repositories found, in depth-first order.
+
+    Args:
+        basedirs: List of directories to walk.
+        list_dir: Function returning (is_repo, subdirs) for a directory, e.g. list_gitrepo_candidates().
+        executor: Optional concurrent.futures.Executor. If given, directories are listed concurrently:
+            The next <lookahead> directories of the walk are listed ahead, including the sub-directories
+            of directories already listed ahead, so independent basedirs and sub-trees are walked in parallel.
+            The repositories are still yielded in the same (depth-first) order as when walking serially.
+        lookahead: The maximum number of directories listed ahead. This bounds the number of listing tasks
+            (and thus the memory used) regardless of the number of directories, while keeping <executor> busy.
+
+    Yields:
+        (basedir, gitrepo) two-tuples.
+    """
+    if executor is None:
+        for basedir in basedirs:
+            stack = [basedir]
+            while stack:
+                dirpath = stack.pop()
+                is_repo, subdirs = list_dir(dirpath)
+                if is_repo:
+                    yield basedir, dirpath
+                # Push in reverse order, so sub-directories are visited in listing order:
+                stack.extend(os.path.join(dirpath, dirname) for dirname in reversed(subdirs))
+        return
+
+    from concurrent.futures import wait, FIRST_COMPLETED
+    aborted = []
+
+    def list_ahead(dirpath):
+        if aborted:
+            return 0, []
+        return list_dir(dirpath)
+
+    # The stack of the serial walk, with a [basedir, dirpath, future, is_repo] list for each directory.
+    # Once a directory is listed, is_repo is set and its sub-directories are inserted right below it
+    # (where the serial walk would push them after popping it), so they can be listed ahead as well.
+    lookahead = max(1, lookahead)
+    stack = [[basedir, basedir, None, None] for basedir in reversed(basedirs)]
+    pending = set()
+
+    def insert_listing(index, is_repo, subdirs):
+        entry = stack[index]
+        entry[3] = is_repo
+        stack[index:index] = [[entry[0], os.path.join(entry[1], dirname), None, None] for dirname in reversed(subdirs)]
+
+    try:
+        while stack:
+            # Submit and insert listings for the top <lookahead> entries of the stack.
+            index, count, running = len(stack) - 1, 0, []
+            while index >= 0 and count < lookahead:
+                entry = stack[index]
+                if entry[3] is None:
+                    if entry[2] is None and len(pending) < lookahead:
+                        entry[2] = executor.submit(list_ahead, entry[1])
+                        pending.add(entry[2])
+                    if entry[2] is not None and entry[2].done():
+                        pending.discard(entry[2])
+                        size = len(stack)
+                        insert_listing(index, *entry[2].result())
+                        index += len(stack) - size  # Continue with the entry's first sub-directory.
+                    elif entry[2] is not None:
+                        running.append(entry[2])
+                index -= 1
+                count += 1
+            entry = stack[-1]
+            if entry[3] is None:
+                if entry[2] is None:
+                    insert_listing(len(stack) - 1, *list_dir(entry[1]))
+                else:
+                    wait(running, return_when=FIRST_COMPLETED)
+                continue
+            stack.pop()
+            if entry[3]:
+                yield entry[0], entry[1]
+    finally:
+        aborted.append(True)
+        for future in pending:
+            future.cancel()
+
+
+def iter_gitrepos(basedirs, ignoreglobs=None, followlinks=False, scan_cache=None, scan_jobs=1, timings=None,
+                  worktrees=False, submodules=False):
     """ Scan the list of basedirs for git repositories, traversing each basedir recursively.
+
+    Like scan_gitrepos(), but a generator, yielding each git repository as soon as it is found.
+    This allows checking repositories while the scan is still running.
+    With <worktrees> and/or <submodules>, the related repositories of each repository found
+    are yielded right after it (see worktrees.related_repos()).
+
+    If a scan_cache is given, it is saved once the scan has completed.
+    If timings (a timings.Timings) is given, the walk time and number of directories listed are recorded.
     """
-    if ignoreglobs is None:
-        ignoreglobs = []
     if isinstance(basedirs, str):
         basedirs = [basedirs]
-    gitrepos = []
-    # first = 5  # True
-    for basedir in basedirs:
-        basedir_gitrepos = []  # make a list for each basedir (to see if any basedir are void of git repos)
-        logger.debug("Walking basedir %s", basedir)
-        for dirpath, dirnames, filenames in os.walk(basedir, followlinks=followlinks):
-            # if first and first > 0:
-            #    print("dirpath, dirnames, filenames) =", (dirpath, dirnames, filenames))
-            #    first -= 1
-            ignoredirs = [dirname for dirname in dirnames if any(fnmatch(dirname, pat) for pat in ignoreglobs)]
-            if ignoredirs:
-                logger.debug("Ignoring the following directories in %s: %s", dirpath, ignoredirs)
-            for dirname in ignoredirs:
-                dirnames.remove(dirname)
-            # if ".git" in dirnames or ".git" in filenames:
-            if is_git_workdir_or_repo(dirpath, dirnames, filenames):
-                logger.debug("Git repository found: %s", dirpath)
-                # Add git repo dir to list of repos and abort further recursion by emptying the dirnames list:
-                basedir_gitrepos.append(dirpath)
-                del dirnames[:]
-        logger.info("%s git repositories found for basedir %s", len(basedir_gitrepos), basedir)
-        gitrepos += basedir_gitrepos
-    logger.info("%s git repositories found for all (%s) basedirs", len(gitrepos), len(basedirs))
-    return gitrepos
-
-
-def check_repo_status(gitrepo, fetch=False, ignore_untracked=False, check_remote_tracking_branch=True):
+    is_ignored = compile_ignoreglobs(ignoreglobs)
+
+    def lister(dirpath):
+        if timings is not None:
+            timings.count_dir()
+        return list_gitrepo_candidates(dirpath, is_ignored=is_ignored, followlinks=followlinks)
+
+    if scan_cache is not None:
+        def list_dir(dirpath):
+            return scan_cache.list_dir(dirpath, lister)
+    else:
+        list_dir = lister
+
+    if worktrees or submodules:
+        related_repos = functools.partial(import_submodule("worktrees").related_repos,
+                                          worktrees=worktrees, submodules=submodules)
+    else:
+        related_repos = None
+    seen = set()
+    counts = {basedir: 0 for basedir in basedirs}  # to see if any basedir are void of git repos
+    if scan_jobs and scan_jobs > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=scan_jobs)
+    else:
+        executor = None
+    if timings is not None:
+        timings.walk_start()
+    try:
+        for basedir, found in walk_gitrepos(basedirs, list_dir, executor=executor, lookahead=4 * scan_jobs):
+            for gitrepo in (related_repos(found) if related_repos is not None else [found]):
+                key = os.path.normcase(os.path.realpath(gitrepo))
+                if key in seen:
+                    logger.debug("Skipping git repository %s (already found).", gitrepo)
+                    continue
+                seen.add(key)
+                logger.debug("Git repository found: %s", gitrepo)
+                counts[basedir] += 1
+                yield gitrepo
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+    if timings is not None:
+        timings.walk_done(len(seen))
+    for basedir, count in counts.items():
+        logger.info("%s git repositories found for basedir %s", count, basedir)
+    if scan_cache is not None:
+        scan_cache.save(basedirs)
+    logger.info("%s git repositories found for all (%s) basedirs", sum(counts.values()), len(basedirs))
+
+
+def scan_gitrepos(basedirs, ignoreglobs=None, followlinks=False, scan_cache=None, scan_jobs=1,
+                  worktrees=False, submodules=False):
+    """ Scan the list of basedirs for git repositories, traversing each basedir recursively.
+
+    Args:
+        basedirs: List of directories to scan (or a single directory).
+        ignoreglobs: Glob patterns for sub-directories to ignore (basedirs are never ignored).
+        followlinks: Whether to descend into symbolic links to directories.
+        scan_cache: Optional scan_cache.ScanCache. If given, directories that have not changed since the
+            previous (cached) scan are not listed again.
+        scan_jobs: Number of directories to list concurrently. With scan_jobs > 1, all basedirs and
+            sub-directories are walked in parallel by a pool of worker threads, which mostly helps when
+            file system latency dominates (e.g. network file systems).
+        worktrees: Follow the `gitdir:` links of each repository found, and also include all its worktrees
+            (main and linked, wherever they are). Bare repositories with linked worktrees are replaced by them.
+        submodules: Also include the checked-out submodules of each repository (recursively).
+            Otherwise, the scan does not look for repositories inside repositories.
+
+    Returns:
+        List of git repositories, in depth-first order, visiting sub-directories in sorted order.
+        The order is the same regardless of scan_jobs.
+        Repositories found more than once (e.g. due to overlapping basedirs or symbolic links)
+        are only included the first time.
+
+    See iter_gitrepos() for a generator version.
+    """
+    return list(iter_gitrepos(basedirs, ignoreglobs=ignoreglobs, followlinks=followlinks,
+                              scan_cache=scan_cache, scan_jobs=scan_jobs, worktrees=worktrees, submodules=submodules))
+
+
+def parse_shard(value):
+    """ Parse a --shard value "K/N" and return the two-tuple (K, N), where 1 <= K <= N. """
+    try:
+        shard, nshards = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected K/N, e.g. 1/4, not %r" % value) from None
+    if not 1 <= shard <= nshards:
+        raise argparse.ArgumentTypeError("K must be between 1 and N in K/N, not %r" % value)
+    return shard, nshards
+
+
+def shard_index(gitrepo, nshards):
+    """ Return the shard (0 to nshards-1) of <gitrepo>, from a hash of its absolute path.
+
+    The shard only depends on the path, so independent processes scanning the same
+    basedirs agree on which shard each repository belongs to.
+    """
+    return zlib.crc32(os.path.abspath(gitrepo).encode("utf-8", "surrogateescape")) % nshards
+
+
+def select_shard(gitrepos, shard, nshards):
+    """ Yield the repositories in <gitrepos> that belong to shard number <shard> (1 to nshards) of <nshards>. """
+    for gitrepo in gitrepos:
+        if shard_index(gitrepo, nshards) == shard - 1:
+            yield gitrepo
+
+
+def check_repo_status(gitrepo, fetch=False, ignore_untracked=False, check_remote_tracking_branch=True,
+                      fetch_timeout=None, backend="subprocess", max_files=None, quick=False, all_branches=False,
+                      repo_groups=None):
     """
     Checks the status of git repository <gitrepo> and returns a tuple of
         (commit-status, push-status, fetch-status)
@@ -265,99 +718,503 @@ def check_repo_status(gitrepo, fetch=False, ignore_untracked=False, check_remote
     and pull-status whether the repo is behind origin.
     If an element is boolean True, it means there are something to do (e.g. changes to commit).
     If all elements are boolean False, there are nothing to commit, push or fetch.
+    If `git fetch --dry-run` takes longer than <fetch_timeout> seconds, it is killed,
+    and the fetch-status is a "Timed out" message.
+    If <backend> is not "subprocess", the commit and push status is first read in-process with
+    the given backend (see native_status.read_status), falling back to `git status` if the backend
+    does not support the repository.
+    At most <max_files> changed files are listed in the commit-status (None means no limit),
+    followed by a line saying how many were not listed. All changed files are counted.
+    If <quick> is True, `git status` is stopped as soon as the first changed file has been read,
+    and only that file is listed (and counted). This is all that is needed to tell if the repository is dirty.
+    If <all_branches> is True, the push-status also includes the other local branches
+    with commits to push (see check_branches_push_status()).
+    If <repo_groups> (a worktrees.RepoGroups) is given, the branch listing and fetch status are shared
+    with the other worktrees of the same repository.
+    The returned tuple is a RepoStatus, with the branch, upstream, ahead/behind counts and
+    number of changed files per state in its `details` attribute (and the error message, if `git status` failed).
     """
-    git_status_command = shlex.split("git status --porcelain=v1 --branch")
-    try:
-        status_output = subprocess.check_output(git_status_command, cwd=gitrepo)\
-                                  .decode().strip().split("\n")
-    except subprocess.CalledProcessError as e:
-        print("Warning: failed to git status on %s: %s", gitrepo, e)
-        return None, None, None
-    #             False if "up-to-date" in status_output else status_output:
-    # Examples of `git status` output:  (The first line is "on branch <branch>" or similar)
-    #   Your branch is up-to-date with 'origin/master'.
-    #   Your branch is ahead of 'origin/master' by 2 commits.
-    #   nothing to commit, working tree clean   # If no remote tracking branch
-    #   Changes not staged for commit           # No remote tracking branch, but local changes.
-    # Examples of `git status --porcelain=v1 --branch` output (first line):
-    #   ## devlegacy-rs                         # If no remote tracking branch.
-    #   ## master...origin/master [ahead 1]     # Local master is 1 commit ahead of remote tracking branch.
-    #   ## edge...origin/edge                   # Local branch is up to date with origin.
-    #   ## HEAD (no branch)                     # Working with detached head.
-    # status_regex = r"Your branch is (?P<status>.* (with|of)) (?P<branch>\'\w+\/\w+\') ?(?P<offset>.*)"
-    # status_regex = (r"## (?P<local_branch>[0-9a-zA-Z_-]+)(\.\.\."
-    #                 r"((?P<remote>[0-9a-zA-Z_-]+)/)?(?P<remote_branch>[0-9a-zA-Z_-]+)( ?\[(?P<ahead_behind>.+)\])?)?")
-    status_regex = (
-        r"## ((?P<commitish>\w+ \(no branch\))"
-        r"|(?P<local_branch>[0-9a-zA-Z_-]+)"
-        r"(\.\.\.((?P<remote>[0-9a-zA-Z_-]+)/)?(?P<remote_branch>[0-9a-zA-Z_-]+)( ?\[(?P<ahead_behind>.+)\])?)?)"
-    )
-    push_match = re.match(status_regex, status_output[0])
-    logger.debug("%s git status output is: %s", gitrepo, status_output)
-    if push_match:
-        # Set push_status to False if there is nothing to push.
-        # OBS: git status output changed from "up-to-date" to "up to date". Maybe use an external package?
-        # Alternatively, use `git status --porcelain=v1 --branch` instead of just `git status`?
-        local_commitish = push_match.group('commitish')  # If not working on a local branch
-        local_branch = push_match.group('local_branch')
-        push_remote = push_match.group('remote')
-        remote_branch = push_match.group('remote')
-        ahead_behind = push_match.group('ahead_behind')
-        if push_remote is None:
-            if check_remote_tracking_branch:
-                push_status = "No remote tracking branch configured, working on local-only branch %r" % (local_branch,)
-            else:
-                push_status = False
+    if backend != "subprocess":
+        native_status = import_submodule("native_status")
+        try:
+            info = native_status.read_status(gitrepo, backend=backend, ignore_untracked=ignore_untracked)
+        except native_status.Unsupported as exc:
+            logger.debug("%s: %s backend not supported (%s), using `git status`.", gitrepo, backend, exc)
         else:
-            push_status = False if ahead_behind is None else "%s is %s of remote branch %s/%s" % (
-                local_branch, ahead_behind, push_remote, remote_branch
-            )
-        # push_status = False if ("up-to-date" in push_status_str
-        #                         or "up to date" in push_status_str) else status_output[1]
-    else:
-        print("OBS: %s status-line '%s' did not match status regex." % (gitrepo, status_output[1]), file=sys.stderr)
-        logger.info("%s status[1] did not match standard status regex: %s", gitrepo, status_output[1])
-        push_status = 'Error: git status output "%s" not recognized.' % (status_output[0])
+            push_status = format_push_status(
+                info["local_branch"], info["remote"], info["remote_branch"], info["ahead_behind"],
+                check_remote_tracking_branch=check_remote_tracking_branch)
+            if all_branches:
+                push_status = "\n".join(filter(None, [push_status] + check_branches_push_status(
+                    gitrepo, info["local_branch"], check_remote_tracking_branch, repo_groups))) or False
+            fetch_dryrun = check_fetch_status(gitrepo, fetch_timeout, repo_groups) if fetch else None
+            details = branch_details(info["local_branch"], info["remote"], info["remote_branch"], info["ahead_behind"])
+            porcelain = import_submodule("porcelain")
+            files = info["files_status"]
+            if quick:
+                files = files[:1]  # Same result as `git status` stopped at the first changed file (see below).
+            details["changes"] = porcelain.count_changes(files)
+            files_status = porcelain.limit_files(files, max_files)
+            if quick and files:
+                files_status = files_status + [porcelain.STOPPED_LINE]
+            return RepoStatus(files_status, push_status, fetch_dryrun, details)
+
+    # Parse `git status --porcelain=v2 --branch -z` output while it is being read (see porcelain.py).
+    # Examples of the branch headers:
+    #   # branch.head feature/x                 # The checked-out branch, or "(detached)".
+    #   # branch.upstream origin/feature/x      # Only if the branch has an upstream (remote tracking branch).
+    #   # branch.ab +1 -0                       # Commits ahead/behind upstream (missing if upstream is gone).
+    porcelain = import_submodule("porcelain")
+    git_status_command = porcelain.status_command(ignore_untracked=ignore_untracked, quick=quick)
+    proc = subprocess.Popen(git_status_command, cwd=gitrepo, stdout=subprocess.PIPE)
+    with proc:
+        info = porcelain.parse_status(porcelain.iter_entries(porcelain.iter_chunks(proc.stdout)),
+                                      ignore_untracked=ignore_untracked, max_files=max_files, quick=quick)
+        if not info["complete"]:
+            proc.kill()  # Found a changed file (quick mode); the rest of the output is not needed.
+    if proc.returncode != 0 and info["complete"]:
+        e = subprocess.CalledProcessError(proc.returncode, git_status_command)
+        print("Warning: failed to git status on %s: %s" % (gitrepo, e), file=sys.stderr)
+        return RepoStatus(None, None, None, {"error": str(e)})
+    # Set push_status to False if there is nothing to push:
+    push_status = format_push_status(info["local_branch"], info["remote"], info["remote_branch"],
+                                     info["ahead_behind"], check_remote_tracking_branch=check_remote_tracking_branch)
+    if push_status and info["local_branch"] is None and detached_head_is_pushed(gitrepo):
+        push_status = False  # E.g. a submodule after `git submodule update`.
+    if all_branches:
+        # Other local branches, one message (line) per branch with commits to push:
+        push_status = "\n".join(filter(None, [push_status] + check_branches_push_status(
+            gitrepo, info["local_branch"], check_remote_tracking_branch, repo_groups))) or False
+    details = branch_details(info["local_branch"], info["remote"], info["remote_branch"], info["ahead_behind"])
+    details.update(ahead=info["ahead"], behind=info["behind"], changes=info["changes"])
 
     # Alternatively, compare hashes: (github.com/natemara/git_check)
     # local_hash=`git rev-parse --verify master`
     # remote_hash=`git rev-parse --verify origin/master`
 
-    # Check for changed files commits:
-    files_status = [line for line in status_output[1:] if line.strip()]
-    if ignore_untracked:
-        logger.debug("Removing lines for untracked files: %s", [line for line in files_status if line[1] == "?"])
-        files_status = [line for line in files_status if line[1] != "?"]
+    # Changed files (at most max_files of them are listed):
+    files_status = porcelain.limit_files(info["files_status"], max_files, info["nfiles"])
+    if not info["complete"]:
+        files_status = files_status + [porcelain.STOPPED_LINE]
 
     # Check for incoming changes (from whatever is the branch's default upstream):
-    if fetch:
-        # print("Checking fetch status for repo:", gitrepo, "...")
-        try:
-            fetch_dryrun = subprocess.check_output(
-                ["git", "fetch", "--dry-run"],
-                cwd=gitrepo,
-                stderr=subprocess.STDOUT,  # redirect stderr to stdout to capture stderr with stdout.
-            ).decode().strip()
-            # proc = subprocess.run("git fetch --dry-run", capture_output=True)  # Alternative.
-        except subprocess.CalledProcessError as exc:
-            # print(f" - ERROR while checking fetch for repo {gitrepo}:", file=sys.stderr)
-            # print(f" - ERROR: {exc}.", file=sys.stderr)
-            # print(f" - Perhaps you do not have read access to the remote repository?", file=sys.stderr)
-            # print(f" - Try to see if you can invoke `git fetch` manually in this repository.", file=sys.stderr)
-            fetch_dryrun = str(exc) + " Maybe failed auth? Please do a manual `git fetch` to debug the issue."
-        # print("fetch_dryrun:", fetch_dryrun)  # debug print
-    else:
-        fetch_dryrun = None
+    fetch_dryrun = check_fetch_status(gitrepo, fetch_timeout, repo_groups) if fetch else None
     logger.debug("%s: (%s, %s, %s)", gitrepo, len(files_status), push_status,
                  fetch_dryrun and len(fetch_dryrun))
-    return files_status, push_status, fetch_dryrun
+    return RepoStatus(files_status, push_status, fetch_dryrun, details)
+
+
+class RepoStatus(tuple):
+    """ (commit-status, push-status, fetch-status) three-tuple, as returned by check_repo_status().
+
+    Since it is a tuple, it can be unpacked and tested with any(), just like a plain three-tuple.
+    Structured information about the repository is available in the `details` dict attribute:
+        branch: The checked-out branch (None if HEAD is detached).
+        upstream: The upstream branch, e.g. "origin/master" (None if the branch has no upstream).
+        ahead, behind: Number of commits ahead of/behind upstream (None if there is no upstream).
+        changes: Dict with the number of changed files in each state (see porcelain.classify()).
+            In quick mode, only the first changed file is counted.
+        error: Error message, if the status could not be read.
+        duration: Time (in seconds) it took to check the repository (set by iter_repo_status()).
+    """
+
+    def __new__(cls, commitstat, pushstat, fetchstat, details=None):
+        self = super().__new__(cls, (commitstat, pushstat, fetchstat))
+        self.details = dict(details or {})
+        return self
+
+    def with_fetch_status(self, fetchstat):
+        """ Return a copy of this RepoStatus, with fetch-status <fetchstat>. """
+        return RepoStatus(self[0], self[1], fetchstat, self.details)
+
+
+def branch_details(local_branch, remote, remote_branch, ahead_behind):
+    """ Return dict with branch, upstream, ahead and behind, for RepoStatus.details.
+
+    Args:
+        local_branch, remote, remote_branch, ahead_behind: As for format_push_status().
+    """
+    details = {"branch": local_branch, "upstream": None, "ahead": None, "behind": None}
+    if remote is not None:
+        details["upstream"] = "%s/%s" % (remote, remote_branch)
+        for key in ("ahead", "behind"):
+            match = re.search(key + r" (\d+)", ahead_behind or "")
+            details[key] = int(match.group(1)) if match else 0
+    return details
+
+
+def format_push_status(local_branch, remote, remote_branch, ahead_behind, check_remote_tracking_branch=True):
+    """ Return the push-status for a repository, given its branch and upstream information.
+
+    Args:
+        local_branch: The checked-out branch.
+        remote: The remote of the branch's upstream, or None if the branch has no upstream.
+        remote_branch: The upstream branch (name on the remote).
+        ahead_behind: E.g. "ahead 1", "behind 2", "ahead 1, behind 2", or None if in sync with upstream.
+        check_remote_tracking_branch: Whether to report a missing upstream.
+
+    Returns:
+        False if there is nothing to push, otherwise a message.
+    """
+    if remote is None:
+        if check_remote_tracking_branch:
+            return "No remote tracking branch configured, working on local-only branch %r" % (local_branch,)
+        return False
+    if ahead_behind is None:
+        return False
+    return "%s is %s of remote branch %s/%s" % (local_branch, ahead_behind, remote, remote_branch)
+
+
+def detached_head_is_pushed(gitrepo):
+    """ Return True if the (detached) HEAD of <gitrepo> is contained in a remote-tracking branch.
+
+    A detached HEAD has no upstream, but nothing needs to be pushed if its commit is already on a remote.
+    This is the normal state of a submodule, which `git submodule update` checks out at the commit
+    recorded in the superproject.
+    """
+    try:
+        output = subprocess.check_output(
+            ["git", "for-each-ref", "--contains", "HEAD", "--count=1", "--format=%(refname)", "refs/remotes"],
+            cwd=gitrepo, stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError:
+        return False
+    return bool(output.strip())
+
+
+def parse_upstream_ref(upstream):
+    """ Return (remote, remote_branch) two-tuple for upstream ref <upstream>, e.g. "refs/remotes/origin/feature/x".
+
+    For a local upstream branch ("refs/heads/<branch>"), remote is ".". If there is no upstream, both are None.
+    """
+    if upstream.startswith("refs/remotes/"):
+        remote, _, remote_branch = upstream[len("refs/remotes/"):].partition("/")
+        return remote, remote_branch
+    if upstream.startswith("refs/heads/"):
+        return ".", upstream[len("refs/heads/"):]
+    return None, None
+
+
+def check_branches_push_status(gitrepo, current_branch=None, check_remote_tracking_branch=True, repo_groups=None):
+    """ Return list of push-status messages for the local branches of <gitrepo>, other than <current_branch>.
+
+    The upstream and ahead/behind state of all local branches is read with a single `git for-each-ref` call.
+    Branches that are only behind their upstream have nothing to push, and are not reported.
+    Branches without an upstream are reported if <check_remote_tracking_branch> is True, see format_push_status().
+    If <repo_groups> (a worktrees.RepoGroups) is given, the branches are only read once for all worktrees of
+    the repository. If all worktrees are checked (repo_groups.worktrees), the branches are only reported for
+    one of the worktrees, and branches checked out in other worktrees are left to those worktrees.
+    """
+    exclude = {current_branch}
+    if repo_groups is not None and repo_groups.worktrees:
+        if not repo_groups.reports_other_branches(gitrepo):
+            return []
+        exclude |= repo_groups.checked_out_branches(gitrepo)
+    command = ["git", "for-each-ref", "--format=%(refname:lstrip=2)%00%(upstream)%00%(upstream:track,nobracket)",
+               "refs/heads"]
+    try:
+        if repo_groups is not None:
+            output = repo_groups.shared(gitrepo, "branches", lambda: subprocess.check_output(command, cwd=gitrepo))
+        else:
+            output = subprocess.check_output(command, cwd=gitrepo)
+    except subprocess.CalledProcessError as exc:
+        print("Warning: failed to list branches in %s: %s" % (gitrepo, exc), file=sys.stderr)
+        return []
+    messages = []
+    for line in output.decode("utf-8", "replace").splitlines():
+        branch, upstream, ahead_behind = line.split("\0")
+        if branch in exclude:
+            continue
+        remote, remote_branch = parse_upstream_ref(upstream)
+        if remote is not None and "ahead" not in ahead_behind and ahead_behind != "gone":
+            continue  # In sync with, or only behind, upstream.
+        message = format_push_status(branch, remote, remote_branch, ahead_behind or None,
+                                     check_remote_tracking_branch=check_remote_tracking_branch)
+        if message:
+            messages.append(message)
+    return messages
+
+
+def check_fetch_status(gitrepo, fetch_timeout=None, repo_groups=None):
+    """ Check if git repository <gitrepo> has incoming changes, using `git fetch --dry-run`.
+
+    Returns the output of `git fetch --dry-run` (empty string if there is nothing to fetch),
+    or an error message if the fetch failed or did not complete within <fetch_timeout> seconds.
+    If <repo_groups> (a worktrees.RepoGroups) is given, the fetch is only run once for all worktrees
+    of the repository that fetch from the same remote.
+    """
+    if repo_groups is not None:
+        return repo_groups.fetch_status(gitrepo, lambda: check_fetch_status(gitrepo, fetch_timeout))
+    # print("Checking fetch status for repo:", gitrepo, "...")
+    try:
+        fetch_dryrun = subprocess.check_output(
+            ["git", "fetch", "--dry-run"],
+            cwd=gitrepo,
+            stderr=subprocess.STDOUT,  # redirect stderr to stdout to capture stderr with stdout.
+            timeout=fetch_timeout,
+        ).decode().strip()
+        # proc = subprocess.run("git fetch --dry-run", capture_output=True)  # Alternative.
+    except subprocess.CalledProcessError as exc:
+        # print(f" - ERROR while checking fetch for repo {gitrepo}:", file=sys.stderr)
+        # print(f" - ERROR: {exc}.", file=sys.stderr)
+        # print(f" - Perhaps you do not have read access to the remote repository?", file=sys.stderr)
+        # print(f" - Try to see if you can invoke `git fetch` manually in this repository.", file=sys.stderr)
+        fetch_dryrun = str(exc) + " Maybe failed auth? Please do a manual `git fetch` to debug the issue."
+    except subprocess.TimeoutExpired:
+        logger.info("%s: `git fetch --dry-run` timed out after %s seconds.", gitrepo, fetch_timeout)
+        fetch_dryrun = "Timed out: `git fetch --dry-run` did not complete within %s seconds." % (fetch_timeout,)
+    # print("fetch_dryrun:", fetch_dryrun)  # debug print
+    return fetch_dryrun
+
+
+def check_repo_status_incremental(gitrepo, status_cache, fetch=False, fetch_timeout=None, **kwargs):
+    """ Like check_repo_status(), but reuse the result from <status_cache> if the repository is unchanged.
+
+    Args:
+        gitrepo: Path of the git repository to check.
+        status_cache: status_cache.StatusCache.
+        fetch, fetch_timeout: Check for incoming changes, see check_repo_status().
+            Fetch status is never cached.
+        **kwargs: Passed on to check_repo_status().
+
+    Returns:
+        (commit-status, push-status, fetch-status) three-tuple, as check_repo_status().
+    """
+    gitdir = import_submodule("gitdir")
+    if kwargs.get("all_branches"):
+        fingerprint_func = functools.partial(gitdir.repo_fingerprint, all_branches=True)
+    else:
+        fingerprint_func = gitdir.repo_fingerprint
+    fingerprint, result = status_cache.lookup(gitrepo, fingerprint_func)
+    if result is not None:
+        logger.debug("%s: Repository unchanged, using cached status.", gitrepo)
+        commitstat, pushstat, details = result
+        fetchstat = check_fetch_status(gitrepo, fetch_timeout, kwargs.get("repo_groups")) if fetch else None
+        return RepoStatus(commitstat, pushstat, fetchstat, details)
+    status_tup = check_repo_status(gitrepo, fetch=fetch, fetch_timeout=fetch_timeout, **kwargs)
+    if status_tup[1] is not None:  # (None, None, None) means `git status` failed.
+        status_cache.store(gitrepo, fingerprint, [status_tup[0], status_tup[1], dict(status_tup.details)])
+    return status_tup
+
+
+def iter_repo_status(gitrepos, jobs=None, fetch_checker=None, status_cache=None, timings=None, scheduler=None,
+                     worktrees=False, **kwargs):
+    """ Check the status of each repository in <gitrepos> using a pool of <jobs> worker threads.
+
+    Args:
+        gitrepos: Iterable of git repository paths to check, e.g. a list or the iter_gitrepos() generator.
+            The iterable is consumed by a separate (producer) thread, so repositories are checked while
+            discovery is still running. At most a few times <jobs> repositories are read ahead,
+            so memory use does not depend on the total number of repositories.
+        jobs: Number of concurrent checks. Default (None) is the number of CPUs.
+        fetch_checker: Optional (started) fetch_checker.AsyncFetchChecker. If given, a fetch check is
+            submitted to the fetch checker as soon as a repository is received, and the fetch status
+            it returns replaces the fetch-status element of the status tuple.
+            (kwargs should then not include `fetch=True`.)
+        status_cache: Optional status_cache.StatusCache. If given, repositories are checked using
+            check_repo_status_incremental(), reusing cached results for unchanged repositories.
+        timings: Optional timings.Timings. If given, the duration of each repository's status check
+            and fetch check is recorded. (The fetch checker should then be created with
+            on_complete=timings.record.)
+        scheduler: Optional scheduler.Scheduler. If given, all of <gitrepos> are read first, and checked
+            by the scheduler, most expensive first, with adaptive concurrency (<jobs> is then not used).
+            Results are still yielded in the same order as <gitrepos>.
+        worktrees: True if <gitrepos> includes all worktrees of each repository (--worktrees).
+            Either way, worktrees of the same repository share their branch listing and fetch check
+            (see worktrees.RepoGroups), during this call.
+        **kwargs: Passed on to check_repo_status().
+
+    Yields:
+        (gitrepo, status_tup) two-tuples, in the same order as <gitrepos>, where status_tup is a RepoStatus
+        (with the time it took to check the repository in status_tup.details["duration"]).
+        Each result is yielded as soon as it (and all results before it) is available,
+        so output can be streamed while the remaining repositories are still being found and checked.
+
+    Threads are sufficient here: each check spends nearly all of its time waiting for `git` subprocesses.
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    repo_groups = kwargs["repo_groups"] = import_submodule("worktrees").RepoGroups(worktrees=worktrees)
+    if fetch_checker is not None:
+        def submit_fetch(gitrepo):
+            return repo_groups.fetch_status(gitrepo, lambda: fetch_checker.submit(gitrepo))
+    else:
+        submit_fetch = None
+    if status_cache is not None:
+        kwargs["status_cache"] = status_cache
+        check_func = check_repo_status_incremental
+    else:
+        check_func = check_repo_status
+    if timings is not None:
+        check_func = _timed(check_func, timings)
+    check_func = _with_duration(check_func)
+    if scheduler is not None:
+        yield from _iter_repo_status_scheduled(gitrepos, scheduler, check_func, submit_fetch, kwargs,
+                                               max_fetches=2 * fetch_checker.max_concurrency if fetch_checker else 1)
+        return
+    # Max number of repositories received but not yet yielded:
+    lookahead = 2 * max(jobs, fetch_checker.max_concurrency if fetch_checker else 1)
+    slots = threading.Semaphore(lookahead)
+    events = queue.Queue()  # ("repo", gitrepo), ("done", None), ("end", None) or ("error", exception)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for gitrepo in gitrepos:
+                while not slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    return
+                events.put(("repo", gitrepo))
+            events.put(("end", None))
+        except BaseException as exc:  # pylint: disable=broad-except
+            events.put(("error", exc))
+
+    def notify(_future):
+        events.put(("done", None))
+
+    def is_ready(entry):
+        _, status_future, fetch_future = entry
+        return (status_future is not None and status_future.done()
+                and (fetch_future is None or fetch_future.done()))
+
+    def receive(kind, value):
+        """ Handle event from the events queue. Returns True if the producer is done. """
+        if kind == "repo":
+            fetch_future = submit_fetch(value) if submit_fetch else None
+            status_future = executor.submit(check_func, value, **kwargs) if executor else None
+            for future in (fetch_future, status_future):
+                if future is not None:
+                    future.add_done_callback(notify)
+            pending.append((value, status_future, fetch_future))
+        elif kind == "error":
+            raise value
+        return kind == "end"
+
+    def collect():
+        gitrepo, status_future, fetch_future = pending.popleft()
+        status_tup = status_future.result() if status_future is not None else check_func(gitrepo, **kwargs)
+        if fetch_future is not None:
+            status_tup = status_tup.with_fetch_status(fetch_future.result())
+        slots.release()
+        return gitrepo, status_tup
+
+    if jobs > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=jobs)
+    else:
+        executor = None
+    if executor is not None:
+        logger.debug("Checking repositories using %s worker threads.", jobs)
+    producer = threading.Thread(target=produce, name="iter_repo_status-producer", daemon=True)
+    producer.start()
+    pending = collections.deque()  # (gitrepo, status_future, fetch_future), in input order.
+    producer_done = False
+    try:
+        while True:
+            # Receive all available repositories and start checking them:
+            while True:
+                try:
+                    event = events.get(block=False)
+                except queue.Empty:
+                    break
+                producer_done |= receive(*event)
+            while pending and is_ready(pending[0]):
+                yield collect()
+            if executor is None and pending:
+                yield collect()  # Serial mode: check the repository in this thread.
+                continue
+            if producer_done and not pending:
+                break
+            producer_done |= receive(*events.get())  # Wait for the next event.
+    finally:
+        # If we are aborted (e.g. Ctrl-C or an exception), do not start any more checks:
+        stop.set()
+        for _, status_future, fetch_future in pending:
+            for future in (status_future, fetch_future):
+                if future is not None:
+                    future.cancel()
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+def _iter_repo_status_scheduled(gitrepos, scheduler, check_func, submit_fetch, kwargs, max_fetches=1):
+    """ iter_repo_status() using <scheduler> (scheduler.Scheduler) to run <check_func> for each repository.
+
+    submit_fetch(gitrepo), if given, submits a fetch check and returns a Future with the fetch status.
+    Each fetch check is only submitted when the scheduler starts checking the repository, and at most
+    <max_fetches> fetch checks are in flight; a worker waits for a free slot before starting its check
+    (this wait is not counted in the repository's cost).
+    """
+    gitrepos = list(gitrepos)  # All repositories must be known before they can be ordered by cost.
+    fetch_futures = {}
+    aborted = threading.Event()
+    start_fetch = None
+    if submit_fetch is not None:
+        fetch_slots = threading.BoundedSemaphore(max(1, max_fetches))
+
+        def start_fetch(gitrepo):
+            while not fetch_slots.acquire(timeout=0.1):
+                if aborted.is_set():
+                    return False  # Do not check the repository; the result is not used.
+            fetch_future = fetch_futures[gitrepo] = submit_fetch(gitrepo)
+            fetch_future.add_done_callback(lambda _future: fetch_slots.release())
+            return True
+    futures = scheduler.submit_all(check_func, gitrepos, before_start=start_fetch, **kwargs)
+    completed = False
+    try:
+        for gitrepo in gitrepos:
+            status_tup = futures[gitrepo].result()
+            if gitrepo in fetch_futures:  # Set before the status check started.
+                status_tup = status_tup.with_fetch_status(fetch_futures[gitrepo].result())
+            yield gitrepo, status_tup
+        completed = True
+    finally:
+        if not completed:
+            # Aborted (e.g. Ctrl-C or an exception); do not start any more checks:
+            aborted.set()
+            for future in list(fetch_futures.values()):
+                future.cancel()
+        scheduler.shutdown(cancel=not completed)
+        if not completed:
+            for future in list(fetch_futures.values()):
+                future.cancel()  # Fetches submitted by checks that were already running.
+
+
+def _timed(check_func, timings):
+    """ Return a version of <check_func> that records the duration of the status and fetch checks in <timings>.
+
+    The fetch check (if requested) is run separately after the status check, so the two can be timed separately.
+    """
+    def timed_check(gitrepo, fetch=False, fetch_timeout=None, **kwargs):
+        start = time.perf_counter()
+        status_tup = check_func(gitrepo, fetch=False, fetch_timeout=fetch_timeout, **kwargs)
+        timings.record("status", gitrepo, time.perf_counter() - start)
+        if fetch and status_tup[1] is not None:
+            start = time.perf_counter()
+            fetchstat = check_fetch_status(gitrepo, fetch_timeout, kwargs.get("repo_groups"))
+            timings.record("fetch", gitrepo, time.perf_counter() - start)
+            status_tup = status_tup.with_fetch_status(fetchstat)
+        return status_tup
+    return timed_check
+
+
+def _with_duration(check_func):
+    """ Return a version of <check_func> that records the time taken in the returned RepoStatus' details. """
+    def check_with_duration(gitrepo, **kwargs):
+        start = time.perf_counter()
+        status_tup = check_func(gitrepo, **kwargs)
+        status_tup.details["duration"] = time.perf_counter() - start
+        return status_tup
+    return check_with_duration
 
 
 def print_report(gitrepo, commitstat, pushstat, fetchstat):
     print("\n"+gitrepo, "has outstanding", ", ".join(
             elem for elem in (commitstat and "commits", pushstat and "pushes", fetchstat and "fetches") if elem), ":")
     if pushstat:
-        print("--", pushstat)
+        for line in pushstat.splitlines():  # With --all-branches, one line per branch.
+            print("--", line)
     if fetchstat:
         print("Outstanding fetches from origin:", fetchstat)
     if commitstat:
@@ -367,9 +1224,41 @@ def print_report(gitrepo, commitstat, pushstat, fetchstat):
 
 def main(argv=None):
     """ Main driver """
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == "query":
+        # `git-status-checker query ...`: Query a running `git-status-checker --serve`.
+        sys.exit(import_submodule("query").main(argv[1:], default_socket=default_socket_path()))
+    if argv and argv[0] == "report":
+        # `git-status-checker report ...`: Trends from the --history database.
+        sys.exit(import_submodule("history").main(
+            argv[1:], default_history_file=os.path.join(default_cache_dir(), "history.sqlite")))
+    if argv and argv[0] == "merge":
+        # `git-status-checker merge ...`: Combine the result files of --shard runs.
+        sys.exit(import_submodule("merge").main(argv[1:]))
     args = process_args(None, argv)
     logging.basicConfig(level=args.get("loglevel", logging.DEBUG),
                         format="%(asctime)s %(levelname)-5s %(name)12s:%(lineno)-4s%(funcName)16s() %(message)s")
+    if args.get("profile") or args.get("print_profile"):
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(check_basedirs, args)
+        finally:
+            profiler.dump_stats(args.get("profile_outputfn") or "git-status-checker.profile")
+            logger.info("Profiling statistics saved to %s", args.get("profile_outputfn"))
+            if args.get("print_profile"):
+                pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(30)
+    else:
+        check_basedirs(args)
+
+
+def check_basedirs(args):
+    """ Find and check all git repositories in the basedirs given by <args> (as returned by process_args()).
+
+    Prints the report and exits (sys.exit) with the exit status.
+    """
     if args['basedirs'] is None:
         args['basedirs'] = []
     if args['dirfile']:
@@ -381,36 +1270,272 @@ def main(argv=None):
     if not args['basedirs']:
         logger.info("Using current directory as basedir: %s", os.path.abspath("."))
         args['basedirs'] = ["."]
-    print("Basedirs:", ", ".join(os.path.abspath(path) for path in args['basedirs']))
-    exit_status = 0     # exit 0 = "No dirty repositories."
+    # With machine-readable output formats, stdout only contains the records:
+    info_file = sys.stdout if args.get("format", "text") == "text" else sys.stderr
+    print("Basedirs:", ", ".join(os.path.abspath(path) for path in args['basedirs']), file=info_file)
+
+    timings = None
+    if args.get("timings"):
+        timings = import_submodule("timings").Timings()
+        timings.start()
+
+    scan_cache = None
+    if args.get("scan_cache") or args.get("rescan"):
+        scan_cache = import_submodule("scan_cache").ScanCache(
+            os.path.join(args.get("cache_dir") or default_cache_dir(), "scan-cache.json"),
+            ignoreglobs=ignoreglobs, followlinks=args.get("followlinks", False),
+            rescan=args.get("rescan", False),
+        )
+        scan_cache.load()
+
+    gitrepos = iter_gitrepos(args['basedirs'], ignoreglobs=ignoreglobs,
+                             followlinks=args.get("followlinks", False), scan_cache=scan_cache,
+                             scan_jobs=args.get("scan_jobs", 1), timings=timings,
+                             worktrees=bool(args.get("worktrees")), submodules=bool(args.get("submodules")))
+    if args.get("shard"):
+        gitrepos = select_shard(gitrepos, *args["shard"])
+
+    fetch_timeout = args.get("fetch_timeout") or None
+    fetch_checker = None
+    fetch_engine = args.get("fetch_engine", "asyncio")
+    if args.get("check_fetch", False) and fetch_engine in ("asyncio", "ls-remote"):
+        fetch_checker_module = import_submodule("fetch_checker")
+        fetch_checker_kwargs = dict(
+            max_concurrency=args.get("fetch_jobs", 8),
+            max_per_host=args.get("fetch_jobs_per_host", 2),
+            timeout=fetch_timeout,
+            on_complete=timings.record if timings is not None else None,
+        )
+        if fetch_engine == "ls-remote":
+            fetch_checker = fetch_checker_module.LsRemoteFetchChecker(
+                cache_file=os.path.join(args.get("cache_dir") or default_cache_dir(), "ls-remote-cache.json"),
+                ttl=args.get("ls_remote_ttl") or 0,
+                **fetch_checker_kwargs)
+        else:
+            fetch_checker = fetch_checker_module.AsyncFetchChecker(**fetch_checker_kwargs)
+        fetch_checker.start()
+    # Machine-readable records only have the number of changed files, so there is no need to list them:
+    max_files = 0 if args.get("format", "text") != "text" else args.get("max_files")
+    status_cache = None
+    if args.get("incremental"):
+        status_cache_module = import_submodule("status_cache")
+        status_cache = status_cache_module.StatusCache(
+            os.path.join(args.get("cache_dir") or default_cache_dir(), "status-cache.json"),
+            max_age=args.get("max_age"),
+            key=status_cache_module.settings_key(
+                ignore_untracked=bool(args.get("ignore_untracked")),
+                check_remote_tracking_branch=args.get("check_remote_tracking_branch", True),
+                max_files=max_files,
+                quick=bool(args.get("summary")),
+                all_branches=bool(args.get("all_branches")),
+                worktrees=bool(args.get("worktrees")),
+            ),
+        )
+        status_cache.load()
+    check_kwargs = dict(
+        jobs=args.get("jobs"),
+        fetch_checker=fetch_checker,
+        fetch=args.get("check_fetch", False) and fetch_checker is None,
+        fetch_timeout=fetch_timeout,
+        backend=args.get("backend", "subprocess"),
+        ignore_untracked=args.get("ignore_untracked"),
+        check_remote_tracking_branch=args.get("check_remote_tracking_branch", True),
+        max_files=max_files,
+        quick=bool(args.get("summary")),
+        all_branches=bool(args.get("all_branches")),
+        worktrees=bool(args.get("worktrees")),
+    )
+    costs = scheduler = None
+    if args.get("schedule") == "adaptive":
+        scheduler_module = import_submodule("scheduler")
+        costs = scheduler_module.CostModel(
+            os.path.join(args.get("cache_dir") or default_cache_dir(), "repo-costs.json"))
+        costs.load()
+        scheduler = scheduler_module.Scheduler(costs, max_jobs=args.get("jobs") or os.cpu_count() or 1,
+                                               max_load=args.get("max_load"))
+    repo_statuses = iter_repo_status(gitrepos, status_cache=status_cache, timings=timings, scheduler=scheduler,
+                                     **check_kwargs)
+    recorder = None
+    if args.get("history"):
+        recorder = import_submodule("history").HistoryRecorder(
+            args.get("history_file") or os.path.join(args.get("cache_dir") or default_cache_dir(), "history.sqlite"),
+            basedirs=[os.path.abspath(path) for path in args['basedirs']])
+        repo_statuses = recorder.record(repo_statuses)
+    statuses = {}  # gitrepo -> status_tup, for --watch and --serve.
+    if args.get("watch") or args.get("serve"):
+        repo_statuses = ((gitrepo, statuses.setdefault(gitrepo, status_tup)) for gitrepo, status_tup in repo_statuses)
+    writer = None
+    if args.get("format", "text") != "text":
+        output = import_submodule("output")
+        # Status transitions (--watch/--serve) are written with the additional TRANSITION_FIELDS:
+        extra_fields = output.TRANSITION_FIELDS if args.get("watch") or args.get("serve") else ()
+        writer = output.make_writer(args["format"], sys.stdout, extra_fields=extra_fields)
+    try:
+        exit_status, nrepos = report_repo_statuses(repo_statuses, args, writer=writer)
+        if status_cache is not None:
+            status_cache.save()
+        if recorder is not None:
+            recorder.save()
+        if costs is not None:
+            costs.save()
+        if timings is not None:
+            timings.stop()
+            timings.print_report(slowest=args.get("slowest", 10))
+        if (args.get("watch") or args.get("serve")) and nrepos:
+            exit_status = watch_and_serve(statuses, args, check_kwargs, writer=writer)
+    finally:
+        if fetch_checker is not None:
+            fetch_checker.close()
+        if writer is not None:
+            writer.close()
+
+    if not nrepos and args.get("shard"):
+        print("No git repositories in shard %s/%s." % args["shard"], file=info_file)
+    elif not nrepos:
+        print("No git repositories found!", file=info_file)
+        sys.exit(127)   # exit 127 = "Error: No repositories found."
+    if exit_status > 0 and args.get('wait'):
+        # Not input(), which prompts on stdout: with --format json etc., stdout is the machine-readable output.
+        print("\nPress Enter to continue... ", end="", file=info_file, flush=True)
+        sys.stdin.readline()
+    sys.exit(exit_status)
 
-    gitrepos = scan_gitrepos(args['basedirs'], ignoreglobs=ignoreglobs,
-                             followlinks=args.get("followlinks", False))
 
-    if not gitrepos:
-        print("No git repositories found!")
-        sys.exit(127)   # exit 127 = "Error: No repositories found."
+def report_repo_statuses(repo_statuses, args, writer=None):
+    """ Print report for each (gitrepo, status_tup) in <repo_statuses>.
 
-    for gitrepo in gitrepos:
+    With args["format"] "jsonl", "json" or "csv", a record is written for every repository (see output.py),
+    otherwise a text report is printed for repositories with outstanding commits, pushes or fetches.
+    If <writer> (from output.make_writer()) is given, records are written with it (and it is not closed).
+
+    Returns:
+        (exit_status, nrepos) two-tuple, where exit_status is 1 if any repository has outstanding
+        commits, pushes or fetches, otherwise 0, and nrepos is the number of repositories reported.
+    """
+    exit_status = 0     # exit 0 = "No dirty repositories."
+    nrepos = 0
+    if args.get("format", "text") != "text":
+        output = import_submodule("output")
+        own_writer = writer is None
+        if own_writer:
+            writer = output.make_writer(args["format"], sys.stdout)
+        try:
+            for gitrepo, status_tup in repo_statuses:
+                nrepos += 1
+                writer.write(output.status_record(gitrepo, status_tup))
+                if any(status_tup):
+                    exit_status = 1
+        except BrokenPipeError:
+            # The reader has gone away (e.g. output piped to `head`), so stop checking.
+            # Redirect stdout to devnull, so flushing it at exit does not raise again.
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        finally:
+            if own_writer:
+                writer.close()
+        return exit_status, nrepos
+    for gitrepo, status_tup in repo_statuses:
+        nrepos += 1
         if args.get('verbose', 0):
-            print(f'Checking git repository: {gitrepo}   ['
+            print(f'Checked git repository: {gitrepo}   ['
                   f'fetch={args.get("check_fetch", False)}, '
                   f'ignore_untracked={args.get("ignore_untracked")}, '
                   f'check_remote_tracking_branch={args.get("check_remote_tracking_branch")}]'
             )
-        commitstat, pushstat, fetchstat = status_tup = check_repo_status(
-            gitrepo, fetch=args.get("check_fetch", False),
-            ignore_untracked=args.get("ignore_untracked"),
-            check_remote_tracking_branch=args.get("check_remote_tracking_branch", True)
-        )
+        commitstat, pushstat, fetchstat = status_tup
         if any(status_tup):
             print_report(gitrepo, commitstat, pushstat, fetchstat)
             exit_status = 1  # exit 1 = "dirty repositories found."
         elif args.get('verbose', 0):
             print(" - No updates found.")
-    if exit_status > 0 and args.get('wait'):
-        input("\nPress Enter to continue... ")
-    sys.exit(exit_status)
+    return exit_status, nrepos
+
+
+def watch_and_serve(statuses, args, check_kwargs, writer=None):
+    """ Keep the status of the repositories up to date (--watch) and/or serve it to clients (--serve).
+
+    Args:
+        statuses: Dict {gitrepo: status_tup} with the current status of the repositories.
+            Updated as repositories are re-checked.
+        args: Dict with args, as returned by process_args().
+        check_kwargs: Keyword arguments for iter_repo_status().
+        writer: Optional writer (from output.make_writer()), for machine-readable output formats.
+
+    Runs until interrupted (Ctrl-C), and then returns the exit status for the current state of the repositories.
+    """
+    lock = threading.Lock()
+
+    def recheck(gitrepos):
+        """ Re-check <gitrepos>, update statuses, and report status transitions. """
+        for gitrepo, status_tup in iter_repo_status(sorted(gitrepos), **check_kwargs):
+            with lock:
+                old_status = statuses[gitrepo]
+                statuses[gitrepo] = status_tup
+                if tuple(status_tup) != tuple(old_status):
+                    report_transition(gitrepo, old_status, status_tup, writer=writer)
+
+    server = None
+    if args.get("serve"):
+        socket_path = args.get("socket") or default_socket_path()
+        server = import_submodule("query").StatusServer(socket_path, statuses, lock, refresh=lambda r: recheck([r]))
+        try:
+            server.start()
+        except OSError as exc:
+            print("Error: Could not serve on %s: %s" % (socket_path, exc), file=sys.stderr)
+            sys.exit(2)
+        print("Serving status queries on %s" % socket_path, file=sys.stderr)
+    try:
+        if args.get("watch"):
+            watch_repos(list(statuses), args, recheck)
+        else:
+            print("Press Ctrl-C to stop.", file=sys.stderr)
+            threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.close()
+    with lock:
+        return 1 if any(any(status_tup) for status_tup in statuses.values()) else 0
+
+
+def watch_repos(gitrepos, args, recheck):
+    """ Watch <gitrepos> for changes, and call recheck(changed_repos) for the repositories that changed.
+
+    Runs until interrupted (raises KeyboardInterrupt on Ctrl-C).
+    """
+    watcher_module = import_submodule("watcher")
+    # Stop `git status` from refreshing the index, since that would cause new events for the repository:
+    os.environ["GIT_OPTIONAL_LOCKS"] = "0"
+    watcher = watcher_module.make_watcher(gitrepos, polling=args.get("watch_poll", False),
+                                          interval=args.get("watch_interval", 2.0))
+    print("Watching %s repositories for changes (press Ctrl-C to stop)..." % len(gitrepos), file=sys.stderr)
+    try:
+        for changed in watcher_module.iter_changes(watcher, debounce=args.get("watch_debounce", 0.5)):
+            logger.debug("Re-checking %s changed repositories: %s", len(changed), sorted(changed))
+            recheck(changed)
+    finally:
+        watcher.close()
+
+
+def report_transition(gitrepo, old_status, new_status, writer=None):
+    """ Report that the status of <gitrepo> has changed from <old_status> to <new_status> (in --watch mode).
+
+    If <writer> is given, a record is written (see output.status_record()), with the additional fields
+    `time` and `previous_dirty` (output.TRANSITION_FIELDS). Otherwise the new status is printed as text.
+    """
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    if writer is not None:
+        record = import_submodule("output").status_record(gitrepo, new_status)
+        record["time"] = now
+        record["previous_dirty"] = bool(any(old_status))
+        writer.write(record)
+        return
+    print("\n[%s] %s changed:" % (now, gitrepo), end="")
+    if any(new_status):
+        print_report(gitrepo, *new_status)
+    else:
+        print("\n%s is now clean." % gitrepo)
+    sys.stdout.flush()
 
 
 def test():
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Functions for reading git repository metadata (HEAD, refs, config) directly from the git directory,
+without running `git`.
+
+These are only used where a cheap, read-only look at the repository is sufficient,
+e.g. to decide whether a repository has changed since it was last checked.
+Anything that is not understood is reported as None, so callers can fall back to running `git`.
+
+Terminology (as in the git documentation):
+* worktree: The checked-out directory, containing a `.git` directory or file.
+* gitdir: The `.git` directory. For linked worktrees and submodules, `.git` is a file with a
+  `gitdir: <path>` line, pointing to the actual git directory.
+* commondir: The git directory shared by all worktrees of a repository (refs, packed-refs, config, objects).
+  Linked worktrees have a `commondir` file in their gitdir, pointing to the commondir.
+
+"""
+
+import os
+import re
+import logging
+logger = logging.getLogger(__name__)
+
+
+def resolve_gitdir(path):
+    """ Return the git directory for repository <path> (a worktree or a bare repository), or None.
+
+    Handles `.git` files with `gitdir: <path>` links (linked worktrees, submodules).
+    """
+    dotgit = os.path.join(path, ".git")
+    if os.path.isdir(dotgit):
+        return dotgit
+    if os.path.isfile(dotgit):
+        try:
+            with open(dotgit) as fp:
+                line = fp.readline().strip()
+        except OSError:
+            return None
+        if not line.startswith("gitdir:"):
+            return None
+        gitdir = line[len("gitdir:"):].strip()
+        return os.path.normpath(os.path.join(path, gitdir))
+    if os.path.isfile(os.path.join(path, "HEAD")) and os.path.isdir(os.path.join(path, "refs")):
+        return path  # bare repository
+    return None
+
+
+def resolve_commondir(gitdir):
+    """ Return the common git directory for <gitdir> (which is gitdir itself, unless it is a linked worktree). """
+    try:
+        with open(os.path.join(gitdir, "commondir")) as fp:
+            commondir = fp.read().strip()
+    except OSError:
+        return gitdir
+    return os.path.normpath(os.path.join(gitdir, commondir))
+
+
+def read_head(gitdir):
+    """ Return the ref that HEAD points to, e.g. "refs/heads/master", or the commit hash if HEAD is detached.
+
+    Returns None if HEAD cannot be read.
+    """
+    try:
+        with open(os.path.join(gitdir, "HEAD")) as fp:
+            head = fp.read().strip()
+    except OSError:
+        return None
+    if head.startswith("ref:"):
+        return head[len("ref:"):].strip()
+    return head
+
+
+_section_regex = re.compile(r'\s*\[\s*([^\]\s"]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]\s*(.*)$')
+_variable_regex = re.compile(r'\s*([A-Za-z][-A-Za-z0-9]*)\s*(?:=\s*(.*?))?\s*$')
+
+
+def read_config(filename, multivalued=False):
+    """ Read git config file and return a dict {(section, subsection): {name: value}}.
+
+    If a variable is given more than once, the last value is used (like `git config --get`), unless
+    <multivalued> is True: then each value is a list of all the variable's values, in order
+    (for multi-valued variables such as `remote.<name>.fetch`).
+    Section and variable names are lower-cased (they are case-insensitive in git), subsection names are not.
+    Only the simple subset of the config syntax used by git itself when writing config files is supported:
+    no line continuations, and values are unquoted (but not otherwise unescaped).
+    `include` and `includeIf` sections are not followed.
+    Returns an empty dict if the file cannot be read.
+    """
+    config = {}
+    section = None
+    try:
+        with open(filename, encoding="utf-8", errors="replace") as fp:
+            lines = fp.readlines()
+    except OSError:
+        return config
+    for line in lines:
+        stripped = line.strip()
+        if not stripped or stripped[0] in "#;":
+            continue
+        match = _section_regex.match(line)
+        if match:
+            name, subsection, rest = match.groups()
+            name = name.lower()
+            if subsection is None and "." in name:
+                # Deprecated [section.subsection] syntax.
+                name, _, subsection = name.partition(".")
+            if subsection is not None:
+                subsection = re.sub(r"\\(.)", r"\1", subsection)
+            section = config.setdefault((name, subsection), {})
+            line = rest
+            if not line.strip():
+                continue
+        if section is None:
+            continue
+        match = _variable_regex.match(line)
+        if match:
+            name, value = match.groups()
+            if value is None:
+                value = "true"  # A variable without a value is a boolean true.
+            value = re.split(r"\s[#;]", value, 1)[0].strip()
+            if len(value) >= 2 and value[0] == value[-1] == '"':
+                value = value[1:-1]
+            if multivalued:
+                section.setdefault(name.lower(), []).append(value)
+            else:
+                section[name.lower()] = value
+    return config
+
+
+def upstream_ref(config, branch):
+    """ Return the remote-tracking ref for local <branch> (e.g. "master"), e.g. "refs/remotes/origin/master".
+
+    Args:
+        config: Config dict, as returned by read_config().
+        branch: Short branch name.
+
+    Returns:
+        The upstream ref, assuming the default fetch refspec, or None if the branch has no upstream.
+    """
+    branch_config = config.get(("branch", branch), {})
+    remote, merge = branch_config.get("remote"), branch_config.get("merge")
+    if not remote or not merge:
+        return None
+    if remote == ".":
+        return merge  # The upstream is a local branch.
+    if merge.startswith("refs/heads/"):
+        merge = merge[len("refs/heads/"):]
+    return "refs/remotes/%s/%s" % (remote, merge)
+
+
+def default_remote(gitdir, config=None):
+    """ Return the name of the remote that `git fetch` uses by default in the repository with git directory <gitdir>.
+
+    That is the remote of the checked-out branch's upstream, falling back to "origin".
+    <config> is the repository's config (as returned by read_config()); it is read if not given.
+    """
+    if config is None:
+        config = read_config(os.path.join(resolve_commondir(gitdir), "config"))
+    head = read_head(gitdir) or ""
+    if head.startswith("refs/heads/"):
+        return config.get(("branch", head[len("refs/heads/"):]), {}).get("remote") or "origin"
+    return "origin"
+
+
+def main_worktree(commondir):
+    """ Return the main worktree of the repository with common git directory <commondir>, or None if it is bare. """
+    core = read_config(os.path.join(commondir, "config")).get(("core", None), {})
+    if core.get("bare", "false").lower() == "true":
+        return None
+    if core.get("worktree"):
+        return os.path.normpath(os.path.join(commondir, core["worktree"]))
+    if os.path.basename(os.path.normpath(commondir)) == ".git":
+        return os.path.dirname(os.path.normpath(commondir))
+    return None
+
+
+def linked_worktrees(commondir):
+    """ Return dict {worktree: gitdir} with the linked worktrees (`git worktree add`) of <commondir>.
+
+    Each linked worktree has a git directory `<commondir>/worktrees/<name>`, whose `gitdir` file
+    points back to the `.git` file in the worktree. Worktrees that no longer exist are not included.
+    """
+    worktrees = {}
+    try:
+        names = sorted(os.listdir(os.path.join(commondir, "worktrees")))
+    except OSError:
+        return worktrees
+    for name in names:
+        gitdir = os.path.join(commondir, "worktrees", name)
+        try:
+            with open(os.path.join(gitdir, "gitdir")) as fp:
+                dotgit = os.path.normpath(os.path.join(gitdir, fp.read().strip()))
+        except OSError:
+            continue
+        if os.path.exists(dotgit):
+            worktrees[os.path.dirname(dotgit)] = gitdir
+    return worktrees
+
+
+def worktree_heads(commondir):
+    """ Return dict {worktree: HEAD} for all worktrees (main and linked) of <commondir>, see read_head(). """
+    heads = {}
+    main = main_worktree(commondir)
+    if main is not None:
+        heads[main] = read_head(commondir)
+    for worktree, gitdir in linked_worktrees(commondir).items():
+        heads[worktree] = read_head(gitdir)
+    return heads
+
+
+def submodule_paths(worktree):
+    """ Return list of the checked-out submodules of <worktree> (paths), as listed in its `.gitmodules` file.
+
+    Submodules that have not been initialized (without a `.git` in the submodule directory) are not included.
+    """
+    paths = []
+    for (section, _), variables in read_config(os.path.join(worktree, ".gitmodules")).items():
+        if section == "submodule" and variables.get("path"):
+            path = os.path.normpath(os.path.join(worktree, variables["path"]))
+            if os.path.exists(os.path.join(path, ".git")):
+                paths.append(path)
+    return paths
+
+
+def stat_fingerprint(path):
+    """ Return (mtime_ns, size, inode) for <path>, or None if it does not exist. """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def repo_fingerprint(worktree, all_branches=False):
+    """ Return a fingerprint of the state of the repository at <worktree> (or None if it is not a repository).
+
+    The fingerprint consists of the stat info (mtime, size, inode) of:
+    * the index, HEAD, and the ref HEAD points to (the checked-out branch),
+    * packed-refs and config (which also holds the branch's upstream configuration),
+    * the upstream (remote-tracking) ref of the checked-out branch,
+    * the worktree's top-level directory (which changes when files are added/removed at the top level).
+    plus the contents of HEAD.
+    If <all_branches> is True, the stat info of all loose refs under refs/heads and refs/remotes is included
+    (for `--all-branches`). If HEAD is detached, the loose refs under refs/remotes are included
+    (their commits determine whether HEAD has been pushed).
+    If the fingerprint has not changed, it is very likely that `git status` will give the same result.
+    However, modifications to already-tracked files, or files added in sub-directories, do not change
+    the fingerprint.
+    """
+    gitdir = resolve_gitdir(worktree)
+    if gitdir is None:
+        return None
+    commondir = resolve_commondir(gitdir)
+    head = read_head(gitdir)
+    refs = []
+    if head and head.startswith("refs/"):
+        refs.append(head)
+        if head.startswith("refs/heads/"):
+            upstream = upstream_ref(read_config(os.path.join(commondir, "config")), head[len("refs/heads/"):])
+            if upstream:
+                refs.append(upstream)
+    elif head and not all_branches:
+        refs += _loose_refs(commondir, ("refs/remotes",))
+    return [
+        head,
+        stat_fingerprint(os.path.join(gitdir, "index")),
+        stat_fingerprint(os.path.join(gitdir, "HEAD")),
+        stat_fingerprint(os.path.join(commondir, "packed-refs")),
+        stat_fingerprint(os.path.join(commondir, "config")),
+        stat_fingerprint(worktree),
+    ] + [[ref, stat_fingerprint(os.path.join(commondir, ref))] for ref in refs + (
+        _loose_refs(commondir, ("refs/heads", "refs/remotes")) if all_branches else [])]
+
+
+def _loose_refs(commondir, prefixes):
+    """ Return sorted list of the loose refs (e.g. "refs/heads/feature/x") under <prefixes> in <commondir>. """
+    refs = []
+    for prefix in prefixes:
+        for dirpath, _, filenames in os.walk(os.path.join(commondir, prefix)):
+            relpath = os.path.relpath(dirpath, commondir).replace(os.sep, "/")
+            refs.extend(relpath + "/" + filename for filename in filenames if not filename.endswith(".lock"))
+    return sorted(refs)
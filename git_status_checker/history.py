@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Result history (`--history`) and trend reports (`git-status-checker report`).
+
+With --history, the status of every checked repository is recorded in a SQLite database
+(default `~/.cache/git-status-checker/history.sqlite`), with one row per run and one row per repository per run.
+Results are kept in memory during the run, and written in a single transaction when the run has finished,
+so recording adds no per-repository disk writes.
+
+`git-status-checker report` then lists:
+* Repositories that have been dirty for a long time (in every run since some date, at least --min-days ago).
+* Repositories that are newly dirty, i.e. dirty in their latest run, but clean in the run before.
+* The slowest repositories to check, averaged over the runs in the report period.
+* The most recent runs, with the number of repositories, dirty repositories, and run time,
+  to see whether scan times are growing.
+
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import logging
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,      -- Unix time.
+    duration REAL,              -- Seconds.
+    basedirs TEXT,              -- JSON list.
+    nrepos INTEGER,
+    ndirty INTEGER
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    path TEXT NOT NULL,
+    dirty INTEGER NOT NULL,     -- 1 if there is anything to commit, push or fetch.
+    commits INTEGER NOT NULL,   -- 1 if there are changes to commit.
+    pushes INTEGER NOT NULL,    -- 1 if there are commits to push (or no upstream).
+    fetches INTEGER NOT NULL,   -- 1 if there are changes to fetch.
+    branch TEXT,
+    error TEXT,
+    duration REAL               -- Seconds it took to check the repository.
+);
+CREATE INDEX IF NOT EXISTS results_path ON results (path, run_id);
+CREATE INDEX IF NOT EXISTS results_run ON results (run_id);
+"""
+
+
+def connect(filename):
+    """ Open (and create, if needed) the history database <filename>, and return the connection. """
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    connection = sqlite3.connect(filename, timeout=30)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+class HistoryRecorder:
+    """ Record the results of a run, and write them to the history database when the run has finished.
+
+    Usage:
+        recorder = HistoryRecorder(filename, basedirs)
+        repo_statuses = recorder.record(repo_statuses)   # Pass-through generator.
+        ...
+        recorder.save()
+    """
+
+    def __init__(self, filename, basedirs=()):
+        self.filename = filename
+        self.basedirs = list(basedirs)
+        self.started = time.time()
+        self.rows = []
+
+    def add(self, gitrepo, status_tup):
+        """ Add the result <status_tup> (RepoStatus) for <gitrepo>.
+
+        The absolute path is recorded (like status_cache.py and scan_cache.py), so the results of runs
+        started from different working directories are recorded for the same repository.
+        """
+        commitstat, pushstat, fetchstat = status_tup
+        details = getattr(status_tup, "details", {})
+        self.rows.append((os.path.abspath(gitrepo), int(any(status_tup)), int(bool(commitstat)), int(bool(pushstat)),
+                          int(bool(fetchstat)), details.get("branch"), details.get("error"), details.get("duration")))
+
+    def record(self, repo_statuses):
+        """ Yield each (gitrepo, status_tup) in <repo_statuses>, adding it to the results. """
+        for gitrepo, status_tup in repo_statuses:
+            self.add(gitrepo, status_tup)
+            yield gitrepo, status_tup
+
+    def save(self):
+        """ Write the run and all results to the database, in one transaction. Returns the run id. """
+        try:
+            connection = connect(self.filename)
+        except (OSError, sqlite3.Error) as exc:
+            logger.warning("Could not open history database %s: %s", self.filename, exc)
+            return None
+        try:
+            with connection:
+                cursor = connection.execute(
+                    "INSERT INTO runs (started, duration, basedirs, nrepos, ndirty) VALUES (?, ?, ?, ?, ?)",
+                    (self.started, time.time() - self.started, json.dumps(self.basedirs),
+                     len(self.rows), sum(row[1] for row in self.rows)))
+                run_id = cursor.lastrowid
+                connection.executemany(
+                    "INSERT INTO results (run_id, path, dirty, commits, pushes, fetches, branch, error, duration) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [(run_id,) + row for row in self.rows])
+        except sqlite3.Error as exc:
+            logger.warning("Could not write history database %s: %s", self.filename, exc)
+            return None
+        finally:
+            connection.close()
+        logger.info("Recorded %s results (run %s) in %s", len(self.rows), run_id, self.filename)
+        return run_id
+
+
+def long_dirty(connection, since, min_age):
+    """ Return list of (path, dirty_since, nruns) for repositories that have been dirty for at least <min_age> seconds.
+
+    Only repositories checked after <since> (Unix time) are included. dirty_since is the time of the first run
+    in which the repository was dirty, after the last run in which it was clean; nruns is the number of runs since.
+    """
+    rows = connection.execute("""
+        SELECT r.path, MIN(runs.started), COUNT(*), MAX(runs.started)
+        FROM results r JOIN runs ON runs.id = r.run_id
+        LEFT JOIN (SELECT path, MAX(run_id) AS run_id FROM results WHERE dirty = 0 GROUP BY path) clean
+            ON clean.path = r.path
+        WHERE r.run_id > COALESCE(clean.run_id, 0)
+        GROUP BY r.path
+        HAVING MAX(runs.started) >= ? AND MIN(runs.started) <= ?
+        ORDER BY MIN(runs.started), r.path
+    """, (since, time.time() - min_age)).fetchall()
+    return [row[:3] for row in rows]
+
+
+def newly_dirty(connection, since):
+    """ Return list of (path, checked, previously) for repositories that were dirty in their latest run,
+    but not in the run before. previously is "clean", or "new" if the repository had not been checked before.
+    """
+    rows = connection.execute("""
+        SELECT path, started, dirty, previous FROM (
+            SELECT r.path, runs.started, r.dirty,
+                   LAG(r.dirty) OVER (PARTITION BY r.path ORDER BY r.run_id) AS previous,
+                   ROW_NUMBER() OVER (PARTITION BY r.path ORDER BY r.run_id DESC) AS age
+            FROM results r JOIN runs ON runs.id = r.run_id
+        )
+        WHERE age = 1 AND dirty = 1 AND (previous IS NULL OR previous = 0) AND started >= ?
+        ORDER BY path
+    """, (since,)).fetchall()
+    return [(path, started, "new" if previous is None else "clean") for path, started, _, previous in rows]
+
+
+def slowest(connection, since, limit=10):
+    """ Return list of (path, average duration, max duration, nruns) for the <limit> slowest repositories. """
+    return connection.execute("""
+        SELECT r.path, AVG(r.duration), MAX(r.duration), COUNT(*)
+        FROM results r JOIN runs ON runs.id = r.run_id
+        WHERE runs.started >= ? AND r.duration IS NOT NULL
+        GROUP BY r.path
+        ORDER BY AVG(r.duration) DESC
+        LIMIT ?
+    """, (since, limit)).fetchall()
+
+
+def recent_runs(connection, limit=10):
+    """ Return list of (started, nrepos, ndirty, duration) for the <limit> most recent runs, oldest first. """
+    rows = connection.execute("SELECT started, nrepos, ndirty, duration FROM runs ORDER BY id DESC LIMIT ?",
+                              (limit,)).fetchall()
+    return rows[::-1]
+
+
+def _format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp))
+
+
+def _format_age(seconds):
+    days = seconds / 86400
+    return "%.0f days" % days if days >= 1 else "%.1f hours" % (seconds / 3600)
+
+
+def main(argv, default_history_file):
+    """ The `git-status-checker report` command. Returns the exit status (0, or 2 if there is no history). """
+    parser = argparse.ArgumentParser(
+        prog="git-status-checker report",
+        description="Report trends from the result history recorded with `git-status-checker --history`.")
+    parser.add_argument("--history-file", default=default_history_file, help="History database. Default: %(default)s")
+    parser.add_argument("--days", type=float, default=30,
+                        help="Only include runs from the last DAYS days. Default: 30.")
+    parser.add_argument("--min-days", type=float, default=7,
+                        help="Report repositories that have been dirty for at least this many days. Default: 7.")
+    parser.add_argument("--slowest", type=int, default=10, help="Number of slowest repositories to list. Default: 10.")
+    parser.add_argument("--runs", type=int, default=10, help="Number of recent runs to list. Default: 10.")
+    parser.add_argument("--format", choices=("text", "json"), default="text", help="Output format.")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.history_file):
+        print("No history found at %s. Run git-status-checker with --history first." % args.history_file,
+              file=sys.stderr)
+        return 2
+    now = time.time()
+    since = now - args.days * 86400
+    connection = connect(args.history_file)
+    try:
+        report = {
+            "long_dirty": long_dirty(connection, since, args.min_days * 86400),
+            "newly_dirty": newly_dirty(connection, since),
+            "slowest": slowest(connection, since, args.slowest),
+            "runs": recent_runs(connection, args.runs),
+        }
+    finally:
+        connection.close()
+
+    if args.format == "json":
+        print(json.dumps({
+            "long_dirty": [{"path": path, "dirty_since": dirty_since, "runs": nruns}
+                           for path, dirty_since, nruns in report["long_dirty"]],
+            "newly_dirty": [{"path": path, "checked": checked, "previously": previously}
+                            for path, checked, previously in report["newly_dirty"]],
+            "slowest": [{"path": path, "mean_duration": mean, "max_duration": maximum, "runs": nruns}
+                        for path, mean, maximum, nruns in report["slowest"]],
+            "runs": [{"started": started, "repos": nrepos, "dirty": ndirty, "duration": duration}
+                     for started, nrepos, ndirty, duration in report["runs"]],
+        }, indent=1))
+        return 0
+
+    print("Dirty for at least %s days:" % args.min_days)
+    for path, dirty_since, nruns in report["long_dirty"]:
+        print("  %s  dirty for %s (since %s, %s runs)" % (path, _format_age(now - dirty_since),
+                                                         _format_time(dirty_since), nruns))
+    if not report["long_dirty"]:
+        print("  (none)")
+    print("\nNewly dirty (clean in the previous run):")
+    for path, checked, previously in report["newly_dirty"]:
+        print("  %s  (%s)" % (path, "first checked " + _format_time(checked) if previously == "new"
+                              else _format_time(checked)))
+    if not report["newly_dirty"]:
+        print("  (none)")
+    print("\nSlowest repositories (mean/max check time over the last %s days):" % args.days)
+    for path, mean, maximum, nruns in report["slowest"]:
+        print("  %7.3f s  %7.3f s  %s  (%s runs)" % (mean, maximum, path, nruns))
+    print("\nRecent runs:")
+    for started, nrepos, ndirty, duration in report["runs"]:
+        print("  %s  %5s repositories  %5s dirty  %7.2f s" % (_format_time(started), nrepos, ndirty, duration or 0))
+    return 0
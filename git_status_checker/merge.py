@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Merge result files from sharded runs (`git-status-checker merge`).
+
+With `--shard K/N`, N independent git-status-checker processes (e.g. on different hosts) each check
+their own share of the repositories, writing their results with `--format jsonl` (or `json`).
+`git-status-checker merge` combines these result files into one report, with a single exit status:
+
+    for k in 1 2 3 4; do git-status-checker --shard $k/4 --format jsonl ~/code > shard-$k.jsonl & done; wait
+    git-status-checker merge shard-*.jsonl
+
+Records are sorted by path. If a repository occurs in more than one file, the first record is used.
+
+"""
+
+import sys
+import json
+import argparse
+import logging
+logger = logging.getLogger(__name__)
+
+if __package__:
+    from . import output
+else:
+    import output
+
+
+def read_records(filename):
+    """ Return list of the status records in result file <filename> ("-" for stdin).
+
+    The file can be in `--format jsonl` (one record per line) or `--format json` (an array of records).
+    Raises ValueError, saying which line (or array element) is bad, if a record cannot be parsed or has no "path".
+    """
+    if filename == "-":
+        content = sys.stdin.read()
+    else:
+        with open(filename, encoding="utf-8") as fp:
+            content = fp.read()
+    if content.lstrip().startswith("["):
+        records = json.loads(content)
+        if not isinstance(records, list):
+            raise ValueError("not an array of records")
+        numbered = [("record %s" % number, record) for number, record in enumerate(records, 1)]
+    else:
+        numbered = [("line %s" % number, parse_line("line %s" % number, line))
+                    for number, line in enumerate(content.splitlines(), 1) if line.strip()]
+    records = []
+    for where, record in numbered:
+        if not isinstance(record, dict) or not isinstance(record.get("path"), str):
+            raise ValueError('%s: not a status record with a "path"' % where)
+        records.append(record)
+    return records
+
+
+def parse_line(where, line):
+    """ Parse a line of a jsonl result file. Raises ValueError with <where> (e.g. "line 3") if it is not JSON. """
+    try:
+        return json.loads(line)
+    except ValueError as exc:
+        raise ValueError("%s: %s" % (where, exc))
+
+
+def print_record(record):
+    """ Print text report for a dirty repository, given its status record. """
+    changes = ", ".join("%s %s" % (count, state) for state, count in (record.get("changes") or {}).items() if count)
+    outstanding = [kind for kind, value in (("commits", changes), ("pushes", record.get("push")),
+                                            ("fetches", record.get("fetch"))) if value]
+    print("\n" + record["path"], "has outstanding", ", ".join(outstanding), ":")
+    if record.get("error"):
+        print("-- error:", record["error"])
+    for line in (record.get("push") or "").splitlines():
+        print("--", line)
+    if record.get("fetch"):
+        print("Outstanding fetches from origin:", record["fetch"])
+    if changes:
+        print("-- outstanding commits:", changes)
+
+
+def main(argv):
+    """ The `git-status-checker merge` command. Returns the exit status.
+
+    Exit status: 0 if no repositories are dirty, 1 if any repository is dirty, 2 if a result file
+    cannot be read, and 127 if the result files have no records (as for an ordinary run that finds no repositories).
+    """
+    parser = argparse.ArgumentParser(
+        prog="git-status-checker merge",
+        description="Merge result files written by `git-status-checker --shard K/N --format jsonl` (or json) "
+                    "into one report.")
+    parser.add_argument("--format", choices=("text", "jsonl", "json", "csv"), default="text",
+                        help="Output format. 'text' (default) prints a report for the dirty repositories, "
+                        "the other formats write all records (see `git-status-checker --format`).")
+    parser.add_argument("files", nargs="+", metavar="FILE", help="Result files ('-' for stdin).")
+    args = parser.parse_args(argv)
+
+    records = {}
+    for filename in args.files:
+        try:
+            file_records = read_records(filename)
+        except (OSError, ValueError) as exc:
+            print("Could not read result file %s: %s" % (filename, exc), file=sys.stderr)
+            return 2
+        for record in file_records:
+            records.setdefault(record["path"], record)
+    logger.info("Merged %s records from %s files.", len(records), len(args.files))
+
+    writer = output.make_writer(args.format, sys.stdout) if args.format != "text" else None
+    for path in sorted(records):
+        record = {field: records[path].get(field) for field in output.FIELDS}
+        if writer is not None:
+            writer.write(record)
+        elif record["dirty"]:
+            print_record(record)
+    if writer is not None:
+        writer.close()
+    if not records:
+        print("No repositories in the result files!", file=sys.stderr)
+        return 127
+    return 1 if any(record.get("dirty") for record in records.values()) else 0
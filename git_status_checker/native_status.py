@@ -0,0 +1,777 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+In-process backends for reading repository status without running `git status` (`--backend`).
+
+Two backends are available:
+
+* "pygit2": Uses the pygit2 library (libgit2 bindings), if it is installed.
+    Gives the full status, including the list of changed files and ahead/behind counts.
+
+* "native": A pure-python reader of HEAD, refs, packed-refs, config, the index, and .gitignore files.
+    This is a fast path for the common case: a clean repository in sync with its upstream (or without one).
+    It checks that
+    * HEAD is a branch whose ref is equal to its upstream's ref (or the branch has no upstream),
+    * the index matches HEAD (the index' cache-tree is valid and equal to HEAD's tree),
+    * every tracked file's stat information matches the index,
+    * there are no untracked, non-ignored files (unless untracked files are ignored).
+    If any of these do not hold, or the repository uses a feature the reader does not understand
+    (submodules, sparse checkout, index v4, split index, reftable, sha256, config includes, etc.),
+    Unsupported is raised, and the caller falls back to running `git status`, which then
+    produces the exact list of changes. The native backend is thus conservative: it may fall back
+    for a repository that is clean, but never reports a dirty repository as clean.
+
+Both backends return a dict with the same information that is parsed from `git status --porcelain=v2 --branch -z`:
+    local_branch:   Checked-out branch (short name).
+    remote:         Remote of the upstream branch, or None if the branch has no upstream.
+    remote_branch:  Upstream branch name on the remote, or None.
+    ahead_behind:   E.g. "ahead 1", "behind 2", "ahead 1, behind 2", or None if in sync.
+    files_status:   List of changed files, as `git status --porcelain=v1` lines ("XY path").
+
+"""
+
+import os
+import re
+import stat
+import mmap
+import zlib
+import glob
+import struct
+import logging
+logger = logging.getLogger(__name__)
+
+if __package__:
+    from . import gitdir as gd
+else:
+    import gitdir as gd
+
+
+def parsed_like_subprocess(local_branch, remote):
+    """ Return True if the subprocess backend gets the same branch and remote names from `git status`.
+
+    `git status --porcelain=v2 --branch -z` gives the branch name as is, so any branch name is parsed correctly,
+    except "(detached)", which means HEAD is detached. The upstream is given as "<remote>/<branch>",
+    which is split at the first "/" (see porcelain.py), so remote names containing "/" are not parsed correctly.
+    For these names we fall back, so the result is always the same as with the subprocess backend.
+    """
+    return local_branch != "(detached)" and (remote is None or "/" not in remote)
+
+
+OBJECT_TYPES = {1: "commit", 2: "tree", 3: "blob", 4: "tag"}
+
+
+class Unsupported(Exception):
+    """ Raised when a backend cannot (or cannot cheaply) determine the status of a repository. """
+
+
+#########################
+# Config and refs
+#########################
+
+
+def read_config_checked(filename):
+    """ Read git config file, raising Unsupported if it uses includes (which read_config does not follow). """
+    config = gd.read_config(filename)
+    if any(section in ("include", "includeif") for section, _ in config):
+        raise Unsupported("config file %s uses includes" % filename)
+    return config
+
+
+def config_value(configs, section, name, default=None):
+    """ Return the value of <section>.<name> from the last config in <configs> that defines it. """
+    for config in reversed(configs):
+        value = config.get((section, None), {}).get(name)
+        if value is not None:
+            return value
+    return default
+
+
+def config_bool(value, default):
+    if value is None:
+        return default
+    return value.lower() in ("true", "yes", "on", "1")
+
+
+def global_config_files():
+    """ Return the system and global git config files, in increasing order of precedence. """
+    files = []
+    if os.name != "nt" and not os.environ.get("GIT_CONFIG_NOSYSTEM"):
+        files.append(os.environ.get("GIT_CONFIG_SYSTEM") or "/etc/gitconfig")
+    if os.environ.get("GIT_CONFIG_GLOBAL"):
+        files.append(os.environ["GIT_CONFIG_GLOBAL"])
+    else:
+        xdg = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+        files.append(os.path.join(xdg, "git", "config"))
+        files.append(os.path.join(os.path.expanduser("~"), ".gitconfig"))
+    return files
+
+
+def read_packed_refs(commondir):
+    """ Return dict {refname: sha} from packed-refs (empty dict if there is no packed-refs file). """
+    refs = {}
+    try:
+        with open(os.path.join(commondir, "packed-refs")) as fp:
+            for line in fp:
+                if line.startswith(("#", "^")):
+                    continue
+                sha, _, refname = line.strip().partition(" ")
+                refs[refname] = sha
+    except FileNotFoundError:
+        pass
+    return refs
+
+
+def resolve_ref(commondir, refname, packed_refs=None):
+    """ Return the commit hash that <refname> points to (following symbolic refs), or None if it does not exist. """
+    for _ in range(5):
+        try:
+            with open(os.path.join(commondir, refname)) as fp:
+                value = fp.read().strip()
+        except (FileNotFoundError, NotADirectoryError):
+            if packed_refs is None:
+                packed_refs = read_packed_refs(commondir)
+            return packed_refs.get(refname)
+        if not value.startswith("ref:"):
+            return value
+        refname = value[len("ref:"):].strip()
+    raise Unsupported("too many levels of symbolic refs")
+
+
+#########################
+# Objects
+#########################
+
+
+def apply_delta(base, delta):
+    """ Apply git pack delta <delta> to <base> and return the result. """
+    def read_varint(pos):
+        value = shift = 0
+        while True:
+            byte = delta[pos]
+            pos += 1
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                return value, pos
+    base_size, pos = read_varint(0)
+    result_size, pos = read_varint(pos)
+    if base_size != len(base):
+        raise Unsupported("corrupt delta")
+    out = bytearray()
+    while pos < len(delta):
+        cmd = delta[pos]
+        pos += 1
+        if cmd & 0x80:
+            offset = size = 0
+            for i in range(4):
+                if cmd & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if cmd & (0x10 << i):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            out += base[offset:offset + (size or 0x10000)]
+        elif cmd:
+            out += delta[pos:pos + cmd]
+            pos += cmd
+        else:
+            raise Unsupported("corrupt delta")
+    if len(out) != result_size:
+        raise Unsupported("corrupt delta")
+    return bytes(out)
+
+
+class PackFile:
+    """ A pack file and its (version 2) index. """
+
+    def __init__(self, idxfile):
+        self.idxfile = idxfile
+        self.packfile = idxfile[:-len(".idx")] + ".pack"
+        with open(idxfile, "rb") as fp:
+            self.idx = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.idx[:8] != b"\xfftOc\x00\x00\x00\x02":
+            self.idx.close()
+            raise Unsupported("unsupported pack index version: %s" % idxfile)
+        self.fanout = struct.unpack_from(">256I", self.idx, 8)
+        self.count = self.fanout[255]
+        self.pack = None
+
+    def close(self):
+        self.idx.close()
+        if self.pack is not None:
+            self.pack.close()
+
+    def find(self, sha):
+        """ Return the pack offset of object <sha> (20 bytes), or None if it is not in this pack. """
+        lo = self.fanout[sha[0] - 1] if sha[0] else 0
+        hi = self.fanout[sha[0]]
+        base = 8 + 1024
+        while lo < hi:
+            mid = (lo + hi) // 2
+            candidate = self.idx[base + 20 * mid:base + 20 * mid + 20]
+            if candidate < sha:
+                lo = mid + 1
+            elif candidate > sha:
+                hi = mid
+            else:
+                offsets = base + 24 * self.count
+                offset, = struct.unpack_from(">I", self.idx, offsets + 4 * mid)
+                if offset & 0x80000000:
+                    large_offsets = offsets + 4 * self.count
+                    offset, = struct.unpack_from(">Q", self.idx, large_offsets + 8 * (offset & 0x7fffffff))
+                return offset
+        return None
+
+    def read_at(self, offset, reader):
+        """ Return (type, data) for the object at <offset>, resolving deltas (using <reader> for REF_DELTA). """
+        if self.pack is None:
+            with open(self.packfile, "rb") as fp:
+                self.pack = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        pack = self.pack
+        pos = offset
+        byte = pack[pos]
+        pos += 1
+        objtype = (byte >> 4) & 7
+        while byte & 0x80:
+            byte = pack[pos]
+            pos += 1
+        if objtype == 6:  # OFS_DELTA
+            byte = pack[pos]
+            pos += 1
+            base_offset = byte & 0x7f
+            while byte & 0x80:
+                byte = pack[pos]
+                pos += 1
+                base_offset = ((base_offset + 1) << 7) | (byte & 0x7f)
+            base_type, base = self.read_at(offset - base_offset, reader)
+            return base_type, apply_delta(base, self._inflate(pos))
+        if objtype == 7:  # REF_DELTA
+            base_type, base = reader.read(pack[pos:pos + 20])
+            return base_type, apply_delta(base, self._inflate(pos + 20))
+        if objtype not in OBJECT_TYPES:
+            raise Unsupported("unknown object type %s in %s" % (objtype, self.packfile))
+        return OBJECT_TYPES[objtype], self._inflate(pos)
+
+    def _inflate(self, pos, chunksize=65536):
+        decompressor = zlib.decompressobj()
+        chunks = []
+        view = memoryview(self.pack)
+        try:
+            while not decompressor.eof and pos < len(self.pack):
+                chunks.append(decompressor.decompress(view[pos:pos + chunksize]))
+                pos += chunksize
+        finally:
+            view.release()
+        return b"".join(chunks)
+
+
+class ObjectReader:
+    """ Read objects from a git object database (loose objects and packs, including alternates). """
+
+    def __init__(self, commondir):
+        self.objdirs = [os.path.join(commondir, "objects")]
+        try:
+            with open(os.path.join(self.objdirs[0], "info", "alternates")) as fp:
+                for line in fp:
+                    line = line.strip()
+                    if line and not line.startswith("#"):
+                        self.objdirs.append(os.path.normpath(os.path.join(self.objdirs[0], line)))
+        except FileNotFoundError:
+            pass
+        self.packs = None
+
+    def close(self):
+        for pack in self.packs or ():
+            pack.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read(self, sha):
+        """ Return (type, data) for object <sha> (hex string or 20 bytes). """
+        if isinstance(sha, str):
+            sha = bytes.fromhex(sha)
+        hexsha = sha.hex()
+        for objdir in self.objdirs:
+            try:
+                with open(os.path.join(objdir, hexsha[:2], hexsha[2:]), "rb") as fp:
+                    raw = zlib.decompress(fp.read())
+            except FileNotFoundError:
+                continue
+            header, _, data = raw.partition(b"\0")
+            return header.split(b" ")[0].decode(), data
+        if self.packs is None:
+            self.packs = [PackFile(idxfile) for objdir in self.objdirs
+                          for idxfile in sorted(glob.glob(os.path.join(objdir, "pack", "*.idx")))]
+        for pack in self.packs:
+            offset = pack.find(sha)
+            if offset is not None:
+                return pack.read_at(offset, self)
+        raise Unsupported("object %s not found" % hexsha)
+
+    def commit_tree(self, sha):
+        """ Return the tree hash (hex) of commit <sha>. """
+        objtype, data = self.read(sha)
+        if objtype != "commit" or not data.startswith(b"tree "):
+            raise Unsupported("%s is not a commit" % sha)
+        return data[5:45].decode()
+
+
+#########################
+# Index
+#########################
+
+
+def read_index(indexfile):
+    """ Read git index file.
+
+    Returns:
+        (entries, tree) two-tuple, where entries is a list of
+        (path, mode, mtime_s, mtime_ns, ctime_s, ctime_ns, ino, size) tuples (path is a str),
+        and tree is the hex hash of the root of the cache-tree extension, or None if the cache-tree is invalid.
+
+    Raises Unsupported for index features that affect the status in ways we do not handle
+    (index v4, conflicts, assume-unchanged, skip-worktree, intent-to-add, split index, sparse index).
+    """
+    with open(indexfile, "rb") as fp:
+        data = fp.read()
+    signature, version, count = struct.unpack_from(">4sII", data, 0)
+    if signature != b"DIRC" or version not in (2, 3):
+        raise Unsupported("unsupported index version %s" % version)
+    entries = []
+    pos = 12
+    unpack_stat = struct.Struct(">10I").unpack_from
+    unpack_flags = struct.Struct(">H").unpack_from
+    for _ in range(count):
+        ctime_s, ctime_ns, mtime_s, mtime_ns, _dev, ino, mode, _uid, _gid, size = unpack_stat(data, pos)
+        flags, = unpack_flags(data, pos + 60)
+        namepos = pos + 62
+        if flags & 0x8000:
+            raise Unsupported("assume-unchanged entries")
+        if flags & 0x3000:
+            raise Unsupported("unmerged entries")
+        if flags & 0x4000:
+            extended_flags, = unpack_flags(data, namepos)
+            if extended_flags & 0x6000:
+                raise Unsupported("skip-worktree or intent-to-add entries")
+            namepos += 2
+        namelen = flags & 0xfff
+        end = namepos + namelen if namelen < 0xfff else data.index(b"\0", namepos)
+        path = os.fsdecode(data[namepos:end])
+        entries.append((path, mode, mtime_s, mtime_ns, ctime_s, ctime_ns, ino, size))
+        pos += (end - pos + 8) & ~7
+    tree = None
+    while pos + 8 <= len(data) - 20:
+        signature, size = struct.unpack_from(">4sI", data, pos)
+        if signature in (b"link", b"sdir"):
+            raise Unsupported("split or sparse index")
+        if signature == b"TREE":
+            end = data.index(b"\n", pos + 8)
+            path, _, counts = data[pos + 8:end].partition(b"\0")
+            entry_count = int(counts.split(b" ")[0])
+            if path == b"" and entry_count == count:
+                tree = data[end + 1:end + 21].hex()
+        pos += 8 + size
+    return entries, tree
+
+
+def stat_matches(entry, st, filemode=True, trustctime=True):
+    """ Return True if stat result <st> matches index <entry> (the file has not been modified).
+
+    Compared to git, this is conservative: we compare all the stat information that git has recorded,
+    and a mismatch simply means that we fall back to `git status`.
+    """
+    _, mode, mtime_s, mtime_ns, ctime_s, ctime_ns, ino, size = entry
+    if mode == 0o120000:
+        if not stat.S_ISLNK(st.st_mode):
+            return False
+    elif mode in (0o100644, 0o100755):
+        if not stat.S_ISREG(st.st_mode):
+            return False
+        if filemode and bool(st.st_mode & 0o100) != bool(mode & 0o100):
+            return False
+    else:
+        return False
+    if (st.st_size & 0xffffffff) != size:
+        return False
+    if int(st.st_mtime_ns // 1000000000) & 0xffffffff != mtime_s:
+        return False
+    if mtime_ns and st.st_mtime_ns % 1000000000 != mtime_ns:
+        return False
+    if trustctime and ctime_s:
+        if int(st.st_ctime_ns // 1000000000) & 0xffffffff != ctime_s:
+            return False
+        if ctime_ns and st.st_ctime_ns % 1000000000 != ctime_ns:
+            return False
+    if ino and (st.st_ino & 0xffffffff) != ino:
+        return False
+    return True
+
+
+#########################
+# Ignore rules
+#########################
+
+
+def gitignore_regex(pattern):
+    """ Translate gitignore glob <pattern> (without leading "!" or trailing "/") into a regular expression. """
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        char = pattern[i]
+        if char == "*":
+            j = i
+            while j < n and pattern[j] == "*":
+                j += 1
+            if j - i >= 2 and (i == 0 or pattern[i - 1] == "/") and (j == n or pattern[j] == "/"):
+                if j == n:
+                    out.append(".*")            # trailing "**": everything inside.
+                    i = j
+                else:
+                    out.append("(?:.*/)?")      # "**/": zero or more directories.
+                    i = j + 1
+                continue
+            out.append("[^/]*")
+            i = j
+            continue
+        if char == "?":
+            out.append("[^/]")
+        elif char == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        elif char == "[":
+            j = i + 1
+            if j < n and pattern[j] in "!^":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                if pattern[j] == "\\":
+                    j += 1
+                elif pattern.startswith("[:", j):
+                    raise Unsupported("character classes in gitignore patterns")
+                j += 1
+            if j >= n:
+                out.append(re.escape(char))     # No closing bracket; a literal "[".
+            else:
+                body = pattern[i + 1:j]
+                negate = body[:1] in ("!", "^")
+                if negate:
+                    body = body[1:]
+                body = re.sub(r"\\(.)", r"\1", body).replace("\\", "\\\\").replace("^", "\\^").replace("[", "\\[")
+                out.append("(?!/)[%s%s]" % ("^" if negate else "", body))
+                i = j
+        else:
+            out.append(re.escape(char))
+        i += 1
+    return "".join(out) + r"\Z"
+
+
+def parse_gitignore(lines, flags=0):
+    """ Parse gitignore lines and return list of (regex_match, negate, dir_only, anchored) tuples. """
+    patterns = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line or line.startswith("#"):
+            continue
+        while line.endswith(" ") and not line.endswith("\\ "):
+            line = line[:-1]
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        dir_only = line.endswith("/")
+        if dir_only:
+            line = line[:-1]
+        if not line:
+            continue
+        anchored = "/" in line
+        if line.startswith("/"):
+            line = line[1:]
+        patterns.append((re.compile(gitignore_regex(line), flags).match, negate, dir_only, anchored))
+    return patterns
+
+
+def read_gitignore(filename, flags=0):
+    try:
+        with open(filename, encoding="utf-8", errors="surrogateescape") as fp:
+            return parse_gitignore(fp, flags)
+    except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+        return []
+
+
+def is_ignored(relpath, is_dir, pattern_stack):
+    """ Return True if <relpath> is ignored.
+
+    Args:
+        relpath: Path relative to the worktree root, "/"-separated.
+        is_dir: Whether relpath is a directory.
+        pattern_stack: List of (basedir, patterns) for the applicable ignore files, in increasing
+            order of precedence, where basedir is the directory (relative to the worktree root,
+            "" for the root) that anchored patterns are relative to.
+    """
+    basename = relpath.rpartition("/")[2]
+    for basedir, patterns in reversed(pattern_stack):
+        target_rel = relpath[len(basedir) + 1:] if basedir else relpath
+        for match, negate, dir_only, anchored in reversed(patterns):
+            if dir_only and not is_dir:
+                continue
+            if match(target_rel if anchored else basename):
+                return not negate
+    return False
+
+
+def find_untracked(worktree, tracked, pattern_stack, flags=0):
+    """ Return the path of an untracked, non-ignored file or directory in <worktree>, or None if there are none.
+
+    Args:
+        worktree: Worktree root.
+        tracked: Set of tracked paths (relative to worktree, "/"-separated).
+        pattern_stack: Ignore patterns from info/exclude and core.excludesFile, see is_ignored().
+            Patterns from .gitignore files are added while walking.
+        flags: Regex flags for .gitignore patterns (re.IGNORECASE if core.ignorecase is true).
+    """
+    stack = [("", list(pattern_stack))]
+    while stack:
+        reldir, patterns = stack.pop()
+        dirpath = os.path.join(worktree, reldir) if reldir else worktree
+        gitignore = read_gitignore(os.path.join(dirpath, ".gitignore"), flags)
+        if gitignore:
+            patterns = patterns + [(reldir, gitignore)]
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                if not reldir and entry.name == ".git":
+                    continue
+                relpath = reldir + "/" + entry.name if reldir else entry.name
+                if relpath in tracked:
+                    continue
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if is_ignored(relpath, is_dir, patterns):
+                    continue
+                if not is_dir or os.path.lexists(os.path.join(entry.path, ".git")):
+                    return relpath  # An untracked file, or an untracked nested repository.
+                stack.append((relpath, patterns))
+    return None
+
+
+#########################
+# Backends
+#########################
+
+
+def read_status_native(gitrepo, ignore_untracked=False):
+    """ Read the status of <gitrepo> in-process, see module docstring. Raises Unsupported if not clean/supported.
+
+    Errors while reading the repository (e.g. a `.git` file pointing to a missing git directory,
+    unreadable files, or a corrupt index or object) are also raised as Unsupported,
+    so `git status` is used instead, and reports the problem.
+    """
+    try:
+        return _read_status_native(gitrepo, ignore_untracked=ignore_untracked)
+    except (OSError, ValueError, struct.error, zlib.error) as exc:
+        raise Unsupported("could not read repository: %s" % exc) from exc
+
+
+def _read_status_native(gitrepo, ignore_untracked=False):
+    for var in ("GIT_DIR", "GIT_WORK_TREE", "GIT_INDEX_FILE", "GIT_OBJECT_DIRECTORY",
+                "GIT_CONFIG_PARAMETERS", "GIT_CONFIG_COUNT"):
+        if os.environ.get(var):
+            raise Unsupported("environment variable %s is set" % var)
+    gitdir = gd.resolve_gitdir(gitrepo)
+    if gitdir is None or os.path.samefile(gitdir, gitrepo):
+        raise Unsupported("not a worktree")
+    commondir = gd.resolve_commondir(gitdir)
+    repo_config = read_config_checked(os.path.join(commondir, "config"))
+    configs = [read_config_checked(fn) for fn in global_config_files()] + [repo_config]
+    core = repo_config.get(("core", None), {})
+    extensions = repo_config.get(("extensions", None), {})
+    if config_bool(core.get("bare"), False) or core.get("worktree"):
+        raise Unsupported("core.bare or core.worktree is set")
+    if extensions.get("objectformat", "sha1") != "sha1" or extensions.get("refstorage", "files") != "files":
+        raise Unsupported("unsupported object format or ref storage")
+    if os.path.isfile(os.path.join(gitdir, "config.worktree")):
+        raise Unsupported("per-worktree config")
+
+    # Branch and upstream:
+    head = gd.read_head(gitdir)
+    if not head or not head.startswith("refs/heads/"):
+        raise Unsupported("detached HEAD")
+    local_branch = head[len("refs/heads/"):]
+    packed_refs = read_packed_refs(commondir)
+    head_sha = resolve_ref(commondir, head, packed_refs)
+    if head_sha is None:
+        raise Unsupported("unborn branch")
+    branch_config = repo_config.get(("branch", local_branch), {})
+    remote, remote_branch = branch_config.get("remote"), branch_config.get("merge")
+    if remote and remote_branch:
+        if not remote_branch.startswith("refs/heads/"):
+            raise Unsupported("unsupported upstream %s" % remote_branch)
+        remote_branch = remote_branch[len("refs/heads/"):]
+        fetch_refspec = repo_config.get(("remote", remote), {}).get("fetch", "")
+        if fetch_refspec.lstrip("+") != "refs/heads/*:refs/remotes/%s/*" % remote:
+            raise Unsupported("non-default fetch refspec for remote %r" % remote)
+        upstream_sha = resolve_ref(commondir, "refs/remotes/%s/%s" % (remote, remote_branch), packed_refs)
+        if upstream_sha != head_sha:
+            raise Unsupported("branch is not in sync with upstream")
+    elif remote or remote_branch:
+        raise Unsupported("incomplete upstream configuration")
+    else:
+        remote = remote_branch = None
+    if not parsed_like_subprocess(local_branch, remote):
+        raise Unsupported("branch or remote name that is not parsed by the subprocess backend")
+
+    # Index vs HEAD:
+    indexfile = os.path.join(gitdir, "index")
+    try:
+        index_stat = os.stat(indexfile)
+        entries, index_tree = read_index(indexfile)
+    except FileNotFoundError:
+        raise Unsupported("no index")
+    if index_tree is None:
+        raise Unsupported("index cache-tree is not valid")
+    with ObjectReader(commondir) as reader:
+        if reader.commit_tree(head_sha) != index_tree:
+            raise Unsupported("index differs from HEAD")
+
+    # Worktree vs index:
+    filemode = config_bool(config_value(configs, "core", "filemode"), True)
+    trustctime = config_bool(config_value(configs, "core", "trustctime"), True)
+    index_mtime = (index_stat.st_mtime_ns // 1000000000, index_stat.st_mtime_ns % 1000000000)
+    for entry in entries:
+        if entry[1] == 0o160000:
+            raise Unsupported("submodules")
+        try:
+            st = os.lstat(os.path.join(gitrepo, entry[0]))
+        except OSError:
+            raise Unsupported("tracked file %s is missing" % entry[0])
+        if not stat_matches(entry, st, filemode=filemode, trustctime=trustctime):
+            raise Unsupported("tracked file %s may be modified" % entry[0])
+        if (entry[2], entry[3]) >= index_mtime:
+            raise Unsupported("racily clean file %s" % entry[0])
+
+    # Untracked files:
+    show_untracked = (config_value(configs, "status", "showuntrackedfiles") or "normal").lower()
+    if not ignore_untracked and show_untracked not in ("no", "false", "0", "off"):
+        flags = re.IGNORECASE if config_bool(config_value(configs, "core", "ignorecase"), False) else 0
+        excludesfile = config_value(configs, "core", "excludesfile")
+        if excludesfile is None:
+            xdg = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+            excludesfile = os.path.join(xdg, "git", "ignore")
+        pattern_stack = [
+            ("", read_gitignore(os.path.expanduser(excludesfile), flags)),
+            ("", read_gitignore(os.path.join(commondir, "info", "exclude"), flags)),
+        ]
+        tracked = {entry[0] for entry in entries}
+        untracked = find_untracked(gitrepo, tracked, pattern_stack, flags)
+        if untracked is not None:
+            raise Unsupported("untracked file %s" % untracked)
+
+    return {"local_branch": local_branch, "remote": remote, "remote_branch": remote_branch,
+            "ahead_behind": None, "files_status": []}
+
+
+# pygit2 status flags mapped to the index (X) and worktree (Y) columns of `git status --porcelain=v1`:
+PYGIT2_INDEX_FLAGS = (("GIT_STATUS_INDEX_NEW", "A"), ("GIT_STATUS_INDEX_MODIFIED", "M"),
+                      ("GIT_STATUS_INDEX_DELETED", "D"), ("GIT_STATUS_INDEX_RENAMED", "R"),
+                      ("GIT_STATUS_INDEX_TYPECHANGE", "T"))
+PYGIT2_WORKTREE_FLAGS = (("GIT_STATUS_WT_MODIFIED", "M"), ("GIT_STATUS_WT_DELETED", "D"),
+                         ("GIT_STATUS_WT_RENAMED", "R"), ("GIT_STATUS_WT_TYPECHANGE", "T"))
+
+
+def read_status_pygit2(gitrepo, ignore_untracked=False):
+    """ Read the status of <gitrepo> using pygit2. Raises Unsupported if pygit2 is not installed.
+
+    The result is the same as from `git status` (checked by the tests in test_native_status.py), except:
+    - Renames: raises Unsupported if there may be staged renames, which libgit2 does not detect.
+    - A tracked file replaced by a directory: raises Unsupported (libgit2 lists the directory as untracked).
+    - An untracked nested repository without any commits is not listed (`git status` lists it as untracked).
+    """
+    try:
+        import pygit2
+    except ImportError:
+        raise Unsupported("pygit2 is not installed")
+    try:
+        repo = pygit2.Repository(gitrepo)
+    except (pygit2.GitError, KeyError) as exc:
+        raise Unsupported(str(exc))
+    if repo.is_bare or repo.head_is_unborn or repo.head_is_detached:
+        raise Unsupported("bare repository, unborn branch or detached HEAD")
+    local_branch = repo.head.shorthand
+    remote = remote_branch = ahead_behind = None
+    upstream = repo.branches.local[local_branch].upstream
+    if upstream is not None:
+        remote = upstream.remote_name
+        remote_branch = upstream.branch_name[len(remote) + 1:]
+        ahead, behind = repo.ahead_behind(repo.head.target, upstream.target)
+        ahead_behind = ", ".join(
+            "%s %s" % (label, count) for label, count in (("ahead", ahead), ("behind", behind)) if count
+        ) or None
+    if not parsed_like_subprocess(local_branch, remote):
+        raise Unsupported("branch or remote name that is not parsed by the subprocess backend")
+
+    try:
+        status = repo.status(untracked_files="no" if ignore_untracked else "normal")
+    except TypeError:  # pygit2 < 1.14
+        status = repo.status()
+    # Like `git status --porcelain=v1`, list changes to tracked files first, then untracked files:
+    tracked_changes, untracked = [], []
+    for path, flags in sorted(status.items()):
+        if flags & pygit2.GIT_STATUS_CONFLICTED:
+            tracked_changes.append("UU %s" % path)
+            continue
+        index_code = next((code for name, code in PYGIT2_INDEX_FLAGS if flags & getattr(pygit2, name)), " ")
+        wt_code = next((code for name, code in PYGIT2_WORKTREE_FLAGS if flags & getattr(pygit2, name)), " ")
+        if index_code != " " or wt_code != " ":
+            tracked_changes.append("%s%s %s" % (index_code, wt_code, path))
+        if flags & pygit2.GIT_STATUS_WT_NEW and not ignore_untracked:
+            untracked.append("?? %s" % path)
+    codes = {line[0] for line in tracked_changes}
+    if "A" in codes and "D" in codes:
+        # `git status` detects renames, which libgit2's status (by default) does not.
+        raise Unsupported("possible renames")
+    if untracked and {line[3:] + "/" for line in tracked_changes} & {line[3:] for line in untracked}:
+        raise Unsupported("tracked file replaced by a directory")
+    files_status = tracked_changes + untracked
+    return {"local_branch": local_branch, "remote": remote, "remote_branch": remote_branch,
+            "ahead_behind": ahead_behind, "files_status": files_status}
+
+
+def pygit2_available():
+    try:
+        import pygit2  # noqa: F401 pylint: disable=unused-import
+    except ImportError:
+        return False
+    return True
+
+
+def read_status(gitrepo, backend="auto", ignore_untracked=False):
+    """ Read the status of <gitrepo> with the given backend ("native", "pygit2", or "auto").
+
+    "auto" uses pygit2 if it is installed, otherwise the native reader.
+    Returns a dict (see module docstring). Raises Unsupported if the status cannot be read in-process.
+    """
+    if backend == "auto":
+        backend = "pygit2" if pygit2_available() else "native"
+    if backend == "pygit2":
+        return read_status_pygit2(gitrepo, ignore_untracked=ignore_untracked)
+    if backend == "native":
+        return read_status_native(gitrepo, ignore_untracked=ignore_untracked)
+    raise ValueError("Unknown backend: %r" % (backend,))
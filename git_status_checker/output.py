@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Machine-readable output formats (`--format jsonl|json|csv`).
+
+Each checked repository is converted to a flat record (see status_record()) and written
+as soon as it has been checked, so output can be consumed while the run is still in progress,
+and memory use does not depend on the number of repositories:
+* jsonl: One JSON object per line (JSON Lines). The output is flushed after each repository.
+* json: A single JSON array of objects (streamed; the array is only complete when the run has finished).
+* csv: A header line, followed by one line per repository. Change counts are in separate columns.
+
+With --watch (and --serve), a record is also written for each status transition, with the additional
+fields in TRANSITION_FIELDS (which are empty for the records of the initial check).
+
+"""
+
+import csv
+import json
+import logging
+logger = logging.getLogger(__name__)
+
+if __package__:
+    from . import porcelain
+else:
+    import porcelain
+
+
+FIELDS = ("path", "dirty", "branch", "upstream", "ahead", "behind", "changes", "push", "fetch", "error", "duration")
+TRANSITION_FIELDS = ("time", "previous_dirty")  # Added to records of status transitions (--watch).
+
+
+def status_record(gitrepo, status_tup):
+    """ Return dict with the status of <gitrepo>, given its RepoStatus <status_tup> (see check_repo_status()).
+
+    Fields:
+        path: The repository path.
+        dirty: True if the repository has outstanding commits, pushes or fetches.
+        branch, upstream, ahead, behind: The checked-out branch, its upstream, and the number of commits
+            ahead of/behind upstream. upstream, ahead and behind are null if the branch has no upstream.
+        changes: Dict with the number of changed files in each state, see porcelain.classify().
+        push: Push status message, or null if there is nothing to push.
+        fetch: Output of `git fetch --dry-run` (empty if there is nothing to fetch), or an error message.
+            Null if fetch status was not checked.
+        error: Error message, if the repository status could not be read.
+        duration: Time, in seconds, it took to check the repository.
+    """
+    commitstat, pushstat, fetchstat = status_tup
+    details = getattr(status_tup, "details", {})
+    duration = details.get("duration")
+    return {
+        "path": gitrepo,
+        "dirty": bool(any(status_tup)),
+        "branch": details.get("branch"),
+        "upstream": details.get("upstream"),
+        "ahead": details.get("ahead"),
+        "behind": details.get("behind"),
+        "changes": details.get("changes") or porcelain.count_changes(commitstat),
+        "push": pushstat or None,
+        "fetch": fetchstat,
+        "error": details.get("error"),
+        "duration": round(duration, 6) if duration is not None else None,
+    }
+
+
+class JsonLinesWriter:
+    """ Write one JSON object per line. """
+
+    def __init__(self, file, extra_fields=()):
+        self.file = file
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        pass
+
+
+class JsonWriter:
+    """ Write a JSON array of objects, one object per line, without holding all records in memory. """
+
+    def __init__(self, file, extra_fields=()):
+        self.file = file
+        self.count = 0
+
+    def write(self, record):
+        self.file.write(("[\n" if self.count == 0 else ",\n") + json.dumps(record))
+        self.file.flush()
+        self.count += 1
+
+    def close(self):
+        self.file.write("\n]\n" if self.count else "[]\n")
+        self.file.flush()
+
+
+class CsvWriter:
+    """ Write CSV with a header line. The changes dict is written as one column per state.
+
+    Records with fields that are not in the header raise ValueError, so use <extra_fields> to add columns
+    for any fields besides FIELDS (e.g. TRANSITION_FIELDS).
+    """
+
+    def __init__(self, file, extra_fields=()):
+        self.file = file
+        columns = [field for field in FIELDS if field != "changes"]
+        columns[columns.index("behind") + 1:columns.index("behind") + 1] = list(porcelain.CHANGE_STATES)
+        columns += [field for field in extra_fields if field not in columns]
+        self.writer = csv.DictWriter(file, fieldnames=columns, lineterminator="\n")
+        self.writer.writeheader()
+
+    def write(self, record):
+        row = dict(record)
+        row.update(row.pop("changes"))
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        pass
+
+
+WRITERS = {"jsonl": JsonLinesWriter, "json": JsonWriter, "csv": CsvWriter}
+
+
+def make_writer(fmt, file, extra_fields=()):
+    """ Return a writer for output format <fmt> ("jsonl", "json" or "csv"), writing to <file>.
+
+    Writers have a write(record) method, taking a dict from status_record(), and a close() method.
+    <extra_fields> are the names of any fields added to the records, besides FIELDS (needed for csv columns).
+    """
+    return WRITERS[fmt](file, extra_fields=extra_fields)
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Streaming parser for `git status --porcelain=v2 --branch -z` output.
+
+The output is parsed while it is being read from the `git status` process, one chunk and one NUL-terminated
+entry at a time, so memory use does not depend on the number of changed files:
+* The `# branch.*` headers give the branch, upstream, and exact ahead/behind counts.
+  Branch names are taken as-is, so names containing `/` or `.` (e.g. `feature/x`) need no special handling.
+* Changed files are counted per XY status code, and classified (see classify()) once per code.
+  A listing line is only made for the first <max_files> entries.
+Listing lines have the same format as `git status --porcelain=v1` lines (e.g. ` M file`, `?? file`),
+which is what the rest of git-status-checker displays.
+
+Porcelain v2 format documentation:
+* https://git-scm.com/docs/git-status#_porcelain_format_version_2
+
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+STATUS_COMMAND = ["git", "status", "--porcelain=v2", "--branch", "-z"]
+CHANGE_STATES = ("staged", "modified", "deleted", "untracked", "conflicted")
+CONFLICT_CODES = {"DD", "AU", "UD", "UA", "DU", "AA", "UU"}
+CHUNK_SIZE = 64 * 1024
+STOPPED_LINE = "... (stopped at the first changed file, other files not checked)"  # Listed in quick mode.
+
+
+def classify(xy):
+    """ Return tuple of the change states (see CHANGE_STATES) for porcelain (v1) status code <xy>, e.g. " M".
+
+    States:
+        staged: Changes staged in the index.
+        modified, deleted: Changes in the worktree that are not staged.
+        untracked: Untracked files.
+        conflicted: Unmerged files.
+    A file with both staged and unstaged changes has both states.
+    """
+    if xy == "??":
+        return ("untracked",)
+    if xy in CONFLICT_CODES:
+        return ("conflicted",)
+    states = ()
+    if xy[0] not in " !":
+        states += ("staged",)
+    if xy[1] == "D":
+        states += ("deleted",)
+    elif xy[1] not in " !":
+        states += ("modified",)
+    return states
+
+
+def count_changes(files_status):
+    """ Return dict with the number of changed files in each state (see classify()), from porcelain v1 lines. """
+    counts = dict.fromkeys(CHANGE_STATES, 0)
+    for line in files_status or ():
+        if line.startswith("... "):
+            continue  # "... and N more changed files (not listed)", see limit_files().
+        for state in classify(line[:2]):
+            counts[state] += 1
+    return counts
+
+
+def iter_entries(chunks):
+    """ Yield NUL-terminated entries (str, without the NUL) from the iterable of byte strings <chunks>.
+
+    Each chunk is decoded in one go (up to its last NUL, so multi-byte characters are never split),
+    which is much faster than decoding the entries one at a time.
+    """
+    rest = b""
+    for chunk in chunks:
+        data = rest + chunk
+        end = data.rfind(b"\0")
+        if end < 0:
+            rest = data
+            continue
+        rest = data[end + 1:]
+        yield from data[:end].decode("utf-8", "replace").split("\0")
+    if rest:
+        yield rest.decode("utf-8", "replace")
+
+
+def iter_chunks(fp, size=CHUNK_SIZE):
+    """ Yield chunks of bytes read from binary file <fp> (e.g. a process' stdout) until EOF. """
+    while True:
+        chunk = fp.read1(size) if hasattr(fp, "read1") else fp.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def status_command(ignore_untracked=False, quick=False):
+    """ Return the `git status` command (list), see parse_status() for the arguments. """
+    command = list(STATUS_COMMAND)
+    if ignore_untracked:
+        command.append("--untracked-files=no")  # Do not even look for untracked files.
+    if quick:
+        command.append("--no-renames")  # Rename detection is only needed to list renamed files.
+    return command
+
+
+def parse_status(entries, ignore_untracked=False, max_files=None, quick=False):
+    """ Parse `git status --porcelain=v2 --branch -z` output.
+
+    Args:
+        entries: Iterable of entries, e.g. from iter_entries().
+        ignore_untracked: Do not count or list untracked files.
+        max_files: Maximum number of files to list. None means no limit. Files are always counted.
+        quick: Stop at the first changed file. The caller can then stop the `git status` process.
+
+    Returns:
+        Dict with:
+            local_branch: The checked-out branch, or None if HEAD is detached.
+            remote, remote_branch: The upstream, e.g. "origin" and "feature/x" (None if there is no upstream).
+            ahead, behind: Number of commits ahead of/behind upstream (None if there is no upstream,
+                or the upstream is gone).
+            ahead_behind: E.g. "ahead 1, behind 2", "gone", or None if in sync, for format_push_status().
+            files_status: Listing lines (porcelain v1 format) for the first <max_files> changed files.
+            nfiles: Total number of changed files.
+            changes: Dict with the number of changed files in each state, see classify().
+            complete: False if parsing stopped at the first changed file (quick=True), i.e. only
+                that file is counted (and listed).
+    """
+    info = {"local_branch": None, "remote": None, "remote_branch": None, "ahead": None, "behind": None,
+            "ahead_behind": None, "files_status": [], "nfiles": 0, "changes": dict.fromkeys(CHANGE_STATES, 0),
+            "complete": True}
+    files_status = info["files_status"]
+    room = float("inf") if max_files is None else max_files  # Number of files that can still be listed.
+    codes = {}  # XY code -> number of files. Files are classified per code, after reading all entries.
+    entries = iter(entries)
+    for entry in entries:
+        kind = entry[:1]
+        if kind == "?":
+            if ignore_untracked:
+                continue
+            code = "??"
+        elif kind in ("1", "2", "u"):
+            code = entry[2:4]
+        elif kind == "#":
+            _parse_header(entry, info)
+            continue
+        else:
+            continue  # "!" (ignored files) are not reported.
+        orig_path = next(entries, "") if kind == "2" else None  # Renames/copies are followed by the original path.
+        codes[code] = codes.get(code, 0) + 1
+        if room > 0:
+            room -= 1
+            # "? path" -> "?? path", like porcelain v1:
+            files_status.append("?" + entry if kind == "?" else _listing_line(kind, code, entry, orig_path))
+        if quick:
+            info["complete"] = False  # The branch headers come before the first changed file, so they are all read.
+            break
+    for code, count in codes.items():
+        info["nfiles"] += count
+        for state in classify(code.replace(".", " ")):
+            info["changes"][state] += count
+    if info["remote"] is not None and info["ahead"] is not None:
+        parts = ["%s %s" % (key, info[key]) for key in ("ahead", "behind") if info[key]]
+        info["ahead_behind"] = ", ".join(parts) or None
+    elif info["remote"] is not None:
+        info["ahead_behind"] = "gone"  # Upstream is configured, but the remote-tracking branch does not exist.
+    return info
+
+
+def _parse_header(line, info):
+    """ Parse `# branch.<key> <value>` header <line> into <info>. """
+    _, key, value = (line.split(" ", 2) + ["", ""])[:3]
+    if key == "branch.head":
+        info["local_branch"] = None if value == "(detached)" else value
+    elif key == "branch.upstream":
+        # The upstream is "<remote>/<branch>", or just "<branch>" for a local upstream branch.
+        # Remote names rarely contain "/", so split at the first one:
+        remote, _, remote_branch = value.partition("/") if "/" in value else (".", "", value)
+        info["remote"], info["remote_branch"] = remote, remote_branch
+    elif key == "branch.ab":
+        ahead, behind = value.split()
+        info["ahead"], info["behind"] = int(ahead), -int(behind)
+
+
+def _listing_line(kind, code, entry, orig_path):
+    """ Return the porcelain v1 listing line for a tracked file entry. Only called for the files that are listed. """
+    # Number of space-separated fields before the path: "1 XY sub mH mI mW hH hI path",
+    # "2 XY sub mH mI mW hH hI Xscore path", "u XY sub m1 m2 m3 mW h1 h2 h3 path".
+    nfields = {"1": 8, "2": 9, "u": 10}[kind]
+    path = entry.split(" ", nfields)[nfields]
+    xy = code.replace(".", " ")
+    if orig_path:
+        return "%s %s -> %s" % (xy, orig_path, path)
+    return "%s %s" % (xy, path)
+
+
+def limit_files(files_status, max_files, nfiles=None):
+    """ Return <files_status> with at most <max_files> lines, plus a line saying how many were not listed.
+
+    Args:
+        files_status: List of listing lines.
+        max_files: Maximum number of lines to list. None means no limit.
+        nfiles: Total number of changed files (default: len(files_status)).
+    """
+    nfiles = len(files_status) if nfiles is None else nfiles
+    if max_files is None or nfiles <= max_files:
+        return files_status
+    return files_status[:max_files] + ["... and %s more changed files (not listed)" % (nfiles - max_files)]
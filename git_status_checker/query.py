@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Query server and client (`--serve` and `git-status-checker query`).
+
+A long-running git-status-checker (typically with `--watch`) can serve its in-memory status table
+over a Unix domain socket, so shell prompts and editor plugins can get a repository's status
+with a single socket round-trip, instead of running `git status` themselves.
+
+Protocol: The client sends one JSON object per line, and the server answers each with one JSON object per line:
+    {"query": "status", "path": <path>}     ->  {"ok": true, "repo": <record>}
+    {"query": "dirty"}                      ->  {"ok": true, "repos": [<record>, ...]}
+    {"query": "refresh", "path": <path>}    ->  {"ok": true, "repo": <record>}  (after re-checking the repository)
+    {"query": "ping"}                       ->  {"ok": true}
+<path> is an absolute path, and can be anywhere inside the repository's worktree.
+<record> is a status record, as written by `--format jsonl` (see output.status_record).
+Errors are returned as {"ok": false, "error": <message>}.
+
+"""
+
+import os
+import sys
+import json
+import stat
+import socket
+import argparse
+import logging
+logger = logging.getLogger(__name__)
+
+if __package__:
+    from . import output
+else:
+    import output
+
+
+class StatusServer:
+    """ Serve the status table <statuses> over a Unix domain socket, in a background thread.
+
+    Usage:
+        server = StatusServer(socket_path, statuses, lock, refresh)
+        server.start()
+        ...
+        server.close()
+    """
+
+    def __init__(self, socket_path, statuses, lock, refresh):
+        """
+        Args:
+            socket_path: Path of the Unix domain socket to listen on.
+            statuses: Dict {gitrepo: status_tup} (kept up to date by the caller, holding <lock>).
+            lock: Lock protecting <statuses>.
+            refresh: Function re-checking a repository, updating <statuses> (called as refresh(gitrepo)).
+        """
+        self.socket_path = socket_path
+        self.statuses = statuses
+        self.lock = lock
+        self.refresh = refresh
+        self._server = None
+        self._thread = None
+        self._index = {}  # normcase(realpath) -> gitrepo
+
+    def find_repo(self, path):
+        """ Return the repository (key of statuses) containing <path>, or None. """
+        path = os.path.normcase(os.path.realpath(path))
+        with self.lock:
+            if len(self._index) != len(self.statuses):
+                self._index = {os.path.normcase(os.path.realpath(gitrepo)): gitrepo for gitrepo in self.statuses}
+            while True:
+                if path in self._index:
+                    return self._index[path]
+                parent = os.path.dirname(path)
+                if parent == path:
+                    return None
+                path = parent
+
+    def handle(self, request):
+        """ Return response (dict) for <request> (dict). """
+        query = request.get("query")
+        if query == "ping":
+            return {"ok": True}
+        if query == "dirty":
+            with self.lock:
+                items = sorted(self.statuses.items())
+            return {"ok": True, "repos": [output.status_record(gitrepo, status_tup)
+                                          for gitrepo, status_tup in items if any(status_tup)]}
+        if query in ("status", "refresh"):
+            if not request.get("path"):
+                return {"ok": False, "error": "No path given."}
+            gitrepo = self.find_repo(request["path"])
+            if gitrepo is None:
+                return {"ok": False, "error": "Not in a watched repository: %s" % request["path"]}
+            if query == "refresh":
+                self.refresh(gitrepo)
+            with self.lock:
+                status_tup = self.statuses[gitrepo]
+            return {"ok": True, "repo": output.status_record(gitrepo, status_tup)}
+        return {"ok": False, "error": "Unknown query: %r" % query}
+
+    def start(self):
+        """ Start listening on the socket, and serve requests in a background thread.
+
+        Raises OSError if another server is already listening on the socket, or if something other than
+        a socket exists at the socket path (which is never removed).
+        """
+        try:
+            mode = os.lstat(self.socket_path).st_mode
+        except FileNotFoundError:
+            mode = None
+        if mode is not None:
+            if not stat.S_ISSOCK(mode):
+                raise FileExistsError("%s exists and is not a socket (refusing to replace it)" % self.socket_path)
+            if ping(self.socket_path):
+                raise OSError("Another git-status-checker is already serving on %s" % self.socket_path)
+            os.unlink(self.socket_path)  # Stale socket from a server that did not exit cleanly.
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+        import threading
+        import socketserver  # Only needed by the server, not by the query client.
+        status_server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        response = status_server.handle(json.loads(line))
+                    except ValueError as exc:
+                        response = {"ok": False, "error": "Bad request: %s" % exc}
+                    except Exception as exc:  # pylint: disable=broad-except
+                        logger.exception("Error handling query %r", line)
+                        response = {"ok": False, "error": str(exc)}
+                    self.wfile.write(json.dumps(response).encode() + b"\n")
+
+        old_umask = os.umask(0o077)  # Only the current user can connect.
+        try:
+            self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        finally:
+            os.umask(old_umask)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="StatusServer", daemon=True)
+        self._thread.start()
+        logger.info("Serving status queries on %s", self.socket_path)
+
+    def close(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+
+def request(socket_path, req, timeout=None):
+    """ Send request <req> (dict) to the server at <socket_path>, and return the response (dict).
+
+    Raises OSError if the server cannot be reached.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(req).encode() + b"\n")
+        with sock.makefile("rb") as fp:
+            line = fp.readline()
+    if not line:
+        raise OSError("No response from server at %s" % socket_path)
+    return json.loads(line)
+
+
+def ping(socket_path):
+    """ Return True if a server is listening on <socket_path>. """
+    try:
+        return request(socket_path, {"query": "ping"}, timeout=1).get("ok", False)
+    except (OSError, ValueError):
+        return False
+
+
+def summary(record):
+    """ Return one-line text summary of a status record, e.g. "master: 2 modified, 1 untracked, ahead 1". """
+    if record.get("error"):
+        return "error: %s" % record["error"]
+    parts = ["%s %s" % (count, state) for state, count in record["changes"].items() if count]
+    for key in ("ahead", "behind"):
+        if record.get(key):
+            parts.append("%s %s" % (key, record[key]))
+    if record.get("upstream") is None and record.get("push"):
+        parts.append("no upstream")
+    if record.get("fetch"):
+        parts.append("fetch pending")
+    return "%s: %s" % (record.get("branch") or "(detached)", ", ".join(parts) or "clean")
+
+
+def main(argv, default_socket):
+    """ The `git-status-checker query` client. Returns the exit status.
+
+    Exit status: 0 if the repository is clean (or, for `dirty`, no repositories are dirty),
+    1 if dirty, 2 on errors (e.g. the path is not in a watched repository), 3 if the server is not running.
+    """
+    parser = argparse.ArgumentParser(
+        prog="git-status-checker query",
+        description="Query a running `git-status-checker --serve` for repository status.")
+    parser.add_argument("--socket", default=default_socket, help="Server socket. Default: %(default)s")
+    parser.add_argument("--format", choices=("text", "json"), default="text", help="Output format.")
+    parser.add_argument("--timeout", type=float, default=30, help="Timeout, in seconds. Default: 30.")
+    parser.add_argument("query", choices=("status", "dirty", "refresh"),
+                        help="'status': status of the repository containing PATH. 'dirty': all dirty repositories. "
+                        "'refresh': re-check the repository containing PATH, and return its status.")
+    parser.add_argument("path", nargs="?", default=".", help="Path in the repository. Default: current directory.")
+    args = parser.parse_args(argv)
+
+    req = {"query": args.query}
+    if args.query != "dirty":
+        req["path"] = os.path.abspath(args.path)
+    try:
+        response = request(args.socket, req, timeout=args.timeout)
+    except OSError as exc:
+        print("Could not connect to git-status-checker server at %s: %s" % (args.socket, exc), file=sys.stderr)
+        return 3
+    if not response.get("ok"):
+        print("Error:", response.get("error"), file=sys.stderr)
+        return 2
+    records = response["repos"] if args.query == "dirty" else [response["repo"]]
+    for record in records:
+        if args.format == "json":
+            print(json.dumps(record))
+        elif args.query == "dirty":
+            print("%s  %s" % (record["path"], summary(record)))
+        else:
+            print(summary(record))
+    return 1 if any(record["dirty"] for record in records) else 0
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Persistent on-disk cache of directory listings used when scanning for git repositories (`--scan-cache`).
+
+For every directory visited by scan_gitrepos(), the cache stores the directory's mtime and inode,
+whether the directory is a git repository, and the (non-ignored) sub-directories to descend into.
+A directory's mtime changes whenever an entry is added, removed or renamed *directly* in that directory,
+so on repeat runs we only have to stat each directory, and only directories whose mtime (or inode)
+changed are listed again. On network file systems, a stat is much cheaper than listing a large directory.
+
+The cache is invalidated (i.e. a full walk is made) if the ignore globs or the followlinks setting change.
+
+Directories modified less than RACY_SECONDS before they were listed are not trusted on the next run,
+since a later modification within the file system's mtime resolution would go unnoticed
+(similar to git's "racy git" problem).
+
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+
+CACHE_VERSION = 1
+RACY_SECONDS = 2
+
+
+def cache_key(ignoreglobs, followlinks):
+    """ Return a key identifying the scan settings that affect cached directory listings. """
+    settings = json.dumps([sorted(set(ignoreglobs or ())), bool(followlinks)])
+    return hashlib.sha1(settings.encode()).hexdigest()
+
+
+class ScanCache:
+    """ Cache of directory listings, keyed by absolute directory path and validated by mtime and inode.
+
+    Usage:
+        scan_cache = ScanCache(filename, ignoreglobs, followlinks)
+        scan_cache.load()
+        is_repo, subdirs = scan_cache.list_dir(dirpath, lister)   # lister(dirpath) -> (is_repo, subdirs)
+        ...
+        scan_cache.save(basedirs)
+    """
+
+    def __init__(self, filename, ignoreglobs=None, followlinks=False, rescan=False):
+        """
+        Args:
+            filename: Cache file.
+            ignoreglobs, followlinks: The settings used for scanning. Cached listings made with
+                different settings are discarded.
+            rescan: If True, do not use any cached listings (but still save the new listings).
+        """
+        self.filename = filename
+        self.key = cache_key(ignoreglobs, followlinks)
+        self.rescan = rescan
+        self.dirs = {}      # abspath -> [mtime_ns, inode, is_repo, subdirs]
+        self.visited = {}   # entries for directories visited in this run.
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """ Load cached listings from file, unless rescanning or the cache was made with other settings. """
+        if self.rescan:
+            logger.info("Rescanning, ignoring scan cache %s", self.filename)
+            return
+        try:
+            with open(self.filename) as fp:
+                data = json.load(fp)
+        except FileNotFoundError:
+            logger.debug("Scan cache %s does not exist.", self.filename)
+            return
+        except (OSError, ValueError) as exc:
+            logger.warning("Could not read scan cache %s (%s), doing a full scan.", self.filename, exc)
+            return
+        if data.get("version") != CACHE_VERSION or data.get("key") != self.key:
+            logger.info("Scan cache %s was made with other settings (e.g. ignore globs), doing a full scan.",
+                        self.filename)
+            return
+        self.dirs = data.get("dirs", {})
+        logger.debug("Loaded %s cached directory listings from %s", len(self.dirs), self.filename)
+
+    def save(self, basedirs):
+        """ Save the listings made in this run to file.
+
+        Cached entries below <basedirs> that were not visited (e.g. deleted or now-ignored directories)
+        are dropped. Entries for directories outside <basedirs> (from scans of other basedirs) are kept.
+        """
+        prefixes = tuple(os.path.join(os.path.abspath(basedir), "") for basedir in basedirs)
+        roots = {os.path.abspath(basedir) for basedir in basedirs}
+        dirs = {path: entry for path, entry in self.dirs.items()
+                if not (path in roots or path.startswith(prefixes))}
+        dirs.update(self.visited)
+        data = {"version": CACHE_VERSION, "key": self.key, "dirs": dirs}
+        tmpfn = "%s.%s.tmp" % (self.filename, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+            with open(tmpfn, "w") as fp:
+                json.dump(data, fp, separators=(",", ":"))
+            os.replace(tmpfn, self.filename)
+        except OSError as exc:
+            logger.warning("Could not write scan cache %s: %s", self.filename, exc)
+            return
+        logger.info("Scan cache: %s directory listings reused, %s directories listed; saved to %s",
+                    self.hits, self.misses, self.filename)
+
+    def list_dir(self, dirpath, lister):
+        """ Return (is_repo, subdirs) for <dirpath>, from cache if the directory is unchanged,
+        otherwise by calling lister(dirpath) (and caching the result).
+        """
+        abspath = os.path.abspath(dirpath)
+        try:
+            st = os.stat(abspath)
+        except OSError:
+            return 0, []
+        entry = self.dirs.get(abspath)
+        if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_ino:
+            with self._lock:
+                self.hits += 1
+                self.visited[abspath] = entry
+            return entry[2], entry[3]
+        is_repo, subdirs = lister(dirpath)
+        mtime_ns = st.st_mtime_ns
+        if time.time() - mtime_ns / 1e9 < RACY_SECONDS:
+            mtime_ns = None  # Racily clean; do not trust this listing next time.
+        with self._lock:
+            self.misses += 1
+            self.visited[abspath] = [mtime_ns, st.st_ino, is_repo, list(subdirs)]
+        return is_repo, subdirs
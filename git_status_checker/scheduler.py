@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Cost-aware, adaptive scheduling of the status checks (`--schedule adaptive`).
+
+By default, repositories are checked in the order they are found, so a few huge repositories
+found late in the scan can dominate the total run time (everything else is done, and we wait for them).
+The adaptive scheduler instead:
+* Checks the repositories that took longest to check in previous runs first (see CostModel).
+  Repositories that have not been checked before are checked first, as their cost is unknown.
+* Adapts the number of concurrent checks (between 1 and --jobs), see AdaptiveLimit:
+  The limit is changed step by step in one direction, as long as the throughput improves,
+  measured as the (previously observed) cost of the checks completed per second.
+  When the throughput drops, the direction is reversed. The limit is also reduced whenever the
+  1-minute load average exceeds --max-load, e.g. when checking thrashes a spinning disk or an NFS server.
+Results are still reported in the order the repositories were found, but only once all
+repositories have been found (the costs of all repositories are needed to order them).
+
+"""
+
+import os
+import json
+import time
+import threading
+from concurrent.futures import Future
+import logging
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_COST = 0.05  # Seconds; expected cost of a repository that has not been checked before.
+MAX_AGE = 30 * 86400  # Seconds; costs of repositories not checked for this long are forgotten.
+
+
+class CostModel:
+    """ The observed cost (check duration, in seconds) of each repository, remembered between runs.
+
+    Costs are exponentially weighted moving averages, so a single slow run does not dominate.
+    Repositories are identified by their absolute path, so costs are shared between runs started from
+    different working directories. Costs of repositories that have not been checked for <max_age> seconds
+    (e.g. deleted or moved repositories) are dropped when saving, so the file does not grow without bound.
+    """
+
+    def __init__(self, filename=None, weight=0.5, max_age=MAX_AGE):
+        """
+        Args:
+            filename: JSON file to load and save costs from/to. None means costs are not remembered between runs.
+            weight: Weight of the newly observed cost in the moving average.
+            max_age: Seconds a repository's cost is remembered after it was last checked.
+        """
+        self.filename = filename
+        self.weight = weight
+        self.max_age = max_age
+        self.costs = {}     # abspath -> cost
+        self.checked = {}   # abspath -> time.time() the repository was last checked
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self.filename is None:
+            return
+        try:
+            with open(self.filename) as fp:
+                data = json.load(fp)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            logger.warning("Could not read repository costs %s: %s", self.filename, exc)
+            return
+        now = time.time()
+        for path, entry in data.items():
+            # Entries are [cost, last checked]; files written by older versions only have the cost.
+            cost, checked = entry if isinstance(entry, list) else (entry, now)
+            self.costs[path], self.checked[path] = cost, checked
+
+    def save(self):
+        if self.filename is None:
+            return
+        tmpfn = "%s.%s.tmp" % (self.filename, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+            with self._lock, open(tmpfn, "w") as fp:
+                oldest = time.time() - self.max_age
+                json.dump({path: [cost, self.checked[path]] for path, cost in self.costs.items()
+                           if self.checked[path] >= oldest}, fp, separators=(",", ":"))
+            os.replace(tmpfn, self.filename)
+        except OSError as exc:
+            logger.warning("Could not write repository costs %s: %s", self.filename, exc)
+
+    def cost(self, gitrepo):
+        """ Return the expected cost of checking <gitrepo>, or None if it is not known. """
+        return self.costs.get(os.path.abspath(gitrepo))
+
+    def update(self, gitrepo, seconds):
+        """ Update the cost of <gitrepo> with an observed check duration of <seconds>. """
+        path = os.path.abspath(gitrepo)
+        with self._lock:
+            old = self.costs.get(path)
+            self.costs[path] = seconds if old is None else self.weight * seconds + (1 - self.weight) * old
+            self.checked[path] = time.time()
+
+    def order(self, gitrepos):
+        """ Return <gitrepos> sorted by expected cost, most expensive (or unknown) first. """
+        costs = {gitrepo: self.cost(gitrepo) for gitrepo in gitrepos}
+        return sorted(gitrepos, key=lambda gitrepo: -(costs[gitrepo] if costs[gitrepo] is not None else float("inf")))
+
+
+class AdaptiveLimit:
+    """ Concurrency limit that adapts to the observed throughput and the system load.
+
+    Workers call acquire() before and release(cost) after each task, where cost is the task's expected cost.
+    Every <interval> seconds, the throughput (sum of expected costs of the completed tasks, per second)
+    is compared with the previous interval, and the limit moved one step (see module docstring).
+    """
+
+    def __init__(self, max_jobs, min_jobs=1, initial=None, max_load=None, interval=0.5, getloadavg=None):
+        self.max_jobs = max(1, max_jobs)
+        self.min_jobs = max(1, min(min_jobs, self.max_jobs))
+        self.limit = max(self.min_jobs, min(initial or (self.max_jobs + 1) // 2, self.max_jobs))
+        self.max_load = max_load if max_load is not None else (os.cpu_count() or 1)
+        self.interval = interval
+        self.getloadavg = getloadavg or getattr(os, "getloadavg", None)
+        self.running = 0
+        self.direction = 1
+        self.history = [(time.perf_counter(), self.limit)]  # (time, limit), for the --timings report/debugging.
+        self._window_start = time.perf_counter()
+        self._window_work = 0.0
+        self._previous_throughput = None
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.running >= self.limit:
+                self._condition.wait()
+            self.running += 1
+
+    def release(self, cost):
+        with self._condition:
+            self.running -= 1
+            self._window_work += cost
+            now = time.perf_counter()
+            if now - self._window_start >= self.interval:
+                self._adjust(self._window_work / (now - self._window_start))
+                self._window_start, self._window_work = now, 0.0
+            self._condition.notify_all()
+
+    def _adjust(self, throughput):
+        """ Move the limit one step, based on <throughput> and the load average. (Called holding the lock.) """
+        load = self.getloadavg()[0] if self.getloadavg is not None else None
+        if load is not None and load > self.max_load:
+            self.direction = -1
+        elif self._previous_throughput is not None and throughput < 0.95 * self._previous_throughput:
+            self.direction = -self.direction  # The last step made things worse; go the other way.
+        self._previous_throughput = throughput
+        limit = max(self.min_jobs, min(self.limit + self.direction, self.max_jobs))
+        if limit != self.limit:
+            logger.debug("Concurrency limit %s -> %s (throughput %.3f, load %s)", self.limit, limit, throughput, load)
+            self.limit = limit
+            self.history.append((time.perf_counter(), limit))
+
+
+class Scheduler:
+    """ Run a function for each repository, most expensive first, with an adaptive concurrency limit.
+
+    Usage:
+        scheduler = Scheduler(costs, max_jobs=8)
+        futures = scheduler.submit_all(check_func, gitrepos, **kwargs)   # dict {gitrepo: Future}
+        ...
+        scheduler.shutdown()
+    """
+
+    def __init__(self, costs, max_jobs, max_load=None, interval=0.5):
+        """
+        Args:
+            costs: CostModel. It is updated with the observed duration of each call.
+            max_jobs: Maximum number of concurrent calls.
+            max_load: Reduce concurrency when the 1-minute load average is above this. Default: number of CPUs.
+            interval: Seconds between concurrency adjustments.
+        """
+        self.costs = costs
+        self.limit = AdaptiveLimit(max_jobs, max_load=max_load, interval=interval)
+        self._queue = []
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stop = threading.Event()
+
+    def submit_all(self, func, gitrepos, before_start=None, **kwargs):
+        """ Call func(gitrepo, **kwargs) for each of <gitrepos>, most expensive first.
+
+        If <before_start> is given, the worker first calls before_start(gitrepo), e.g. to wait for a resource
+        the call needs. This wait is not counted in the repository's cost. If it returns False, func is not
+        called, and the result is None.
+
+        Returns dict {gitrepo: concurrent.futures.Future}, with the return value of each call.
+        """
+        futures = {gitrepo: Future() for gitrepo in gitrepos}
+        known = [cost for cost in (self.costs.cost(gitrepo) for gitrepo in futures) if cost is not None]
+        default_cost = sorted(known)[len(known) // 2] if known else DEFAULT_COST
+        # Reversed, so the most expensive repositories can be popped from the end:
+        self._queue = [(gitrepo, futures[gitrepo], self.costs.cost(gitrepo) or default_cost)
+                       for gitrepo in reversed(self.costs.order(futures))]
+        for i in range(min(self.limit.max_jobs, len(self._queue))):
+            thread = threading.Thread(target=self._work, args=(func, before_start, kwargs), name="Scheduler-%s" % i,
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return futures
+
+    def _work(self, func, before_start, kwargs):
+        while not self._stop.is_set():
+            self.limit.acquire()
+            with self._lock:
+                if not self._queue or self._stop.is_set():
+                    self.limit.release(0)
+                    return
+                gitrepo, future, cost = self._queue.pop()
+            try:
+                if future.set_running_or_notify_cancel():
+                    start = None
+                    try:
+                        if before_start is None or before_start(gitrepo):
+                            start = time.perf_counter()
+                            future.set_result(func(gitrepo, **kwargs))
+                        else:
+                            future.set_result(None)
+                    except BaseException as exc:  # pylint: disable=broad-except
+                        future.set_exception(exc)
+                    if start is not None:
+                        self.costs.update(gitrepo, time.perf_counter() - start)
+            finally:
+                self.limit.release(cost)
+
+    def shutdown(self, cancel=False):
+        """ Wait for the workers to finish. If <cancel> is True, calls that have not started are cancelled. """
+        if cancel:
+            self._stop.set()
+            with self._lock:
+                for _, future, _ in self._queue:
+                    future.cancel()
+                self._queue = []
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        logger.debug("Concurrency limit history: %s", self.limit.history)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Persistent cache of repository status results, used by `--incremental` mode.
+
+Each repository's last (commit-status, push-status, details) result is stored together with a fingerprint
+of the repository (see gitdir.repo_fingerprint()). If the fingerprint has not changed,
+and the result is not older than max_age, the cached result is reused instead of running `git status`.
+
+Fetch status is never cached, since it depends on the remote, not on the local repository.
+
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+
+CACHE_VERSION = 2
+RACY_SECONDS = 2
+PRUNE_SECONDS = 30*24*3600  # Drop entries for repositories that have not been checked for this long.
+
+
+def settings_key(**settings):
+    """ Return a key identifying the check settings that affect the cached status results. """
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _normalize(fingerprint):
+    """ Return fingerprint as it will be after a round-trip through JSON (tuples become lists). """
+    return json.loads(json.dumps(fingerprint))
+
+
+def _is_racy(fingerprint, now):
+    """ Return True if any mtime in <fingerprint> is too recent to be trusted.
+
+    A modification within the file system's timestamp resolution after the fingerprint was taken
+    would not change the fingerprint.
+    """
+    stack = [fingerprint]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, list):
+            if len(item) == 3 and all(isinstance(elem, int) for elem in item):
+                if now - item[0] / 1e9 < RACY_SECONDS:
+                    return True
+            else:
+                stack.extend(item)
+    return False
+
+
+class StatusCache:
+    """ Cache of [commit-status, push-status, details] results, keyed by absolute repository path.
+
+    Usage:
+        status_cache = StatusCache(filename, max_age=3600, key=settings_key(...))
+        status_cache.load()
+        fingerprint, result = status_cache.lookup(gitrepo)
+        if result is None:
+            result = <check status>
+            status_cache.store(gitrepo, fingerprint, result)
+        ...
+        status_cache.save()
+    """
+
+    def __init__(self, filename, max_age=None, key=None):
+        """
+        Args:
+            filename: Cache file.
+            max_age: Cached results older than this (in seconds) are not used. None means no limit.
+            key: Key for the settings used to produce the results, e.g. from settings_key().
+                Cached results made with a different key are not used.
+        """
+        self.filename = filename
+        self.max_age = max_age
+        self.key = key
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """ Load cached results from file. """
+        try:
+            with open(self.filename) as fp:
+                data = json.load(fp)
+        except FileNotFoundError:
+            logger.debug("Status cache %s does not exist.", self.filename)
+            return
+        except (OSError, ValueError) as exc:
+            logger.warning("Could not read status cache %s (%s), checking all repositories.", self.filename, exc)
+            return
+        if data.get("version") != CACHE_VERSION:
+            return
+        self.entries = data.get("repos", {})
+        logger.debug("Loaded %s cached status results from %s", len(self.entries), self.filename)
+
+    def save(self):
+        """ Save cached results to file. """
+        now = time.time()
+        with self._lock:
+            repos = {path: entry for path, entry in self.entries.items() if now - entry["checked"] < PRUNE_SECONDS}
+        data = {"version": CACHE_VERSION, "repos": repos}
+        tmpfn = "%s.%s.tmp" % (self.filename, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+            with open(tmpfn, "w") as fp:
+                json.dump(data, fp, separators=(",", ":"))
+            os.replace(tmpfn, self.filename)
+        except OSError as exc:
+            logger.warning("Could not write status cache %s: %s", self.filename, exc)
+            return
+        logger.info("Status cache: %s cached results reused, %s repositories checked; saved to %s",
+                    self.hits, self.misses, self.filename)
+
+    def lookup(self, gitrepo, fingerprint_func):
+        """ Look up cached result for <gitrepo>.
+
+        Args:
+            gitrepo: Path of the git repository.
+            fingerprint_func: Function returning the current fingerprint of the repository (given its path).
+
+        Returns:
+            (fingerprint, result) two-tuple, where fingerprint is the current fingerprint of the repository
+            (to be passed to store() after checking), and result is the cached result, or None
+            if the repository has changed, the cached result is too old, or there is no cached result.
+        """
+        path = os.path.abspath(gitrepo)
+        fingerprint = _normalize(fingerprint_func(gitrepo))
+        with self._lock:
+            entry = self.entries.get(path)
+            if (fingerprint is not None and entry is not None
+                    and entry.get("key") == self.key
+                    and entry["fingerprint"] == fingerprint
+                    and (self.max_age is None or time.time() - entry["checked"] < self.max_age)):
+                self.hits += 1
+                return fingerprint, entry["result"]
+            self.misses += 1
+        return fingerprint, None
+
+    def store(self, gitrepo, fingerprint, result):
+        """ Store <result> for <gitrepo>, taken with repository <fingerprint> (as returned by lookup()).
+
+        <result> must be JSON serializable.
+        """
+        now = time.time()
+        if fingerprint is None or _is_racy(fingerprint, now):
+            return
+        with self._lock:
+            self.entries[os.path.abspath(gitrepo)] = {
+                "key": self.key, "fingerprint": fingerprint, "checked": now, "result": list(result),
+            }
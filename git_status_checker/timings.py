@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Lightweight timing instrumentation, used by the `--timings` report.
+
+Records the wall time of the directory walk, the number of directories listed,
+the duration of each repository's status check and fetch check, and the number of subprocesses started.
+Recording only takes a lock and stores a number, so the overhead is negligible compared to running `git`.
+
+"""
+
+import sys
+import time
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+
+def percentile(values, pct):
+    """ Return the <pct> percentile of <values> (nearest-rank method), or None if values is empty. """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, -(-len(values) * pct // 100))  # ceil(n * pct / 100)
+    return values[int(rank) - 1]
+
+
+class Timings:
+    """ Collect timing data for a run. All methods are thread-safe.
+
+    Usage:
+        timings = Timings()
+        timings.start()
+        <pass timings to iter_gitrepos() and iter_repo_status()>
+        timings.print_report()
+    """
+
+    def __init__(self):
+        self.started = None
+        self.walk_started = None
+        self.walk_finished = None
+        self.ndirs = 0
+        self.nrepos_found = 0
+        self.nsubprocesses = 0
+        self.durations = {"status": {}, "fetch": {}}  # {kind: {gitrepo: seconds}}
+        self._counting_subprocesses = False
+        self._hook_installed = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """ Start the run clock, and start counting subprocesses. """
+        self.started = time.perf_counter()
+        if not self._hook_installed and hasattr(sys, "addaudithook"):
+            # The "subprocess.Popen" audit event is raised for every subprocess, including those
+            # started by asyncio. Audit hooks cannot be removed, so the hook only counts while started.
+            sys.addaudithook(self._audit_hook)
+            self._hook_installed = True
+        self._counting_subprocesses = True
+
+    def stop(self):
+        """ Stop counting subprocesses. """
+        self._counting_subprocesses = False
+
+    def _audit_hook(self, event, _args):
+        if event == "subprocess.Popen" and self._counting_subprocesses:
+            with self._lock:
+                self.nsubprocesses += 1
+
+    def count_dir(self):
+        """ Record that a directory was listed during the walk. """
+        with self._lock:
+            self.ndirs += 1
+
+    def walk_start(self):
+        self.walk_started = time.perf_counter()
+
+    def walk_done(self, nrepos):
+        self.walk_finished = time.perf_counter()
+        self.nrepos_found = nrepos
+
+    def record(self, kind, gitrepo, seconds):
+        """ Record that the <kind> ("status" or "fetch") check of <gitrepo> took <seconds>. """
+        with self._lock:
+            self.durations[kind][gitrepo] = seconds
+
+    def slowest(self, n=10):
+        """ Return list of (total seconds, gitrepo, status seconds, fetch seconds) for the <n> slowest repositories. """
+        with self._lock:
+            status, fetch = dict(self.durations["status"]), dict(self.durations["fetch"])
+        totals = [(status.get(gitrepo, 0) + fetch.get(gitrepo, 0), gitrepo, status.get(gitrepo), fetch.get(gitrepo))
+                  for gitrepo in set(status) | set(fetch)]
+        return sorted(totals, key=lambda item: (-item[0], item[1]))[:n]
+
+    def print_report(self, slowest=10, file=None):
+        """ Print timings report to <file> (default: stderr). """
+        file = file or sys.stderr
+
+        def ms(seconds):
+            return "-" if seconds is None else "%.1f ms" % (seconds * 1000)
+
+        print("\nTimings:", file=file)
+        if self.started is not None:
+            print("  Total:         %.2f s" % (time.perf_counter() - self.started), file=file)
+        if self.walk_finished is not None:
+            print("  Walk:          %.2f s, %s directories listed, %s repositories found" % (
+                self.walk_finished - self.walk_started, self.ndirs, self.nrepos_found), file=file)
+        for kind in ("status", "fetch"):
+            values = list(self.durations[kind].values())
+            if values:
+                print("  %-14s %s repositories, p50 %s, p95 %s, max %s" % (
+                    kind.capitalize() + ":", len(values), ms(percentile(values, 50)),
+                    ms(percentile(values, 95)), ms(max(values))), file=file)
+        if self._hook_installed:
+            print("  Subprocesses:  %s" % self.nsubprocesses, file=file)
+        rows = self.slowest(slowest)
+        if rows:
+            print("  Slowest %s repositories (status + fetch):" % len(rows), file=file)
+            for total, gitrepo, status, fetch in rows:
+                print("    %10s  %s  (status %s, fetch %s)" % (ms(total), gitrepo, ms(status), ms(fetch)), file=file)
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+File system watchers for `--watch` mode: report which repositories have (probably) changed.
+
+Two implementations, with the same interface:
+* InotifyWatcher (Linux): Uses inotify (via ctypes, no extra dependencies) to watch
+    - every directory in each worktree, except the `.git` directory, git-ignored directories
+      and nested repositories (which are watched as repositories of their own),
+    - the git directory (index, HEAD, packed-refs, config), and the refs/heads and refs/remotes directories.
+  Uses no CPU while nothing changes.
+* PollingWatcher (everywhere else, or if inotify is not available or runs out of watches):
+  Every <interval> seconds, compares a signature of each repository: the repository fingerprint
+  (see gitdir.repo_fingerprint) plus the stat info of every file and directory in the worktree
+  (again excluding `.git`, git-ignored directories and nested repositories). This does not start any processes.
+
+Usage:
+    watcher = make_watcher(gitrepos)
+    for changed_repos in iter_changes(watcher, debounce=0.5):
+        <re-check changed_repos>
+
+Events caused by running `git` itself should be avoided by setting GIT_OPTIONAL_LOCKS=0,
+which stops `git status` from refreshing (writing) the index.
+
+"""
+
+import os
+import sys
+import time
+import errno
+import struct
+import select
+import subprocess
+import logging
+logger = logging.getLogger(__name__)
+
+if __package__:
+    from . import gitdir as gd
+else:
+    import gitdir as gd
+
+
+# inotify constants, from <sys/inotify.h>:
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_EXCL_UNLINK)
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+# Files in the git directory whose changes affect the status (other files, e.g. *.lock, are ignored):
+GITDIR_FILES = {"index", "HEAD", "packed-refs", "config"}
+
+
+class WatcherError(Exception):
+    """ Raised if a watcher cannot be set up (e.g. inotify is not available, or has too few watches). """
+
+
+def ignored_dirs(gitrepo):
+    """ Return set of (absolute paths of) git-ignored directories in worktree <gitrepo>.
+
+    Uses `git ls-files --others --ignored --exclude-standard --directory`, which lists
+    ignored directories (with a trailing slash) without descending into them.
+    """
+    try:
+        output = subprocess.check_output(
+            ["git", "ls-files", "--others", "--ignored", "--exclude-standard", "--directory", "-z"],
+            cwd=gitrepo, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError) as exc:
+        logger.debug("%s: Could not list ignored directories: %s", gitrepo, exc)
+        return set()
+    return {os.path.normpath(os.path.join(gitrepo, os.fsdecode(path)))
+            for path in output.split(b"\0") if path.endswith(b"/")}
+
+
+def iter_worktree_dirs(worktree, skip):
+    """ Yield <worktree> and all directories below it, not descending into `.git`, nested repositories,
+    or directories in <skip>. Symbolic links are not followed.
+    """
+    stack = [worktree]
+    while stack:
+        dirpath = stack.pop()
+        yield dirpath
+        try:
+            with os.scandir(dirpath) as it:
+                for entry in it:
+                    if (entry.name != ".git" and entry.is_dir(follow_symlinks=False) and entry.path not in skip
+                            and not os.path.lexists(os.path.join(entry.path, ".git"))):
+                        stack.append(entry.path)
+        except OSError:
+            continue
+
+
+def _load_libc():
+    import ctypes
+    import ctypes.util
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        raise WatcherError("inotify is not available.")
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc, ctypes
+
+
+class InotifyWatcher:
+    """ Watch repositories for changes using inotify. See module docstring. """
+
+    def __init__(self, gitrepos):
+        """
+        Args:
+            gitrepos: List of repository (worktree) paths to watch.
+
+        Raises WatcherError if inotify is not available, or if the repositories cannot all be watched
+        (e.g. because fs.inotify.max_user_watches is too low).
+        """
+        if not sys.platform.startswith("linux"):
+            raise WatcherError("inotify is only available on Linux.")
+        self._libc, self._ctypes = _load_libc()
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise WatcherError("inotify_init1 failed: %s" % os.strerror(self._ctypes.get_errno()))
+        self.gitrepos = list(gitrepos)
+        self.watches = {}  # wd -> (gitrepo, kind, path), where kind is "worktree", "gitdir" or "refs".
+        self.skip = {}  # gitrepo -> set of directories not to watch (git-ignored directories).
+        try:
+            for gitrepo in self.gitrepos:
+                self._watch_repo(gitrepo)
+        except WatcherError:
+            self.close()
+            raise
+        logger.info("Watching %s repositories using %s inotify watches.", len(self.gitrepos), len(self.watches))
+
+    def _add_watch(self, path, gitrepo, kind):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = self._ctypes.get_errno()
+            if err in (errno.ENOSPC, errno.ENOMEM):
+                raise WatcherError("Could not add inotify watch (%s). "
+                                   "Consider increasing fs.inotify.max_user_watches." % os.strerror(err))
+            logger.debug("Could not watch %s: %s", path, os.strerror(err))  # e.g. deleted or not a directory.
+            return
+        self.watches[wd] = (gitrepo, kind, path)
+
+    def _watch_tree(self, path, gitrepo, kind):
+        if kind == "worktree":
+            for dirpath in iter_worktree_dirs(path, self.skip.get(gitrepo, ())):
+                self._add_watch(dirpath, gitrepo, kind)
+        else:
+            for dirpath, _, _ in os.walk(path):
+                self._add_watch(dirpath, gitrepo, kind)
+
+    def _watch_repo(self, gitrepo):
+        gitdir = gd.resolve_gitdir(gitrepo)
+        if gitdir is None:
+            logger.warning("%s: Could not find git directory, not watching.", gitrepo)
+            return
+        commondir = gd.resolve_commondir(gitdir)
+        self.skip[gitrepo] = ignored_dirs(gitrepo)
+        self._watch_tree(gitrepo, gitrepo, "worktree")
+        self._add_watch(gitdir, gitrepo, "gitdir")
+        if commondir != gitdir:
+            self._add_watch(commondir, gitrepo, "gitdir")
+        for refs in ("refs/heads", "refs/remotes"):
+            if os.path.isdir(os.path.join(commondir, refs)):
+                self._watch_tree(os.path.join(commondir, refs), gitrepo, "refs")
+
+    def fileno(self):
+        return self.fd
+
+    def read_events(self, timeout=None):
+        """ Wait up to <timeout> seconds (None: forever) for events, and return set of changed repositories.
+
+        Events that do not affect the status (e.g. lock files in the git directory) do not end the wait.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if not ready:
+                return set()
+            changed = self._read_available()
+            if changed:
+                return changed
+
+    def _read_available(self):
+        """ Read and handle all available events. Returns set of changed repositories. """
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+                offset += EVENT_HEADER.size + length
+                self._handle_event(wd, mask, os.fsdecode(name), changed)
+        return changed
+
+    def _handle_event(self, wd, mask, name, changed):
+        if mask & IN_Q_OVERFLOW:
+            logger.info("inotify event queue overflowed, re-checking all repositories.")
+            changed.update(self.gitrepos)
+            return
+        if wd not in self.watches:
+            return
+        gitrepo, kind, path = self.watches[wd]
+        if mask & IN_IGNORED:
+            del self.watches[wd]  # The watched directory was deleted (or moved away).
+            return
+        if kind == "gitdir" and name not in GITDIR_FILES:
+            return
+        if name.endswith(".lock") and kind != "worktree":
+            return
+        if kind == "worktree" and name == ".git":
+            return
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and kind in ("worktree", "refs"):
+            try:
+                self._watch_tree(os.path.join(path, name), gitrepo, kind)
+            except WatcherError as exc:
+                logger.warning("%s: Not watching new directory %s: %s", gitrepo, name, exc)
+        changed.add(gitrepo)
+
+    def close(self):
+        if self.fd is not None and self.fd >= 0:
+            os.close(self.fd)
+        self.fd = None
+
+
+class PollingWatcher:
+    """ Watch repositories for changes by periodically comparing stat signatures. See module docstring. """
+
+    def __init__(self, gitrepos, interval=2.0):
+        self.gitrepos = list(gitrepos)
+        self.interval = interval
+        self.skip = {gitrepo: ignored_dirs(gitrepo) for gitrepo in self.gitrepos}
+        self.signatures = {gitrepo: self.signature(gitrepo) for gitrepo in self.gitrepos}
+        self._next_poll = time.monotonic() + interval
+        logger.info("Watching %s repositories by polling every %s seconds.", len(self.gitrepos), interval)
+
+    def signature(self, gitrepo):
+        """ Return a hash of the repository fingerprint and the stat info of the worktree's files. """
+        sig = hash(repr(gd.repo_fingerprint(gitrepo)))
+        for dirpath in iter_worktree_dirs(gitrepo, self.skip[gitrepo]):
+            try:
+                with os.scandir(dirpath) as it:
+                    for entry in it:
+                        if entry.name == ".git":
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                        sig = hash((sig, entry.name, st.st_mtime_ns, st.st_size, st.st_ino, st.st_mode))
+            except OSError:
+                continue
+        return sig
+
+    def read_events(self, timeout=None):
+        """ Wait until the next poll (or <timeout> seconds, if that is sooner), and return set of changed repos. """
+        delay = self._next_poll - time.monotonic()
+        if timeout is not None and timeout < delay:
+            time.sleep(max(0, timeout))
+            return set()
+        time.sleep(max(0, delay))
+        self._next_poll = time.monotonic() + self.interval
+        changed = set()
+        for gitrepo in self.gitrepos:
+            signature = self.signature(gitrepo)
+            if signature != self.signatures[gitrepo]:
+                self.signatures[gitrepo] = signature
+                changed.add(gitrepo)
+        return changed
+
+    def close(self):
+        pass
+
+
+def make_watcher(gitrepos, polling=False, interval=2.0):
+    """ Return an InotifyWatcher for <gitrepos> if possible, otherwise a PollingWatcher.
+
+    Args:
+        gitrepos: List of repository paths to watch.
+        polling: Always use polling.
+        interval: Polling interval, in seconds.
+    """
+    if not polling:
+        try:
+            return InotifyWatcher(gitrepos)
+        except (WatcherError, OSError) as exc:
+            logger.warning("Could not use inotify (%s), watching for changes by polling every %s seconds.",
+                           exc, interval)
+    return PollingWatcher(gitrepos, interval=interval)
+
+
+def iter_changes(watcher, debounce=0.5, max_delay=None):
+    """ Yield sets of changed repositories, reported by <watcher>.
+
+    Changes are debounced: a set is yielded once no new events have been seen for <debounce> seconds,
+    or when the first pending change is <max_delay> seconds old (default: 10 times debounce),
+    so a repository that is modified continuously is still re-checked regularly.
+    """
+    if max_delay is None:
+        max_delay = 10 * debounce
+    pending = set()
+    first = None
+    while True:
+        if pending:
+            timeout = max(0, min(debounce, first + max_delay - time.monotonic()))
+        else:
+            timeout = None
+        changed = watcher.read_events(timeout)
+        if changed:
+            pending |= changed
+            if first is None:
+                first = time.monotonic()
+        if pending and (not changed or time.monotonic() - first >= max_delay):
+            yield pending
+            pending = set()
+            first = None
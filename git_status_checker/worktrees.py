@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Worktree and submodule awareness.
+
+Several checkouts can share one repository: linked worktrees (`git worktree add`) and the main worktree
+all use the same common git directory (refs, config, objects), which is found by following the
+`gitdir:` link in each linked worktree's `.git` file (see gitdir.py).
+The worktrees of one repository form a group, and work that only depends on the common git directory
+is done once per group (during one pass over the repositories), instead of once per checkout:
+* The local branches and their upstreams (`git for-each-ref`, for --all-branches).
+  Other branches (not checked out in any worktree) are only reported for one worktree of the group.
+* The fetch check, for worktrees that fetch from the same remote.
+`git status` is still run in every worktree, since each worktree has its own index and checked-out branch.
+
+Discovery (see related_repos()) can also follow the links from each repository found:
+* --worktrees: Also check all worktrees of each repository, and check bare repositories
+  (which cannot be checked themselves) through their linked worktrees.
+* --submodules: Also check the checked-out submodules of each repository, recursively.
+
+"""
+
+import os
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+if __package__:
+    from . import gitdir
+else:
+    import gitdir
+
+
+def related_repos(gitrepo, worktrees=False, submodules=False):
+    """ Yield <gitrepo>, followed by its related repositories.
+
+    Args:
+        gitrepo: A repository found by the scan (a worktree or a bare repository).
+        worktrees: If True, also yield the main and linked worktrees of <gitrepo>'s repository
+            (main worktree first). A bare repository is replaced by its linked worktrees (if it has any).
+        submodules: If True, also yield the checked-out submodules of each yielded worktree, recursively.
+
+    The same repository may be yielded more than once (e.g. a worktree that is also found by the scan);
+    the caller is expected to skip duplicates.
+    """
+    checkouts = [gitrepo]
+    gdir = gitdir.resolve_gitdir(gitrepo) if worktrees else None
+    if gdir is not None:
+        commondir = gitdir.resolve_commondir(gdir)
+        main = gitdir.main_worktree(commondir)
+        others = ([main] if main is not None else []) + list(gitdir.linked_worktrees(commondir))
+        if others and os.path.normpath(gdir) == os.path.normpath(gitrepo):
+            checkouts = []  # <gitrepo> is a git directory (e.g. bare); check it through its worktrees.
+        checkouts += others
+    for checkout in checkouts:
+        yield checkout
+        if submodules:
+            for path in gitdir.submodule_paths(checkout):
+                yield from related_repos(path, worktrees=worktrees, submodules=submodules)
+
+
+class RepoGroups:
+    """ Results shared between the worktrees of the same repository during one pass over the repositories.
+
+    Repositories are grouped by their common git directory. Thread-safe: if several threads ask for
+    the same shared result, it is computed by the first, and the others wait for it.
+    Create a new RepoGroups for each pass, since shared results are never invalidated.
+    """
+
+    def __init__(self, worktrees=False):
+        """
+        Args:
+            worktrees: True if all worktrees of each repository are checked in this pass (--worktrees),
+                so results that only need to be reported once per repository can be left to one of them.
+        """
+        self.worktrees = worktrees
+        self._lock = threading.Lock()
+        self._commondirs = {}
+        self._results = {}   # (commondir, key) -> [threading.Event, result, exception]
+
+    def commondir(self, gitrepo):
+        """ Return the (real) common git directory of <gitrepo>, or <gitrepo> itself if it cannot be resolved. """
+        commondir = self._commondirs.get(gitrepo)
+        if commondir is None:
+            gdir = gitdir.resolve_gitdir(gitrepo)
+            commondir = os.path.realpath(gitdir.resolve_commondir(gdir) if gdir is not None else gitrepo)
+            self._commondirs[gitrepo] = commondir
+        return commondir
+
+    def shared(self, gitrepo, key, func):
+        """ Return func(), computed at most once for all repositories with the same common git directory as <gitrepo>.
+
+        Args:
+            gitrepo: The repository.
+            key: Identifies the result within the group, e.g. "branches".
+            func: Function computing the result (called without arguments). Exceptions are re-raised for all callers.
+        """
+        group_key = (self.commondir(gitrepo), key)
+        with self._lock:
+            entry = self._results.get(group_key)
+            first = entry is None
+            if first:
+                entry = self._results[group_key] = [threading.Event(), None, None]
+        if first:
+            try:
+                entry[1] = func()
+            except BaseException as exc:  # pylint: disable=broad-except
+                entry[2] = exc
+            finally:
+                entry[0].set()
+        else:
+            logger.debug("%s: Using shared %s result for %s", gitrepo, key, group_key[0])
+            entry[0].wait()
+        if entry[2] is not None:
+            raise entry[2]
+        return entry[1]
+
+    def fetch_status(self, gitrepo, func):
+        """ Return func() (the fetch status, or a Future for it), computed once for all worktrees of the
+        repository that fetch from the same remote (the default remote of the checked-out branch).
+        """
+        gdir = gitdir.resolve_gitdir(gitrepo)
+        remote = gitdir.default_remote(gdir) if gdir is not None else None
+        return self.shared(gitrepo, ("fetch", remote), func)
+
+    def checked_out_branches(self, gitrepo):
+        """ Return set of the branches checked out in any worktree of <gitrepo>'s repository. """
+        def read():
+            return {head[len("refs/heads/"):] for head in gitdir.worktree_heads(self.commondir(gitrepo)).values()
+                    if head and head.startswith("refs/heads/")}
+        return self.shared(gitrepo, "checked_out_branches", read)
+
+    def reports_other_branches(self, gitrepo):
+        """ Return True if <gitrepo> is the worktree that reports the branches not checked out in any worktree.
+
+        That is the main worktree, or if the repository is bare, the first of its linked worktrees (by path).
+        Repositories without linked worktrees always report their other branches.
+        """
+        def owner():
+            commondir = self.commondir(gitrepo)
+            worktrees = sorted(gitdir.linked_worktrees(commondir))
+            main = gitdir.main_worktree(commondir)
+            if main is not None or not worktrees:
+                return main
+            return worktrees[0]
+        owner_path = self.shared(gitrepo, "owner", owner)
+        return owner_path is None or os.path.realpath(owner_path) == os.path.realpath(gitrepo)
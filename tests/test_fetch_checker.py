@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Tests for the ls-remote fetch engine (fetch_checker.py): refspec handling and remote URLs, and reading
+multi-valued config variables (gitdir.read_config()).
+
+"""
+
+import shutil
+import subprocess
+
+import pytest
+
+from git_status_checker import gitdir
+from git_status_checker.fetch_checker import map_refspec, compare_refs, LsRemoteFetchChecker
+
+
+@pytest.fixture
+def git_environment(tmp_path, monkeypatch):
+    """ Isolate git from the user's and system's git config. """
+    if shutil.which("git") is None:
+        pytest.skip("git is not installed")
+    home = tmp_path / "home"
+    home.mkdir()
+    monkeypatch.setenv("HOME", str(home))
+    monkeypatch.setenv("GIT_CONFIG_NOSYSTEM", "1")
+    for var in ("XDG_CONFIG_HOME", "GIT_CONFIG_GLOBAL", "GIT_DIR", "GIT_WORK_TREE"):
+        monkeypatch.delenv(var, raising=False)
+    for var in ("GIT_AUTHOR_NAME", "GIT_COMMITTER_NAME"):
+        monkeypatch.setenv(var, "Test")
+    for var in ("GIT_AUTHOR_EMAIL", "GIT_COMMITTER_EMAIL"):
+        monkeypatch.setenv(var, "test@example.com")
+
+
+def git(cwd, *args):
+    return subprocess.run(["git"] + list(args), cwd=str(cwd), check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout.decode()
+
+
+def test_map_refspec():
+    assert map_refspec("+refs/heads/*:refs/remotes/origin/*", "refs/heads/feature/x") == "refs/remotes/origin/feature/x"
+    assert map_refspec("refs/heads/main:refs/remotes/origin/main", "refs/heads/main") == "refs/remotes/origin/main"
+    assert map_refspec("refs/heads/main:refs/remotes/origin/main", "refs/heads/other") is None
+    assert map_refspec("refs/heads/main", "refs/heads/main") is None  # Only updates FETCH_HEAD.
+
+
+def test_compare_refs_uses_all_refspecs():
+    advertised = {"refs/heads/main": "b" * 40, "refs/heads/special": "c" * 40, "refs/heads/tmp/x": "d" * 40}
+    local = {"refs/remotes/origin/main": "a" * 40, "refs/remotes/origin/special": "c" * 40}
+    refspecs = ["+refs/heads/*:refs/remotes/origin/*", "+refs/heads/special:refs/special/s", "^refs/heads/tmp/*"]
+    assert compare_refs(advertised, local, refspecs) == [
+        ("a" * 40, "b" * 40, "refs/heads/main", "refs/remotes/origin/main"),
+        (None, "c" * 40, "refs/heads/special", "refs/special/s"),
+    ]
+
+
+def test_read_config_multivalued(tmp_path):
+    config_file = tmp_path / "config"
+    config_file.write_text('[remote "origin"]\n\turl = /srv/repo.git\n'
+                           '\tfetch = +refs/heads/*:refs/remotes/origin/*\n'
+                           '\tfetch = +refs/notes/*:refs/notes/*\n')
+    assert gitdir.read_config(str(config_file))[("remote", "origin")]["fetch"] == "+refs/notes/*:refs/notes/*"
+    assert gitdir.read_config(str(config_file), multivalued=True)[("remote", "origin")] == {
+        "url": ["/srv/repo.git"],
+        "fetch": ["+refs/heads/*:refs/remotes/origin/*", "+refs/notes/*:refs/notes/*"],
+    }
+
+
+def test_ls_remote_relative_url(tmp_path, monkeypatch, git_environment):
+    """ A relative remote URL is relative to the worktree, also when the repository path itself is relative. """
+    git(tmp_path, "init", "-q", "upstream")
+    git(tmp_path / "upstream", "commit", "-q", "--allow-empty", "-m", "First")
+    git(tmp_path, "clone", "-q", "upstream", "sub/repo")
+    git(tmp_path / "sub/repo", "remote", "set-url", "origin", "../../upstream")
+    git(tmp_path / "upstream", "commit", "-q", "--allow-empty", "-m", "Second")
+    branch = git(tmp_path / "upstream", "symbolic-ref", "--short", "HEAD").strip()
+    monkeypatch.chdir(tmp_path)
+
+    with LsRemoteFetchChecker() as fetch_checker:
+        fetch_status = fetch_checker.submit("sub/repo").result()
+    assert fetch_status.startswith("From %s\n" % (tmp_path / "upstream"))
+    assert fetch_status.endswith("-> origin/%s" % branch)
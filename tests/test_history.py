@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Tests for the result history (history.py).
+
+"""
+
+import os
+
+from git_status_checker import history
+
+
+DIRTY = ([" M README.md"], "", None)
+CLEAN = ([], "", None)
+
+
+def test_paths_do_not_depend_on_working_directory(tmp_path, monkeypatch):
+    farm = tmp_path / "farm"
+    (farm / "tree").mkdir(parents=True)
+    dbfile = str(tmp_path / "history.sqlite")
+    repos = ["repo%s" % i for i in range(5)]
+
+    monkeypatch.chdir(farm)  # Basedir "tree".
+    recorder = history.HistoryRecorder(dbfile, basedirs=[os.path.abspath("tree")])
+    list(recorder.record((os.path.join("tree", repo), DIRTY if repo == "repo0" else CLEAN) for repo in repos))
+    recorder.save()
+    monkeypatch.chdir(farm / "tree")  # Basedir ".".
+    recorder = history.HistoryRecorder(dbfile, basedirs=[os.path.abspath(".")])
+    list(recorder.record((os.path.join(".", repo), DIRTY if repo in ("repo0", "repo1") else CLEAN) for repo in repos))
+    recorder.save()
+
+    connection = history.connect(dbfile)
+    try:
+        paths = {path for (path,) in connection.execute("SELECT DISTINCT path FROM results")}
+        assert paths == {str(farm / "tree" / repo) for repo in repos}
+        # repo0 was dirty in both runs, repo1 was clean in the first:
+        assert [(path, previously) for path, _, previously in history.newly_dirty(connection, since=0)] == [
+            (str(farm / "tree" / "repo1"), "clean")]
+    finally:
+        connection.close()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Tests for sharded runs (--shard K/N) and merging their result files (merge.py).
+
+"""
+
+import os
+import json
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+import git_status_checker
+from git_status_checker import merge
+
+
+@pytest.fixture(autouse=True)
+def git_environment(tmp_path, monkeypatch):
+    """ Isolate git (and git-status-checker's config file) from the user's and system's config. """
+    home = tmp_path / "home"
+    home.mkdir()
+    monkeypatch.setenv("HOME", str(home))
+    monkeypatch.setenv("GIT_CONFIG_NOSYSTEM", "1")
+    for var in ("XDG_CONFIG_HOME", "GIT_CONFIG_GLOBAL", "GIT_DIR", "GIT_WORK_TREE"):
+        monkeypatch.delenv(var, raising=False)
+    for var in ("GIT_AUTHOR_NAME", "GIT_COMMITTER_NAME"):
+        monkeypatch.setenv(var, "Test")
+    for var in ("GIT_AUTHOR_EMAIL", "GIT_COMMITTER_EMAIL"):
+        monkeypatch.setenv(var, "test@example.com")
+
+
+def git(cwd, *args):
+    return subprocess.run(["git"] + list(args), cwd=str(cwd), check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout.decode()
+
+
+def run(cwd, *args):
+    """ Run git-status-checker with <args> in <cwd>. Returns two-tuple (exit status, stdout). """
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(git_status_checker.__file__))))
+    result = subprocess.run([sys.executable, "-m", "git_status_checker.git_status_checker"] + list(args),
+                            cwd=str(cwd), env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return result.returncode, result.stdout.decode()
+
+
+def without_duration(records):
+    return sorted((dict(record, duration=None) for record in records), key=lambda record: record["path"])
+
+
+@pytest.fixture
+def farm(tmp_path):
+    """ Return a directory with 12 repositories, 3 of which have uncommitted changes. """
+    farm = tmp_path / "farm"
+    for i in range(12):
+        repo = farm / ("group%s" % (i % 3)) / ("repo%s" % i)
+        repo.mkdir(parents=True)
+        git(repo, "init", "-q")
+        (repo / "README.md").write_text("readme\n")
+        git(repo, "add", "README.md")
+        git(repo, "commit", "-q", "-m", "Initial commit")
+        if i % 4 == 1:
+            (repo / "README.md").write_text("changed\n")
+        elif i == 6:
+            (repo / "new.txt").write_text("new\n")
+    return farm
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+@pytest.mark.parametrize("nshards", [1, 2, 5])
+def test_merged_shards_same_as_unsharded(tmp_path, farm, nshards):
+    options = ["--format", "jsonl", "--no-check-remote-tracking-branch"]
+    status, unsharded = run(tmp_path, str(farm), *options)
+    unsharded = [json.loads(line) for line in unsharded.splitlines()]
+    assert status == 1 and len(unsharded) == 12
+    assert sum(record["dirty"] for record in unsharded) == 4
+
+    shard_files, shard_paths = [], []
+    for shard in range(1, nshards + 1):
+        status, shard_output = run(tmp_path, str(farm), "--shard", "%s/%s" % (shard, nshards), *options)
+        shard_file = tmp_path / ("shard-%s.jsonl" % shard)
+        shard_file.write_text(shard_output)
+        shard_files.append(str(shard_file))
+        records = [json.loads(line) for line in shard_output.splitlines()]
+        shard_paths.extend(record["path"] for record in records)
+        assert status == (1 if any(record["dirty"] for record in records) else 0)
+    assert sorted(shard_paths) == sorted(record["path"] for record in unsharded)  # Each repository in one shard.
+
+    status, merged = run(tmp_path, "merge", "--format", "jsonl", *shard_files)
+    assert status == 1
+    assert without_duration(json.loads(line) for line in merged.splitlines()) == without_duration(unsharded)
+
+
+@pytest.mark.parametrize("content, where", [
+    ('{"path": "/a", "dirty": false}\n\n{"dirty": true}\n', "line 3"),
+    ('{"path": "/a", "dirty": false}\n{"path": \n', "line 2"),
+    ('[{"path": "/a", "dirty": false}, ["/b"]]', "record 2"),
+])
+def test_bad_record_is_reported(tmp_path, capsys, content, where):
+    good = tmp_path / "good.jsonl"
+    good.write_text('{"path": "/b", "dirty": true}\n')
+    bad = tmp_path / "bad.jsonl"
+    bad.write_text(content)
+    assert merge.main([str(good), str(bad)]) == 2
+    assert "%s: %s:" % (bad, where) in capsys.readouterr().err
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Tests for the native backend (native_status.py), checked against the output of real `git` commands.
+
+The native backend must never report a dirty repository as clean, so each scenario is checked with
+`git status`: if git reports any change, read_status_native() must raise Unsupported.
+
+"""
+
+import os
+import shutil
+import subprocess
+import time
+
+import pytest
+
+from git_status_checker import native_status
+from git_status_checker.native_status import Unsupported
+
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+
+
+@pytest.fixture(autouse=True)
+def git_environment(tmp_path, monkeypatch):
+    """ Isolate git (and the native backend) from the user's and system's git config. """
+    home = tmp_path / "home"
+    home.mkdir()
+    monkeypatch.setenv("HOME", str(home))
+    monkeypatch.setenv("GIT_CONFIG_NOSYSTEM", "1")
+    monkeypatch.setenv("GIT_OPTIONAL_LOCKS", "0")  # `git status` must not refresh the index.
+    for var in ("XDG_CONFIG_HOME", "GIT_CONFIG_GLOBAL", "GIT_DIR", "GIT_WORK_TREE", "GIT_INDEX_FILE"):
+        monkeypatch.delenv(var, raising=False)
+    for var in ("GIT_AUTHOR_NAME", "GIT_COMMITTER_NAME"):
+        monkeypatch.setenv(var, "Test")
+    for var in ("GIT_AUTHOR_EMAIL", "GIT_COMMITTER_EMAIL"):
+        monkeypatch.setenv(var, "test@example.com")
+
+
+def git(repo, *args):
+    return subprocess.run(["git"] + list(args), cwd=str(repo), check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout.decode()
+
+
+def write(repo, relpath, content="content\n", age=60):
+    """ Write file <relpath> in <repo>, with a modification time <age> seconds ago (so it is not racily clean). """
+    path = os.path.join(str(repo), relpath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fp:
+        fp.write(content)
+    then = time.time() - age
+    os.utime(path, (then, then))
+    return path
+
+
+def make_repo(path, files):
+    """ Create a repository at <path>, with <files> (dict {relpath: content}) committed. """
+    git(path.parent, "init", "-q", path.name)
+    for relpath, content in files.items():
+        write(path, relpath, content)
+    git(path, "add", "-A")
+    git(path, "commit", "-q", "-m", "Initial commit")
+    return path
+
+
+def git_status_entries(repo):
+    return [entry for entry in git(repo, "status", "--porcelain=v1", "-z").split("\0") if entry]
+
+
+def native_is_clean(repo):
+    try:
+        native_status.read_status_native(str(repo))
+    except Unsupported:
+        return False
+    return True
+
+
+FILES = {
+    ".gitignore": "*.log\n!keep.log\nbuild/\n",
+    "README.md": "readme\n",
+    "src/main.py": "print('hello')\n",
+    "src/pkg/__init__.py": "",
+    "docs/index.rst": "docs\n",
+}
+
+
+def test_read_index_matches_ls_files(tmp_path):
+    repo = make_repo(tmp_path / "repo", FILES)
+    script = write(repo, "bin/run.sh", "#!/bin/sh\n")
+    os.chmod(script, 0o755)
+    os.symlink("README.md", os.path.join(str(repo), "link"))
+    git(repo, "add", "-A")
+    git(repo, "commit", "-q", "-m", "More files")
+
+    entries, tree = native_status.read_index(os.path.join(str(repo), ".git", "index"))
+
+    expected = []
+    for line in git(repo, "ls-files", "--stage", "-z").split("\0"):
+        if line:
+            info, path = line.split("\t", 1)
+            expected.append((path, int(info.split()[0], 8)))
+    assert [(entry[0], entry[1]) for entry in entries] == expected
+    for entry in entries:
+        assert entry[7] == os.lstat(os.path.join(str(repo), entry[0])).st_size
+    assert tree == git(repo, "rev-parse", "HEAD^{tree}").strip()
+
+
+def test_read_index_unsupported_entries(tmp_path):
+    repo = make_repo(tmp_path / "repo", FILES)
+    indexfile = os.path.join(str(repo), ".git", "index")
+    git(repo, "update-index", "--assume-unchanged", "README.md")
+    with pytest.raises(Unsupported):
+        native_status.read_index(indexfile)
+    git(repo, "update-index", "--no-assume-unchanged", "README.md")
+    write(repo, "new.txt")
+    git(repo, "add", "--intent-to-add", "new.txt")
+    with pytest.raises(Unsupported):
+        native_status.read_index(indexfile)
+
+
+IGNORE_FILES = {
+    ".gitignore": "*.log\n!keep.log\n/build/\ntmp?\ndoc/**/*.pdf\n**/cache\n*.[oa]\nfile[!0-9]\nnode_modules/\n",
+    "sub/.gitignore": "*.txt\n!important.txt\n/local\n",
+    "README.md": "readme\n",
+}
+UNTRACKED_FILES = [
+    "a.log", "keep.log", "sub/b.log", "sub/keep.log", "build/out.bin", "sub/build/out.bin",
+    "tmp1", "tmpab", "doc/a.pdf", "doc/x/y/z.pdf", "doc/z.txt", "cache/f", "deep/er/cache/f",
+    "notes.txt", "sub/notes.txt", "sub/important.txt", "sub/local", "local", "sub/deeper/local",
+    "main.o", "src/main.c", "lib.a", "filex", "file1", "src/filey",
+    "node_modules/pkg/index.js", "sub/node_modules/x.js",
+]
+
+
+def native_ignored(worktree):
+    """ Return set of the ignored paths in <worktree> (ignored directories with a trailing "/", not descended into),
+    using the native backend's gitignore matching.
+    """
+    ignored = set()
+    stack = [("", [])]
+    while stack:
+        reldir, patterns = stack.pop()
+        dirpath = os.path.join(worktree, reldir)
+        gitignore = native_status.read_gitignore(os.path.join(dirpath, ".gitignore"))
+        if gitignore:
+            patterns = patterns + [(reldir, gitignore)]
+        for entry in os.scandir(dirpath):
+            if entry.name == ".git":
+                continue
+            relpath = reldir + "/" + entry.name if reldir else entry.name
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if native_status.is_ignored(relpath, is_dir, patterns):
+                ignored.add(relpath + "/" if is_dir else relpath)
+            elif is_dir:
+                stack.append((relpath, patterns))
+    return ignored
+
+
+def test_is_ignored_matches_git(tmp_path):
+    repo = make_repo(tmp_path / "repo", IGNORE_FILES)
+    for relpath in UNTRACKED_FILES:
+        write(repo, relpath)
+    output = git(repo, "status", "--porcelain=v1", "-z", "--ignored=matching", "--untracked-files=all")
+    git_ignored = {entry[3:] for entry in output.split("\0") if entry.startswith("!! ")}
+    assert git_ignored  # Sanity check of the test itself.
+    assert native_ignored(str(repo)) == git_ignored
+
+
+def test_gitignore_regex_unsupported_pattern():
+    with pytest.raises(Unsupported):
+        native_status.gitignore_regex("*.[[:digit:]]")
+
+
+SCENARIOS = {
+    "clean": lambda repo: None,
+    "ignored files only": lambda repo: [write(repo, "debug.log"), write(repo, "build/out.bin"),
+                                        write(repo, "src/build/x.o")],
+    "empty untracked directory": lambda repo: os.makedirs(os.path.join(str(repo), "empty/nested")),
+    "untracked file": lambda repo: write(repo, "new.txt"),
+    "untracked file in sub-directory": lambda repo: write(repo, "src/pkg/new.py"),
+    "untracked file in untracked directory": lambda repo: write(repo, "newdir/deeper/file.txt"),
+    "negated ignore pattern": lambda repo: write(repo, "keep.log"),
+    "untracked nested repository": lambda repo: git(repo, "init", "-q", "nested"),
+    "modified file": lambda repo: write(repo, "src/main.py", "print('changed')\n", age=0),
+    "modified file, same size": lambda repo: write(repo, "README.md", "README\n", age=0),
+    "deleted file": lambda repo: os.remove(os.path.join(str(repo), "docs/index.rst")),
+    "file replaced by directory": lambda repo: [os.remove(os.path.join(str(repo), "README.md")),
+                                                write(repo, "README.md/file")],
+    "file replaced by symlink": lambda repo: [os.remove(os.path.join(str(repo), "README.md")),
+                                              os.symlink("docs/index.rst", os.path.join(str(repo), "README.md"))],
+    "mode change": lambda repo: os.chmod(os.path.join(str(repo), "src/main.py"), 0o755),
+    "staged new file": lambda repo: [write(repo, "staged.txt"), git(repo, "add", "staged.txt")],
+    "staged modification": lambda repo: [write(repo, "README.md", "staged change\n"), git(repo, "add", "README.md")],
+    "staged deletion": lambda repo: git(repo, "rm", "-q", "--cached", "docs/index.rst"),
+}
+CLEAN_SCENARIOS = ("clean", "ignored files only", "empty untracked directory")
+
+
+@pytest.mark.parametrize("scenario", sorted(SCENARIOS))
+def test_never_reports_dirty_as_clean(tmp_path, scenario):
+    repo = make_repo(tmp_path / "repo", FILES)
+    SCENARIOS[scenario](repo)
+    native_clean = native_is_clean(repo)  # Before `git status`, so git cannot change the index first.
+    git_clean = not git_status_entries(repo)
+    assert git_clean == (scenario in CLEAN_SCENARIOS)
+    if not git_clean:
+        assert not native_clean
+    else:
+        assert native_clean  # The fast path should work for these (the files are not racily clean).
+
+
+def test_missing_gitdir_is_unsupported(tmp_path):
+    worktree = tmp_path / "worktree"
+    worktree.mkdir()
+    (worktree / ".git").write_text("gitdir: %s\n" % (tmp_path / "missing"))
+    with pytest.raises(Unsupported):
+        native_status.read_status_native(str(worktree))
+
+
+def test_corrupt_index_is_unsupported(tmp_path):
+    repo = make_repo(tmp_path / "repo", FILES)
+    indexfile = os.path.join(str(repo), ".git", "index")
+    with open(indexfile, "rb") as fp:
+        data = fp.read()
+    with open(indexfile, "wb") as fp:
+        fp.write(data[:len(data) // 2])
+    with pytest.raises(Unsupported):
+        native_status.read_status_native(str(repo))
+
+
+def test_corrupt_object_is_unsupported(tmp_path):
+    repo = make_repo(tmp_path / "repo", FILES)
+    commit = git(repo, "rev-parse", "HEAD").strip()
+    objectfile = os.path.join(str(repo), ".git", "objects", commit[:2], commit[2:])
+    os.chmod(objectfile, 0o644)
+    with open(objectfile, "wb") as fp:
+        fp.write(b"not zlib data")
+    with pytest.raises(Unsupported):
+        native_status.read_status_native(str(repo))
+
+
+@pytest.mark.parametrize("branch", ["master", "feature/x", "user/fix.v2-final"])
+def test_branch_names_same_as_subprocess(tmp_path, branch):
+    from git_status_checker import git_status_checker
+    git(tmp_path, "init", "-q", "--bare", "remote.git")
+    repo = make_repo(tmp_path / "repo", FILES)
+    git(repo, "checkout", "-q", "-B", branch)
+    git(repo, "remote", "add", "origin", str(tmp_path / "remote.git"))
+    git(repo, "push", "-q", "-u", "origin", branch)
+
+    info = native_status.read_status_native(str(repo))  # Must not fall back.
+    assert (info["local_branch"], info["remote"], info["remote_branch"]) == (branch, "origin", branch)
+    native = git_status_checker.check_repo_status(str(repo), backend="native")
+    subprocess_status = git_status_checker.check_repo_status(str(repo), backend="subprocess")
+    assert tuple(native) == tuple(subprocess_status)
+    assert native.details == subprocess_status.details
+
+
+PYGIT2_SCENARIOS = dict(SCENARIOS, **{
+    "untracked files in untracked directories": lambda repo: [write(repo, "newdir/a.txt"),
+                                                               write(repo, "newdir/deeper/b.txt")],
+    "ignored and untracked files": lambda repo: [write(repo, "debug.log"), write(repo, "keep.log"),
+                                                 write(repo, "build/out.bin"), write(repo, "new.txt")],
+    "staged rename": lambda repo: git(repo, "mv", "README.md", "README.rst"),
+    "unstaged rename": lambda repo: os.rename(os.path.join(str(repo), "README.md"),
+                                              os.path.join(str(repo), "README.rst")),
+})
+# Scenarios that read_status_pygit2() leaves to the subprocess backend (raises Unsupported), with ignore_untracked:
+PYGIT2_UNSUPPORTED = {"staged rename": (False, True), "file replaced by directory": (False,)}
+# Known difference (see read_status_pygit2): libgit2 does not list an untracked repository without commits.
+PYGIT2_DIFFERENT = ("untracked nested repository",)
+
+
+@pytest.mark.parametrize("ignore_untracked", [False, True])
+@pytest.mark.parametrize("scenario", sorted(PYGIT2_SCENARIOS))
+def test_pygit2_same_as_subprocess(tmp_path, scenario, ignore_untracked):
+    pytest.importorskip("pygit2")
+    from git_status_checker import git_status_checker
+    repo = make_repo(tmp_path / "repo", FILES)
+    PYGIT2_SCENARIOS[scenario](repo)
+    if scenario in PYGIT2_DIFFERENT:
+        pytest.skip("known difference from `git status`")
+    if ignore_untracked in PYGIT2_UNSUPPORTED.get(scenario, ()):
+        with pytest.raises(Unsupported):
+            native_status.read_status_pygit2(str(repo), ignore_untracked)
+    else:
+        native_status.read_status_pygit2(str(repo), ignore_untracked)  # Must not fall back.
+    for quick in (False, True):
+        kwargs = dict(ignore_untracked=ignore_untracked, quick=quick, check_remote_tracking_branch=False)
+        pygit2_status = git_status_checker.check_repo_status(str(repo), backend="pygit2", **kwargs)
+        subprocess_status = git_status_checker.check_repo_status(str(repo), backend="subprocess", **kwargs)
+        assert tuple(pygit2_status) == tuple(subprocess_status)
+        assert pygit2_status.details == subprocess_status.details
+
+
+def test_quick_mode_same_for_all_backends(tmp_path, monkeypatch):
+    from git_status_checker import git_status_checker
+    repo = make_repo(tmp_path / "repo", FILES)
+    write(repo, "README.md", "changed\n", age=0)
+    write(repo, "docs/index.rst", "changed\n", age=0)
+    write(repo, "new.txt")
+    subprocess_status = git_status_checker.check_repo_status(str(repo), backend="subprocess", quick=True)
+    assert subprocess_status[0][-1].startswith("... (stopped at the first changed file")
+
+    def read_status(gitrepo, backend, ignore_untracked):
+        # What read_status_pygit2() returns for this repository (pygit2 may not be installed):
+        return {"local_branch": "master", "remote": None, "remote_branch": None, "ahead_behind": None,
+                "files_status": [" M README.md", " M docs/index.rst", "?? new.txt"]}
+    monkeypatch.setattr(native_status, "read_status", read_status)
+    pygit2_status = git_status_checker.check_repo_status(str(repo), backend="pygit2", quick=True)
+    assert tuple(pygit2_status) == tuple(subprocess_status)
+    assert pygit2_status.details == subprocess_status.details
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Tests for the machine-readable output formats (output.py), including status transitions in --watch mode.
+
+"""
+
+import io
+import os
+import csv
+import json
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+import git_status_checker
+from git_status_checker import output
+from git_status_checker.git_status_checker import report_transition
+
+
+CLEAN = ([], "", None)
+DIRTY = ([" M README.md"], "", None)
+
+
+@pytest.mark.parametrize("fmt", sorted(output.WRITERS))
+def test_transition_records(fmt):
+    file = io.StringIO()
+    writer = output.make_writer(fmt, file, extra_fields=output.TRANSITION_FIELDS)
+    writer.write(output.status_record("repo", CLEAN))
+    report_transition("repo", CLEAN, DIRTY, writer=writer)
+    writer.close()
+
+    if fmt == "csv":
+        rows = list(csv.DictReader(io.StringIO(file.getvalue())))
+        assert rows[0]["time"] == rows[0]["previous_dirty"] == ""
+        assert rows[1]["dirty"] == "True" and rows[1]["previous_dirty"] == "False"
+        assert rows[1]["modified"] == "1"
+    else:
+        text = file.getvalue()
+        rows = json.loads(text) if fmt == "json" else [json.loads(line) for line in text.splitlines()]
+        assert "time" not in rows[0]
+        assert rows[1]["dirty"] is True and rows[1]["previous_dirty"] is False
+    assert rows[1]["time"]
+
+
+def test_csv_rejects_unknown_fields():
+    writer = output.make_writer("csv", io.StringIO())
+    record = dict(output.status_record("repo", CLEAN), time="2024-01-01 00:00:00")
+    with pytest.raises(ValueError):
+        writer.write(record)
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+@pytest.mark.parametrize("fmt", sorted(output.WRITERS))
+def test_wait_prompt_is_not_in_output(tmp_path, fmt):
+    env = dict(os.environ, HOME=str(tmp_path), GIT_CONFIG_NOSYSTEM="1",
+               PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(git_status_checker.__file__))))
+    repo = tmp_path / "repo"
+    subprocess.run(["git", "init", "-q", str(repo)], env=env, check=True)
+    (repo / "new.txt").write_text("new\n")  # Dirty, so --wait prompts.
+    result = subprocess.run(
+        [sys.executable, "-m", "git_status_checker.git_status_checker", "--wait", "--format", fmt, str(repo)],
+        input=b"\n", env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert result.returncode == 1
+    assert "Press Enter" in result.stderr.decode()
+    text = result.stdout.decode()
+    if fmt == "csv":
+        rows = list(csv.DictReader(io.StringIO(text)))
+    else:
+        rows = json.loads(text) if fmt == "json" else [json.loads(line) for line in text.splitlines()]
+    assert len(rows) == 1 and rows[0]["dirty"] in (True, "True")
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Tests for the streaming `git status --porcelain=v2 --branch -z` parser (porcelain.py).
+
+"""
+
+import io
+import shutil
+import subprocess
+
+import pytest
+
+from git_status_checker import porcelain
+
+
+HASH = "0123456789abcdef0123456789abcdef01234567"
+HEADERS = ["# branch.oid " + HASH, "# branch.head feature/x", "# branch.upstream origin/feature/x",
+           "# branch.ab +2 -3"]
+ENTRIES = [
+    "1 .M N... 100644 100644 100644 %s %s src/café.py" % (HASH, HASH),
+    "2 R. N... 100644 100644 100644 %s %s R100 new name.txt" % (HASH, HASH),
+    "1 M. looks like an entry",  # The original path of the rename, which must not be parsed as an entry.
+    "2 C. N... 100644 100644 100644 %s %s C75 docs/copy.rst" % (HASH, HASH),
+    "docs/index.rst",
+    "u UU N... 100644 100644 100644 100644 %s %s %s conflict.txt" % (HASH, HASH, HASH),
+    "? 日本語/",
+    "! build/",
+]
+OUTPUT = "".join(entry + "\0" for entry in HEADERS + ENTRIES).encode("utf-8")
+FILES_STATUS = [" M src/café.py", "R  1 M. looks like an entry -> new name.txt", "C  docs/index.rst -> docs/copy.rst",
+                "UU conflict.txt", "?? 日本語/"]
+
+
+def splits(data):
+    """ Yield <data> split into chunks in all the awkward ways: at every position, and in chunks of 1 to 7 bytes. """
+    for position in range(len(data) + 1):
+        yield [data[:position], data[position:]]
+    for size in range(1, 8):
+        yield [data[start:start + size] for start in range(0, len(data), size)]
+
+
+def test_iter_entries_at_any_chunk_boundary():
+    # Chunk boundaries fall at and next to every NUL, and inside every multi-byte character:
+    assert "é".encode("utf-8") in OUTPUT and "日".encode("utf-8") in OUTPUT
+    for chunks in splits(OUTPUT):
+        assert list(porcelain.iter_entries(chunks)) == HEADERS + ENTRIES
+
+
+def test_iter_entries_empty_chunks_and_missing_final_nul():
+    assert list(porcelain.iter_entries([])) == []
+    assert list(porcelain.iter_entries([b"", b"a\0b", b"", b"\0", b""])) == ["a", "b"]
+    assert list(porcelain.iter_entries([b"a\0", b"b"])) == ["a", "b"]
+
+
+def test_iter_chunks():
+    assert b"".join(porcelain.iter_chunks(io.BytesIO(OUTPUT), size=5)) == OUTPUT
+
+
+def test_parse_status_at_any_chunk_boundary():
+    for chunks in splits(OUTPUT):
+        info = porcelain.parse_status(porcelain.iter_entries(chunks))
+        assert info["files_status"] == FILES_STATUS
+        assert info["nfiles"] == 5
+        assert info["changes"] == {"staged": 2, "modified": 1, "deleted": 0, "untracked": 1, "conflicted": 1}
+        assert (info["local_branch"], info["remote"], info["remote_branch"]) == ("feature/x", "origin", "feature/x")
+        assert (info["ahead"], info["behind"], info["ahead_behind"]) == (2, 3, "ahead 2, behind 3")
+        assert info["complete"]
+
+
+@pytest.mark.parametrize("max_files", [0, 1, 2, 3])
+def test_renames_that_are_not_listed_are_counted(max_files):
+    # The original path of a rename must also be skipped when the rename is not listed:
+    info = porcelain.parse_status(HEADERS + ENTRIES, max_files=max_files)
+    assert info["files_status"] == FILES_STATUS[:max_files]
+    assert info["nfiles"] == 5 and info["changes"]["staged"] == 2
+
+
+def test_ignore_untracked_and_quick():
+    info = porcelain.parse_status(HEADERS + ENTRIES, ignore_untracked=True)
+    assert info["nfiles"] == 4 and info["changes"]["untracked"] == 0
+    info = porcelain.parse_status(HEADERS + ENTRIES, quick=True)
+    assert info["files_status"] == FILES_STATUS[:1] and info["nfiles"] == 1 and not info["complete"]
+    assert info["ahead_behind"] == "ahead 2, behind 3"  # The headers come first, so they are all read.
+    info = porcelain.parse_status(HEADERS[:2], quick=True)
+    assert info["files_status"] == [] and info["complete"]
+
+
+@pytest.mark.parametrize("headers, expected", [
+    # (local_branch, remote, remote_branch, ahead, behind, ahead_behind):
+    (["# branch.head main", "# branch.upstream origin/main", "# branch.ab +0 -0"],
+     ("main", "origin", "main", 0, 0, None)),
+    (["# branch.head main", "# branch.upstream origin/main", "# branch.ab +1 -0"],
+     ("main", "origin", "main", 1, 0, "ahead 1")),
+    (["# branch.head main", "# branch.upstream origin/main", "# branch.ab +0 -4"],
+     ("main", "origin", "main", 0, 4, "behind 4")),
+    # No "# branch.ab" header: the upstream branch is gone.
+    (["# branch.head main", "# branch.upstream origin/main"], ("main", "origin", "main", None, None, "gone")),
+    # No "# branch.upstream" header (and then no "# branch.ab"): no upstream configured.
+    (["# branch.head main"], ("main", None, None, None, None, None)),
+    (["# branch.oid (initial)", "# branch.head main"], ("main", None, None, None, None, None)),
+    (["# branch.head (detached)"], (None, None, None, None, None, None)),
+    ([], (None, None, None, None, None, None)),
+    # Upstream in the same repository (`git branch -u main`), and a remote branch name with "/":
+    (["# branch.head x", "# branch.upstream main", "# branch.ab +0 -0"], ("x", ".", "main", 0, 0, None)),
+    (["# branch.head user/fix.v2", "# branch.upstream up/user/fix.v2", "# branch.ab +0 -0"],
+     ("user/fix.v2", "up", "user/fix.v2", 0, 0, None)),
+])
+def test_branch_headers(headers, expected):
+    info = porcelain.parse_status(headers + ["? new.txt"])
+    keys = ("local_branch", "remote", "remote_branch", "ahead", "behind", "ahead_behind")
+    assert tuple(info[key] for key in keys) == expected
+    assert info["files_status"] == ["?? new.txt"]
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+def test_parse_git_output(tmp_path, monkeypatch):
+    """ Parse the output of a real `git status`, with a staged rename, read in tiny chunks. """
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("GIT_CONFIG_NOSYSTEM", "1")
+    for var in ("GIT_AUTHOR_NAME", "GIT_COMMITTER_NAME"):
+        monkeypatch.setenv(var, "Test")
+    for var in ("GIT_AUTHOR_EMAIL", "GIT_COMMITTER_EMAIL"):
+        monkeypatch.setenv(var, "test@example.com")
+    for args in (["init", "-q"], ["commit", "-q", "--allow-empty", "-m", "Initial commit"]):
+        subprocess.run(["git"] + args, cwd=str(tmp_path), check=True)
+    (tmp_path / "old name.txt").write_text("content\n")
+    subprocess.run(["git", "add", "old name.txt"], cwd=str(tmp_path), check=True)
+    subprocess.run(["git", "commit", "-q", "-m", "Add file"], cwd=str(tmp_path), check=True)
+    subprocess.run(["git", "mv", "old name.txt", "new name.txt"], cwd=str(tmp_path), check=True)
+    (tmp_path / "untracked é.txt").write_text("new\n")
+
+    process = subprocess.Popen(porcelain.status_command(), cwd=str(tmp_path), stdout=subprocess.PIPE)
+    info = porcelain.parse_status(porcelain.iter_entries(porcelain.iter_chunks(process.stdout, size=3)))
+    process.wait()
+    assert info["files_status"] == ["R  old name.txt -> new name.txt", "?? untracked é.txt"]
+    assert info["remote"] is None and info["ahead_behind"] is None
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Tests for the query server (query.py): what it does with an existing entry at the socket path.
+
+"""
+
+import socket
+import threading
+
+import pytest
+
+from git_status_checker import query
+
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="Unix domain sockets are not available")
+
+
+def make_server(socket_path):
+    return query.StatusServer(str(socket_path), {}, threading.Lock(), refresh=lambda gitrepo: None)
+
+
+def test_existing_file_is_not_removed(tmp_path):
+    notes = tmp_path / "notes.txt"
+    notes.write_text("important\n")
+    with pytest.raises(OSError, match="not a socket"):
+        make_server(notes).start()
+    assert notes.read_text() == "important\n"
+
+
+def test_existing_directory_is_not_removed(tmp_path):
+    directory = tmp_path / "dir"
+    directory.mkdir()
+    with pytest.raises(OSError, match="not a socket"):
+        make_server(directory).start()
+    assert directory.is_dir()
+
+
+def test_stale_socket_is_replaced(tmp_path):
+    socket_path = str(tmp_path / "stale.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(socket_path)
+    stale.close()  # Like a server that did not exit cleanly: the socket file is left, but nothing listens.
+
+    server = make_server(socket_path)
+    server.start()
+    try:
+        assert query.ping(socket_path)
+        with pytest.raises(OSError, match="already serving"):
+            make_server(socket_path).start()
+    finally:
+        server.close()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Tests for the cost model and the adaptive scheduler (scheduler.py).
+
+"""
+
+import json
+import time
+
+from git_status_checker import scheduler
+
+
+def test_costs_do_not_depend_on_working_directory(tmp_path, monkeypatch):
+    (tmp_path / "tree").mkdir()
+    filename = str(tmp_path / "repo-costs.json")
+    monkeypatch.chdir(tmp_path)
+    costs = scheduler.CostModel(filename)
+    costs.update("tree/repo", 2.0)
+    costs.save()
+
+    monkeypatch.chdir(tmp_path / "tree")
+    costs = scheduler.CostModel(filename)
+    costs.load()
+    assert costs.cost("repo") == costs.cost("./repo") == 2.0
+    assert costs.order(["other", "repo", "cheap"]) == ["other", "cheap", "repo"]  # Unknown costs first.
+
+
+def test_old_costs_are_dropped(tmp_path):
+    filename = str(tmp_path / "repo-costs.json")
+    now = time.time()
+    with open(filename, "w") as fp:
+        json.dump({"/old": [1.0, now - 2 * scheduler.MAX_AGE], "/recent": [1.0, now - 60],
+                   "/old-format": 1.0}, fp)
+    costs = scheduler.CostModel(filename)
+    costs.load()
+    costs.update("/new", 1.0)
+    costs.save()
+    with open(filename) as fp:
+        assert sorted(json.load(fp)) == ["/new", "/old-format", "/recent"]
+
+
+def test_wait_before_start_is_not_counted():
+    costs = scheduler.CostModel()
+    waits = []
+
+    def before_start(gitrepo):
+        time.sleep(0.2)  # E.g. waiting for a free fetch slot.
+        waits.append(gitrepo)
+        return gitrepo != "/skipped"
+
+    sched = scheduler.Scheduler(costs, max_jobs=2)
+    futures = sched.submit_all(lambda gitrepo, value: value, ["/a", "/skipped"], before_start=before_start, value=1)
+    sched.shutdown()
+    assert futures["/a"].result() == 1 and futures["/skipped"].result() is None
+    assert sorted(waits) == ["/a", "/skipped"]
+    assert costs.cost("/a") < 0.1
+    assert costs.cost("/skipped") is None
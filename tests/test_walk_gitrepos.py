@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Tests for walk_gitrepos(), with and without an executor (--scan-jobs), using a synthetic directory tree.
+
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from git_status_checker.git_status_checker import walk_gitrepos
+
+
+def make_tree(width, depth, prefix="/base"):
+    """ Return dict {dirpath: (is_repo, subdirs)} for a tree <width> directories wide and <depth> levels deep.
+    Every third directory is a repository (and still has sub-directories, like a repository with submodules).
+    """
+    tree = {}
+    level = [prefix]
+    for _ in range(depth):
+        next_level = []
+        for dirpath in level:
+            subdirs = ["d%s" % i for i in range(width)]
+            tree[dirpath] = (len(tree) % 3 == 0, subdirs)
+            next_level += [dirpath + "/" + name for name in subdirs]
+        level = next_level
+    for dirpath in level:
+        tree[dirpath] = (len(tree) % 3 == 0, [])
+    return tree
+
+
+@pytest.mark.parametrize("width, depth", [(1, 30), (3, 5), (300, 1), (40, 2)])
+@pytest.mark.parametrize("lookahead", [1, 4, 32])
+def test_same_order_as_serial_walk(width, depth, lookahead):
+    tree = dict(make_tree(width, depth, "/a"), **make_tree(2, 2, "/b"))
+    serial = list(walk_gitrepos(["/a", "/b"], tree.__getitem__))
+    assert serial  # Sanity check of the test itself.
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        concurrent = list(walk_gitrepos(["/a", "/b"], tree.__getitem__, executor=executor, lookahead=lookahead))
+    assert concurrent == serial
+
+
+def test_listing_tasks_are_bounded():
+    tree = make_tree(30, 2)
+    release = threading.Event()
+    submitted = []
+
+    def list_dir(dirpath):
+        if dirpath != "/base":
+            release.wait()
+        return tree[dirpath]
+
+    class RecordingExecutor(ThreadPoolExecutor):
+        def submit(self, fn, *args, **kwargs):
+            submitted.append(args)
+            return super().submit(fn, *args, **kwargs)
+
+    with RecordingExecutor(max_workers=4) as executor:
+        walk = walk_gitrepos(["/base"], list_dir, executor=executor, lookahead=10)
+        result = []
+        thread = threading.Thread(target=lambda: result.extend(walk))
+        thread.start()
+        try:
+            thread.join(0.5)
+            # While no listing can complete, only <lookahead> are submitted (after the basedir itself):
+            assert len(submitted) == 1 + 10
+        finally:
+            release.set()
+            thread.join()
+    assert result == list(walk_gitrepos(["/base"], tree.__getitem__))
+    assert len(submitted) > len(tree) // 2  # Most directories are still listed ahead.
+
+
+def test_error_is_raised_from_walk():
+    tree = make_tree(5, 3)
+
+    def list_dir(dirpath):
+        if dirpath == "/base/d2/d3":
+            raise OSError("cannot list %s" % dirpath)
+        return tree[dirpath]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        with pytest.raises(OSError):
+            list(walk_gitrepos(["/base"], list_dir, executor=executor))
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#    Copyright 2015 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#
+
+"""
+
+Tests for submodule discovery and checking (--submodules, worktrees.py), with submodules created by git.
+
+"""
+
+import shutil
+import subprocess
+
+import pytest
+
+from git_status_checker import worktrees
+from git_status_checker.git_status_checker import check_repo_status
+
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+
+
+@pytest.fixture(autouse=True)
+def git_environment(tmp_path, monkeypatch):
+    """ Isolate git from the user's and system's git config. """
+    home = tmp_path / "home"
+    home.mkdir()
+    monkeypatch.setenv("HOME", str(home))
+    monkeypatch.setenv("GIT_CONFIG_NOSYSTEM", "1")
+    for var in ("XDG_CONFIG_HOME", "GIT_CONFIG_GLOBAL", "GIT_DIR", "GIT_WORK_TREE"):
+        monkeypatch.delenv(var, raising=False)
+    for var in ("GIT_AUTHOR_NAME", "GIT_COMMITTER_NAME"):
+        monkeypatch.setenv(var, "Test")
+    for var in ("GIT_AUTHOR_EMAIL", "GIT_COMMITTER_EMAIL"):
+        monkeypatch.setenv(var, "test@example.com")
+
+
+def git(cwd, *args):
+    # Local (file) submodule URLs are disallowed by default since git 2.38.1.
+    return subprocess.run(["git", "-c", "protocol.file.allow=always"] + list(args), cwd=str(cwd), check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout.decode()
+
+
+@pytest.fixture
+def superproject(tmp_path):
+    """ Return a clone of a superproject, with its submodule "lib" checked out by `git submodule update`. """
+    git(tmp_path, "init", "-q", "--bare", "lib.git")
+    git(tmp_path, "clone", "-q", "lib.git", "lib-work")
+    git(tmp_path / "lib-work", "commit", "-q", "--allow-empty", "-m", "Library")
+    git(tmp_path / "lib-work", "push", "-q", "origin", "HEAD")
+    git(tmp_path, "init", "-q", "--bare", "app.git")
+    git(tmp_path, "clone", "-q", "app.git", "app-work")
+    git(tmp_path / "app-work", "submodule", "add", "-q", str(tmp_path / "lib.git"), "lib")
+    git(tmp_path / "app-work", "commit", "-q", "-m", "Add submodule")
+    git(tmp_path / "app-work", "push", "-q", "origin", "HEAD")
+    git(tmp_path, "clone", "-q", "app.git", "app")
+    git(tmp_path / "app", "submodule", "update", "-q", "--init")
+    return tmp_path / "app"
+
+
+def test_submodules_are_found(superproject):
+    found = list(worktrees.related_repos(str(superproject), submodules=True))
+    assert [path.replace("\\", "/") for path in found] == [str(superproject), str(superproject) + "/lib"]
+
+
+def test_detached_submodule_is_clean(superproject):
+    submodule = str(superproject / "lib")
+    assert "# branch.head (detached)" in git(submodule, "status", "--porcelain=v2", "--branch")
+    assert not any(check_repo_status(str(superproject)))
+    assert not any(check_repo_status(submodule))
+
+    # A commit on the detached HEAD that is not on the remote must still be pushed:
+    git(submodule, "commit", "-q", "--allow-empty", "-m", "Local change")
+    assert check_repo_status(submodule)[1]